@@ -0,0 +1,152 @@
+"""
+Deciding when a game is over.
+
+An Adjudicator follows the Position a game is played on and counts how often each
+position has occurred, by Zobrist key. Then a repetition is one dict lookup, not a
+walk back through the moves. Together with the halfmove clock the Position
+already keeps, every rule that ends a game takes the same time however long the
+game has gone on. That makes it cheap enough for the engine to call at every node
+of its search, as well as for Game, tournament.py and replay.py after each move.
+"""
+
+from bitboard import WHITE, BLACK, PAWN, BISHOP, ROOK, QUEEN, KING, popcount
+
+DRAW = "1/2-1/2"
+
+# The dark squares, to tell bishops on them from bishops on light squares
+DARK_SQUARES = sum(1 << sq for sq in range(64) if (sq >> 3 ^ sq) & 1)
+
+
+def insufficient_material(position):
+    """
+    Whether no series of legal moves can end in mate: king against king, a king
+    and one minor piece against a king, or kings and bishops that all stand on
+    squares of one colour. Positions such as a knight against a knight, or
+    bishops on opposite colours, are left to be played out, as a mate can still
+    happen there.
+    """
+    bitboards = position.bitboards
+    bishops = 0
+    for color in (WHITE, BLACK):
+        base = color << 3
+        if bitboards[base | PAWN] | bitboards[base | ROOK] | bitboards[base | QUEEN]:
+            return False
+        bishops |= bitboards[base | BISHOP]
+    kings = bitboards[WHITE << 3 | KING] | bitboards[BLACK << 3 | KING]
+    pieces = (position.occupied[WHITE] | position.occupied[BLACK]) ^ kings
+    if popcount(pieces) <= 1:
+        return True
+    # With two pieces or more, only bishops that are all on one colour cannot mate
+    return pieces == bishops and (
+        not bishops & DARK_SQUARES or not bishops & ~DARK_SQUARES
+    )
+
+
+class Adjudicator:
+    def __init__(self, position, tablebase=None):
+        """
+        Follow a game from a position.
+        :param position: the Position the game is played on; the moves already
+            pushed on it count towards repetitions
+        :param tablebase: an optional Tablebase that ends a game as soon as it has
+            the position
+        """
+        self.position = position
+        self.tablebase = tablebase
+        # The undo records hold the key before each move
+        counts = {}
+        for undo in position.undo_stack:
+            counts[undo >> 32] = counts.get(undo >> 32, 0) + 1
+        counts[position.key] = counts.get(position.key, 0) + 1
+        self.counts = counts
+        self.saved_counts = []  # The counts put aside by push_null
+
+    def record(self):
+        """Count the position after a move played on it directly, e.g. by Board.push"""
+        key = self.position.key
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def forget(self):
+        """Stop counting the position, before the move that led to it is taken back"""
+        key = self.position.key
+        count = self.counts[key] - 1
+        if count:
+            self.counts[key] = count
+        else:
+            del self.counts[key]
+
+    def push(self, move):
+        """Play a move on the position and count the position it leads to"""
+        self.position.push(move)
+        key = self.position.key
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def pop(self):
+        """
+        Take back the last move played with push.
+        :return: the move that was taken back
+        """
+        self.forget()
+        return self.position.pop()
+
+    def push_null(self):
+        """
+        Pass the turn, for null-move pruning. No position from before a null move
+        counts as repeated after it.
+        """
+        self.saved_counts.append(self.counts)
+        self.position.push_null()
+        self.counts = {self.position.key: 1}
+
+    def pop_null(self):
+        """Take back a null move played with push_null"""
+        self.position.pop_null()
+        self.counts = self.saved_counts.pop()
+
+    def repetitions(self):
+        """How many times the current position has occurred, this time included"""
+        return self.counts.get(self.position.key, 0)
+
+    def is_draw(self, repetitions=3):
+        """
+        Whether the fifty-move rule, a repetition or the material left makes the
+        position a draw. Checkmate and stalemate are not looked for, as they take
+        generating the moves.
+        :param repetitions: how many occurrences of a position make a draw; the
+            search counts the first repetition
+        """
+        position = self.position
+        return (
+            position.halfmove_clock >= 100
+            or self.counts.get(position.key, 0) >= repetitions
+            or insufficient_material(position)
+        )
+
+    def result(self, moves=None):
+        """
+        Decide whether the game is over.
+        :param moves: the legal moves of the position, when they are known already
+        :return: None while the game goes on, otherwise (result, termination),
+            where result is written as in PGN and termination is one of
+            "checkmate", "stalemate", "fifty-move rule", "threefold repetition",
+            "insufficient material" and "tablebase"
+        """
+        position = self.position
+        if moves is None:
+            moves = position.legal_moves()
+        if not moves:
+            if not position.in_check():
+                return DRAW, "stalemate"
+            return ("0-1" if position.side == WHITE else "1-0"), "checkmate"
+        if position.halfmove_clock >= 100:
+            return DRAW, "fifty-move rule"
+        if self.counts.get(position.key, 0) >= 3:
+            return DRAW, "threefold repetition"
+        if insufficient_material(position):
+            return DRAW, "insufficient material"
+        if self.tablebase is not None:
+            found = self.tablebase.probe(position)
+            if found is not None:
+                wdl = found[0] if position.side == WHITE else -found[0]
+                return {1: "1-0", 0: DRAW, -1: "0-1"}[wdl], "tablebase"
+        return None
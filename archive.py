@@ -0,0 +1,290 @@
+"""
+Binary game archives.
+
+An archive holds games far more compactly than PGN and reads them without any
+parsing. Every move is the packed move itself in 16 bits: 6 for the from square,
+6 for the to square and 4 for the promotion. Each game is a small header (the
+number of plies, the result and the length of its tags), its tags as
+NUL-separated UTF-8 and then its moves. An index of the offset of every game
+follows the games, so game K is found without reading the ones before it. The file
+is memory-mapped, so opening an archive reads nothing up front and scanning one
+only touches the pages it needs.
+
+Archives are written from PGN with pack and back with unpack. replay plays a
+game's moves on a Board or Position one push at a time.
+
+Usage:
+    python archive.py pack games.pgn --out games.cga
+    python archive.py unpack games.cga --out games.pgn
+    python archive.py show games.cga --game 1234
+    python archive.py scan games.cga
+"""
+
+import argparse
+import mmap
+import struct
+import sys
+import time
+from array import array
+
+from bitboard import Position, START_FEN, move_to_uci
+from pgn import PgnGame, RESULTS, read_games, write_games
+
+MAGIC = b"CGA1"
+HEADER = struct.Struct("<4sIQ")  # magic, number of games, offset of the index
+GAME = struct.Struct("<HBH")  # plies, index of the result in RESULTS, tags length
+OFFSET = struct.Struct("<Q")
+MAX_PLIES = 0xFFFF
+
+
+class ArchiveWriter:
+    def __init__(self, path):
+        """
+        Start writing an archive. Games are added with add or add_game, and the
+        index is written by close.
+        :param path: the file to write
+        """
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, 0, 0))
+        self.offsets = array("Q")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, moves, headers=None, result="*"):
+        """
+        Add a game.
+        :param moves: the packed moves, played from the standard position or the
+            one in the FEN tag
+        :param headers: the tag pairs, as a dict
+        :param result: "1-0", "0-1", "1/2-1/2" or "*"
+        :return: the game's index in the archive
+        :raises ValueError: if the game has more than MAX_PLIES moves
+        """
+        if len(moves) > MAX_PLIES:
+            raise ValueError(f"Too many moves for an archive: {len(moves)}")
+        tags = "\0".join(
+            f"{name}\0{value}"
+            for name, value in (headers or {}).items()
+            if name != "Result"
+        ).encode()
+        self.offsets.append(self.file.tell())
+        self.file.write(GAME.pack(len(moves), RESULTS.index(result), len(tags)))
+        self.file.write(tags)
+        self.file.write(struct.pack(f"<{len(moves)}H", *moves))
+        return len(self.offsets) - 1
+
+    def add_game(self, game):
+        """
+        Add a PgnGame, parsing its moves against the board.
+        :return: the game's index in the archive
+        :raises ValueError: at the first illegal or unreadable move
+        """
+        moves = [move for _, move in game.moves()]
+        return self.add(moves, game.headers, game.result)
+
+    def close(self):
+        """Write the index and the header, and close the file"""
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        if sys.byteorder != "little":
+            self.offsets.byteswap()
+        self.offsets.tofile(self.file)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, len(self.offsets), index_offset))
+        self.file.close()
+
+
+class ArchivedGame:
+    __slots__ = ("headers", "moves", "result")
+
+    def __init__(self, headers, moves, result):
+        self.headers = headers
+        self.moves = moves  # Packed moves, as a tuple
+        self.result = result
+
+    def starting_position(self):
+        """The position before the first move, from the FEN tag if there is one"""
+        return Position.from_fen(self.headers.get("FEN", START_FEN))
+
+    def to_pgn_game(self):
+        """The game as a PgnGame, its moves written in SAN"""
+        return PgnGame.from_moves(
+            self.moves, self.headers, self.headers.get("FEN"), self.result
+        )
+
+
+class Archive:
+    def __init__(self, path):
+        """
+        Open an archive.
+        :param path: the archive file
+        :raises ValueError: if the file is not an archive
+        """
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.index_offset = HEADER.unpack_from(self.data)
+        if magic != MAGIC or self.index_offset + self.count * OFFSET.size > len(
+            self.data
+        ):
+            self.close()
+            raise ValueError(f"Not a game archive: {path!r}")
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def offset(self, index):
+        """Where game index starts in the file"""
+        if not 0 <= index < self.count:
+            raise IndexError(f"No game {index} in an archive of {self.count}")
+        return OFFSET.unpack_from(self.data, self.index_offset + index * OFFSET.size)[0]
+
+    def read(self, offset):
+        """
+        Read the game starting at an offset.
+        :return: (ArchivedGame, the offset of the game after it)
+        """
+        plies, result, tags_length = GAME.unpack_from(self.data, offset)
+        start = offset + GAME.size
+        headers = {}
+        if tags_length:
+            fields = self.data[start : start + tags_length].decode().split("\0")
+            headers = dict(zip(fields[::2], fields[1::2]))
+        moves = struct.unpack_from(f"<{plies}H", self.data, start + tags_length)
+        game = ArchivedGame(headers, moves, RESULTS[result])
+        return game, start + tags_length + 2 * plies
+
+    def moves(self, index):
+        """The packed moves of a game, without reading its tags"""
+        offset = self.offset(index)
+        plies, _, tags_length = GAME.unpack_from(self.data, offset)
+        return struct.unpack_from(
+            f"<{plies}H", self.data, offset + GAME.size + tags_length
+        )
+
+    def __getitem__(self, index):
+        """Read game index as an ArchivedGame"""
+        return self.read(self.offset(index))[0]
+
+    def __iter__(self):
+        """Every game in order, read sequentially rather than through the index"""
+        offset = HEADER.size
+        for _ in range(self.count):
+            game, offset = self.read(offset)
+            yield game
+
+    def replay(self, index, board=None):
+        """
+        Play a game's moves one at a time.
+        :param index: the game to play
+        :param board: a Board, set up from the game's starting position here, or
+            None to play on a new Position
+        :return: a generator yielding each move once it has been pushed on the
+            board, or on the Position when no board was given
+        """
+        game = self[index]
+        if board is None:
+            board = game.starting_position()
+        else:
+            board.load_fen(game.headers.get("FEN", START_FEN))
+        for move in game.moves:
+            board.push(move)
+            yield move
+
+
+def pack(sources, path):
+    """
+    Write PGN collections to an archive. A game with an illegal move keeps the
+    moves before it.
+    :param sources: PGN file paths
+    :param path: the archive to write
+    :return: a dict with the games written and how many had an illegal move
+    """
+    games = errors = 0
+    with ArchiveWriter(path) as writer:
+        for source in sources:
+            for game in read_games(source):
+                moves = []
+                try:
+                    for _, move in game.moves():
+                        moves.append(move)
+                except ValueError:
+                    errors += 1
+                writer.add(moves[:MAX_PLIES], game.headers, game.result)
+                games += 1
+    return {"games": games, "errors": errors}
+
+
+def unpack(path, out):
+    """
+    Write an archive back to PGN.
+    :return: the number of games written
+    """
+    with Archive(path) as archive:
+        return write_games(out, (game.to_pgn_game() for game in archive))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert and read game archives")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_parser = commands.add_parser("pack", help="write PGN files to an archive")
+    pack_parser.add_argument("pgn", nargs="+", help="PGN files to read")
+    pack_parser.add_argument("--out", required=True, help="archive to write")
+    unpack_parser = commands.add_parser("unpack", help="write an archive as PGN")
+    unpack_parser.add_argument("archive", help="archive to read")
+    unpack_parser.add_argument("--out", required=True, help="PGN file to write")
+    show = commands.add_parser("show", help="print one game of an archive")
+    show.add_argument("archive", help="archive to read")
+    show.add_argument("--game", type=int, default=0, help="index of the game")
+    scan = commands.add_parser("scan", help="time reading every move")
+    scan.add_argument("archive", help="archive to read")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.command == "pack":
+        stats = pack(args.pgn, args.out)
+        print(
+            f"{stats['games']} games written to {args.out} in "
+            f"{time.perf_counter() - start:.2f}s, {stats['errors']} with an "
+            "illegal move"
+        )
+    elif args.command == "unpack":
+        count = unpack(args.archive, args.out)
+        print(f"{count} games written to {args.out}")
+    elif args.command == "show":
+        with Archive(args.archive) as archive:
+            game = archive[args.game]
+            for name, value in game.headers.items():
+                print(f"{name}: {value}")
+            print(" ".join(move_to_uci(move) for move in game.moves), game.result)
+    else:
+        games = moves = 0
+        with Archive(args.archive) as archive:
+            for game in archive:
+                games += 1
+                moves += len(game.moves)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{games} games, {moves:,} moves in {elapsed:.2f}s: "
+            f"{games / max(elapsed, 1e-9):,.0f} games/s, "
+            f"{moves / max(elapsed, 1e-9):,.0f} moves/s"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+Evaluate many positions at once with NumPy.
+
+Positions come in as an (N, 64) array of piece codes, laid out like
+Position.squares, or as (N, 12, 64) one-hot planes in PLANE_CODES order. Every
+term of evaluation.evaluate is computed for the whole batch with array operations,
+and the scores match it exactly, so results from the batch path and the search
+can be compared directly. NumPy is only needed by this module.
+
+Usage:
+    python batch_evaluation.py --count 1000000
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from bitboard import WHITE, BLACK, PAWN, PACKED_SIZE, iter_squares
+from piece_square import MIDDLEGAME_SCORES, ENDGAME_SCORES, PHASE_WEIGHTS, MAX_PHASE
+from evaluation import (
+    DOUBLED_PAWN,
+    ISOLATED_PAWN,
+    PASSED_PAWN,
+    PASSED_MASKS,
+    MOBILITY_WEIGHTS,
+    MOBILITY_MASKS,
+)
+
+# The piece code of each plane in the (N, 12, 64) layout: white pawn to king, then
+# black pawn to king
+PLANE_CODES = np.array(
+    [color << 3 | kind for color in (WHITE, BLACK) for kind in range(1, 7)],
+    dtype=np.int8,
+)
+
+CHUNK = 1 << 16  # Positions scored at a time, which bounds the temporary arrays
+
+
+def _matrix(masks):
+    """A (64, 64) 0/1 matrix whose row sq holds the squares in masks[sq]"""
+    matrix = np.zeros((64, 64), dtype=np.float32)
+    for sq, mask in enumerate(masks):
+        matrix[sq, list(iter_squares(mask))] = 1
+    return matrix
+
+
+SQUARES = np.arange(64)
+MIDDLEGAME_TABLE = np.array(MIDDLEGAME_SCORES, dtype=np.int32)
+ENDGAME_TABLE = np.array(ENDGAME_SCORES, dtype=np.int32)
+PHASE_TABLE = np.array(
+    [PHASE_WEIGHTS.get(code & 7, 0) for code in range(16)],
+    dtype=np.int32,
+)
+# PASSED_MATRICES[color] is transposed so enemy_pawns @ it counts the blockers
+PASSED_MATRICES = [_matrix(PASSED_MASKS[color]).T.copy() for color in (WHITE, BLACK)]
+# The weighted mobility matrices of every kind stacked, so one product covers them
+MOBILITY_KINDS = np.array(list(MOBILITY_WEIGHTS), dtype=np.int32)
+MOBILITY_MATRIX = np.concatenate(
+    [
+        weight * _matrix(MOBILITY_MASKS[kind])
+        for kind, weight in MOBILITY_WEIGHTS.items()
+    ]
+)
+# PASSED_BONUS[color][sq] is the passed pawn bonus for a pawn of that color on sq
+PASSED_BONUS = np.array(
+    [
+        [PASSED_PAWN[7 - sq // 8 if color == WHITE else sq // 8] for sq in range(64)]
+        for color in (WHITE, BLACK)
+    ],
+    dtype=np.int32,
+)
+
+
+def encode_positions(positions):
+    """
+    Stack positions into an (N, 64) array of piece codes.
+    :param positions: an iterable of Position
+    :return: the codes array and an (N,) array of the sides to move
+    """
+    squares, sides = bytearray(), bytearray()
+    for position in positions:
+        squares += position.squares
+        sides.append(position.side)
+    codes = np.frombuffer(bytes(squares), dtype=np.int8).reshape(-1, 64)
+    return codes, np.frombuffer(bytes(sides), dtype=np.int8)
+
+
+def decode_packed(data):
+    """
+    Unpack positions written by Position.pack, all at once.
+    :param data: a bytes-like object holding N packed positions back to back
+    :return: the (N, 64) codes array and an (N,) array of the sides to move
+    """
+    records = np.frombuffer(data, dtype=np.uint8).reshape(-1, PACKED_SIZE)
+    pairs = records[:, :32]
+    codes = np.empty((len(records), 64), dtype=np.int8)
+    codes[:, 0::2] = pairs & 15
+    codes[:, 1::2] = pairs >> 4
+    return codes, (records[:, 32] & 1).astype(np.int8)
+
+
+def planes_to_codes(planes):
+    """Turn (N, 12, 64) one-hot planes into an (N, 64) array of piece codes"""
+    planes = np.asarray(planes)
+    return np.einsum("npq,p->nq", planes.astype(np.int8), PLANE_CODES).astype(np.int8)
+
+
+def _pawn_structure(codes, color):
+    """The pawn structure score of one color, for each position"""
+    pawns = codes == (color << 3 | PAWN)
+    enemy_pawns = codes == ((color ^ 1) << 3 | PAWN)
+
+    counts = pawns.reshape(-1, 8, 8).sum(axis=1, dtype=np.int32)  # Pawns per file
+    neighbours = np.zeros_like(counts)
+    neighbours[:, 1:] += counts[:, :-1]
+    neighbours[:, :-1] += counts[:, 1:]
+    score = DOUBLED_PAWN * np.maximum(counts - 1, 0).sum(axis=1)
+    score += ISOLATED_PAWN * (counts * (neighbours == 0)).sum(axis=1)
+
+    blockers = enemy_pawns.astype(np.float32) @ PASSED_MATRICES[color]
+    passed = pawns & (blockers == 0)
+    score += (passed * PASSED_BONUS[color]).sum(axis=1)
+    return score
+
+
+def _mobility(codes, color):
+    """The mobility proxy score of one color, for each position"""
+    free = ((codes == 0) | (codes >> 3 != color)).astype(np.float32)
+    pieces = codes[:, None, :] == (color << 3 | MOBILITY_KINDS)[:, None]
+    reach = pieces.reshape(len(codes), -1).astype(np.float32) @ MOBILITY_MATRIX
+    # Every count is a small whole number, which float32 holds exactly
+    return (reach * free).sum(axis=1).astype(np.int32)
+
+
+def _evaluate_chunk(codes):
+    codes = codes.astype(np.int32)
+    middlegame = MIDDLEGAME_TABLE[codes, SQUARES].sum(axis=1)
+    endgame = ENDGAME_TABLE[codes, SQUARES].sum(axis=1)
+    phase = np.minimum(PHASE_TABLE[codes].sum(axis=1), MAX_PHASE)
+    # Floor division, like taper, so negative scores round the same way
+    score = (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+    score += _pawn_structure(codes, WHITE) - _pawn_structure(codes, BLACK)
+    score += _mobility(codes, WHITE) - _mobility(codes, BLACK)
+    return score
+
+
+def evaluate_batch(boards, sides=None):
+    """
+    Evaluate a batch of positions.
+    :param boards: an (N, 64) array of piece codes or (N, 12, 64) planes
+    :param sides: the side to move in each position, or None for scores from
+        white's point of view
+    :return: an (N,) int32 array of scores in centipawns, for the side to move
+        when sides are given, as evaluation.evaluate returns them
+    """
+    boards = np.asarray(boards)
+    codes = planes_to_codes(boards) if boards.ndim == 3 else boards
+    scores = np.concatenate(
+        [_evaluate_chunk(codes[i : i + CHUNK]) for i in range(0, len(codes), CHUNK)]
+        or [np.zeros(0, dtype=np.int32)]
+    )
+    if sides is not None:
+        scores = np.where(np.asarray(sides) == WHITE, scores, -scores)
+    return scores.astype(np.int32)
+
+
+def main(argv=None):
+    import random
+
+    from bitboard import Position, START_FEN
+    from evaluation import evaluate
+
+    parser = argparse.ArgumentParser(description="Time batch evaluation")
+    parser.add_argument("--count", type=int, default=1000000, help="positions")
+    parser.add_argument("--check", type=int, default=2000, help="positions checked")
+    args = parser.parse_args(argv)
+
+    # A pool of positions from random games, repeated up to the requested count
+    rng = random.Random(1)
+    positions = []
+    while len(positions) < min(args.count, 10000):
+        position = Position.from_fen(START_FEN)
+        for _ in range(rng.randrange(10, 120)):
+            moves = position.legal_moves()
+            if not moves:
+                break
+            position.push(rng.choice(moves))
+            positions.append(position.copy())
+    packed = b"".join(position.pack() for position in positions)
+    packed = (packed * (args.count // len(positions) + 1))[: args.count * PACKED_SIZE]
+
+    start = time.perf_counter()
+    codes, sides = decode_packed(packed)
+    scores = evaluate_batch(codes, sides)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(scores):,} positions in {elapsed:.2f}s, "
+        f"{len(scores) / elapsed:,.0f} positions/s"
+    )
+
+    checked = positions[: args.check]
+    mismatches = sum(
+        evaluate(position) != score for position, score in zip(checked, scores)
+    )
+    print(f"checked {len(checked)} against the scalar evaluation: {mismatches} differ")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1164 @@
+"""
+Bitboard move generation backend.
+
+Squares are numbered row * 8 + col, so square 0 is the top-left corner of
+Board.board (a8) and square 63 is the bottom-right (h1). Bit n of a bitboard is
+set when square n is in the set. This module does not import pygame, so it can be
+used by analysis tools that never open a window.
+"""
+
+import struct
+
+from zobrist import PIECE_KEYS, CASTLING_KEYS, EP_KEYS, SIDE_KEY
+from piece_square import MIDDLEGAME_SCORES, ENDGAME_SCORES, PHASE_SCORES
+
+# Colors and piece kinds. A piece code is color << 3 | kind, which keeps every
+# piece in a nibble and leaves 0 free to mean an empty square.
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+EMPTY = 0
+
+PIECE_SYMBOLS = {PAWN: "p", KNIGHT: "n", BISHOP: "b", ROOK: "r", QUEEN: "q", KING: "k"}
+SYMBOL_KINDS = {symbol: kind for kind, symbol in PIECE_SYMBOLS.items()}
+COLOR_NAMES = {WHITE: "w", BLACK: "b"}
+NAME_COLORS = {"w": WHITE, "b": BLACK}
+
+# Packed position: the squares two to a byte, then side and castling rights, the
+# en passant square plus one, the halfmove clock and the fullmove number
+PACKED_FORMAT = struct.Struct("<32sBBBH")
+PACKED_SIZE = PACKED_FORMAT.size
+
+# Castling right bits
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+
+FULL = (1 << 64) - 1
+FILE_A = sum(1 << (row * 8) for row in range(8))
+FILE_H = FILE_A << 7
+NOT_FILE_A = FULL ^ FILE_A
+NOT_FILE_H = FULL ^ FILE_H
+ROWS = [0xFF << (row * 8) for row in range(8)]
+
+# Pawns that can still make a double step, and the rows they promote on
+PAWN_START_ROW = {WHITE: ROWS[6], BLACK: ROWS[1]}
+PROMOTION_ROW = {WHITE: ROWS[0], BLACK: ROWS[7]}
+
+# Castling squares: king start, king destination, rook start, rook destination,
+# the squares that must be empty and the squares the king passes through
+CASTLING = {
+    WHITE_KINGSIDE: (60, 62, 63, 61, (1 << 61) | (1 << 62), (60, 61, 62)),
+    WHITE_QUEENSIDE: (60, 58, 56, 59, (1 << 57) | (1 << 58) | (1 << 59), (60, 59, 58)),
+    BLACK_KINGSIDE: (4, 6, 7, 5, (1 << 5) | (1 << 6), (4, 5, 6)),
+    BLACK_QUEENSIDE: (4, 2, 0, 3, (1 << 1) | (1 << 2) | (1 << 3), (4, 3, 2)),
+}
+CASTLING_FOR = {
+    WHITE: (WHITE_KINGSIDE, WHITE_QUEENSIDE),
+    BLACK: (BLACK_KINGSIDE, BLACK_QUEENSIDE),
+}
+
+# CASTLING_MASK[sq] is the set of castling rights that survive a move to or from sq
+CASTLING_MASK = [15] * 64
+for _right, (_king_sq, _, _rook_sq, _, _, _) in CASTLING.items():
+    CASTLING_MASK[_king_sq] &= ~_right
+    CASTLING_MASK[_rook_sq] &= ~_right
+
+# Rook move that goes with each castling king destination
+CASTLING_ROOKS = {
+    king_to: (rook_from, rook_to)
+    for _, king_to, rook_from, rook_to, _, _ in CASTLING.values()
+}
+
+# Squares the king passes through for each castling king destination
+CASTLING_PATHS = {king_to: path for _, king_to, _, _, _, path in CASTLING.values()}
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Promotion kinds in the order they are generated
+PROMOTIONS = (QUEEN, ROOK, BISHOP, KNIGHT)
+
+# Opposite rays are listed in pairs so each pair forms one line through the square
+ROOK_DIRECTIONS = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+BISHOP_DIRECTIONS = [(1, 1), (-1, -1), (1, -1), (-1, 1)]
+
+
+def square(row, col):
+    """Convert a (row, col) board position to a square number"""
+    return row * 8 + col
+
+
+def iter_squares(bb):
+    """
+    Yield the square of every set bit, lowest first.
+    :param bb: a bitboard
+    """
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def popcount(bb):
+    """Count the squares in a bitboard"""
+    return bin(bb).count("1")
+
+
+# ---------------------------------------------------------------------------
+# Precomputed attack tables
+# ---------------------------------------------------------------------------
+
+
+def _step_attacks(offsets):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        bb = 0
+        for dr, dc in offsets:
+            r, c = row + dr, col + dc
+            if 0 <= r < 8 and 0 <= c < 8:
+                bb |= 1 << (r * 8 + c)
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _step_attacks(
+    [(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)]
+)
+KING_ATTACKS = _step_attacks(
+    [(1, 1), (1, 0), (1, -1), (0, 1), (0, -1), (-1, 1), (-1, 0), (-1, -1)]
+)
+# PAWN_ATTACKS[color][sq] is the set of squares a pawn of that color on sq attacks
+PAWN_ATTACKS = [_step_attacks([(-1, -1), (-1, 1)]), _step_attacks([(1, -1), (1, 1)])]
+
+
+def _ray(sq, dr, dc):
+    """The squares from sq (exclusive) to the edge of the board in one direction"""
+    row, col = divmod(sq, 8)
+    squares = []
+    r, c = row + dr, col + dc
+    while 0 <= r < 8 and 0 <= c < 8:
+        squares.append(r * 8 + c)
+        r, c = r + dr, c + dc
+    return squares
+
+
+def _line_attacks(sq, rays, occ):
+    """Slide along each ray until the first occupied square, which is included"""
+    bb = 0
+    for ray in rays:
+        for target in ray:
+            bb |= 1 << target
+            if occ >> target & 1:
+                break
+    return bb
+
+
+def _subsets(mask):
+    """Every subset of the bits in mask, using the carry-rippler trick"""
+    sub = 0
+    while True:
+        yield sub
+        sub = (sub - mask) & mask
+        if not sub:
+            break
+
+
+def _slider_tables(directions):
+    """
+    Build the sliding attack lookup for one piece type.
+
+    Each square gets a mask of the squares whose occupancy can block it (the board
+    edge never blocks) and a dict from masked occupancy to the attack set. The two
+    lines through the square are enumerated separately and then combined, which is
+    much cheaper than walking the rays for every combined subset.
+    :return: (masks, tables), each indexed by square
+    """
+    masks, tables = [], []
+    for sq in range(64):
+        lines, square_mask = [], 0
+        for (dr, dc), (er, ec) in zip(directions[::2], directions[1::2]):
+            rays = [_ray(sq, dr, dc), _ray(sq, er, ec)]
+            # The last square of each ray is on the edge and cannot block anything
+            mask = sum(1 << target for ray in rays for target in ray[:-1])
+            lines.append({sub: _line_attacks(sq, rays, sub) for sub in _subsets(mask)})
+            square_mask |= mask
+        first, second = lines
+        table = {}
+        for sub_a, att_a in first.items():
+            for sub_b, att_b in second.items():
+                table[sub_a | sub_b] = att_a | att_b
+        masks.append(square_mask)
+        tables.append(table)
+    return masks, tables
+
+
+ROOK_MASKS, ROOK_TABLES = _slider_tables(ROOK_DIRECTIONS)
+BISHOP_MASKS, BISHOP_TABLES = _slider_tables(BISHOP_DIRECTIONS)
+
+
+def _line_tables():
+    """
+    BETWEEN[a][b] holds the squares strictly between two squares on a shared rank,
+    file or diagonal, and LINE[a][b] the whole line through both (0 when unaligned).
+    """
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    directions = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+    for sq in range(64):
+        for (dr, dc), (er, ec) in zip(directions[::2], directions[1::2]):
+            full = 1 << sq
+            for target in _ray(sq, dr, dc) + _ray(sq, er, ec):
+                full |= 1 << target
+            for dir_r, dir_c in ((dr, dc), (er, ec)):
+                passed = 0
+                for target in _ray(sq, dir_r, dir_c):
+                    between[sq][target] = passed
+                    line[sq][target] = full
+                    passed |= 1 << target
+    return between, line
+
+
+BETWEEN, LINE = _line_tables()
+
+
+def rook_attacks(sq, occ):
+    """Squares a rook on sq attacks given the occupancy bitboard occ"""
+    return ROOK_TABLES[sq][occ & ROOK_MASKS[sq]]
+
+
+def bishop_attacks(sq, occ):
+    """Squares a bishop on sq attacks given the occupancy bitboard occ"""
+    return BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]]
+
+
+def queen_attacks(sq, occ):
+    """Squares a queen on sq attacks given the occupancy bitboard occ"""
+    return (
+        ROOK_TABLES[sq][occ & ROOK_MASKS[sq]]
+        | BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]]
+    )
+
+
+# ---------------------------------------------------------------------------
+# Moves
+# ---------------------------------------------------------------------------
+
+# A move is packed into 16 bits: from square, to square and the promotion kind
+# (0 when the move is not a promotion). Castling and en passant are recognised
+# from the piece that moves, so they need no extra flags.
+
+
+def encode_move(from_sq, to_sq, promotion=0):
+    """Pack a move into a 16-bit int"""
+    return from_sq | to_sq << 6 | promotion << 12
+
+
+# A null move passes the turn, a8 to a8 is never a real move
+NULL_MOVE = 0
+
+
+def move_from(move):
+    return move & 63
+
+
+def move_to(move):
+    return move >> 6 & 63
+
+
+def move_promotion(move):
+    return move >> 12
+
+
+def square_name(sq):
+    """The algebraic name of a square, e.g. 0 -> "a8" and 63 -> "h1" """
+    return "abcdefgh"[sq & 7] + str(8 - (sq >> 3))
+
+
+def parse_square(name):
+    """
+    The square number of an algebraic square name.
+    :raises ValueError: if name is not a square such as "e4"
+    """
+    if len(name) != 2 or name[0] not in "abcdefgh" or name[1] not in "12345678":
+        raise ValueError(f"Invalid square: {name!r}")
+    return (8 - int(name[1])) * 8 + "abcdefgh".index(name[0])
+
+
+def move_to_uci(move):
+    """Write a move in long algebraic (UCI) form, e.g. "e2e4" or "a7a8q" """
+    text = square_name(move & 63) + square_name(move >> 6 & 63)
+    if move >> 12:
+        text += PIECE_SYMBOLS[move >> 12]
+    return text
+
+
+def parse_uci(text):
+    """
+    Parse a move in long algebraic (UCI) form into a packed move.
+    :raises ValueError: if text is not two squares and an optional promotion
+    """
+    if len(text) not in (4, 5) or (len(text) == 5 and text[4] not in "nbrq"):
+        raise ValueError(f"Invalid UCI move: {text!r}")
+    promotion = SYMBOL_KINDS[text[4]] if len(text) > 4 else 0
+    return encode_move(parse_square(text[:2]), parse_square(text[2:4]), promotion)
+
+
+# ---------------------------------------------------------------------------
+# Position
+# ---------------------------------------------------------------------------
+
+
+class Position:
+    """
+    A chess position held as one bitboard per piece code plus occupancy masks.
+
+    bitboards[code] is the bitboard for piece code color << 3 | kind, occupied[color]
+    holds all of one side's pieces and squares[sq] mirrors the board as piece codes,
+    one byte per square, so the piece on a square is a single lookup. pack turns a
+    position into PACKED_SIZE bytes for storing large numbers of them.
+
+    Like the Zobrist key, the material and piece-square sums of the evaluation
+    (middlegame, endgame), the game phase and a key of the pawns alone
+    (pawn_key) are kept up to date by push and pop, at the cost of the squares a
+    move touches.
+    """
+
+    __slots__ = (
+        "bitboards",
+        "occupied",
+        "squares",
+        "side",
+        "castling",
+        "ep_square",
+        "halfmove_clock",
+        "fullmove_number",
+        "key",
+        "middlegame",
+        "endgame",
+        "phase",
+        "pawn_key",
+        "move_stack",
+        "undo_stack",
+    )
+
+    def __init__(self):
+        self.bitboards = [0] * 16
+        self.occupied = [0, 0]
+        self.squares = bytearray(64)
+        self.side = WHITE
+        self.castling = 0
+        self.ep_square = -1  # Square a pawn may capture en passant onto, or -1
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.key = 0  # Zobrist key, see compute_key
+        # Evaluation terms, positive for white, see compute_scores
+        self.middlegame = 0
+        self.endgame = 0
+        self.phase = 0
+        self.pawn_key = 0
+        # Moves played with push, and the packed undo record of each one
+        self.move_stack = []
+        self.undo_stack = []
+
+    @classmethod
+    def from_board(cls, board, side=WHITE):
+        """
+        Build a position from a Board of Piece objects.
+        :param board: a Board whose board attribute is a list of lists of pieces
+        :param side: the color to move
+        :return: a new Position
+        """
+        position = cls()
+        position.side = side
+        for row in range(8):
+            for col in range(8):
+                piece = board.board[row][col]
+                if piece is not None:
+                    code = NAME_COLORS[piece.color] << 3 | SYMBOL_KINDS[piece.symbol]
+                    position.put_piece(code, row * 8 + col)
+
+        # A castling right survives as long as neither the king nor that rook moved
+        for right, (king_sq, _, rook_sq, _, _, _) in CASTLING.items():
+            king = board.board[king_sq // 8][king_sq % 8]
+            rook = board.board[rook_sq // 8][rook_sq % 8]
+            if (
+                king is not None
+                and king.symbol == "k"
+                and not king.has_moved
+                and rook is not None
+                and rook.symbol == "r"
+                and rook.color == king.color
+                and not rook.has_moved
+            ):
+                position.castling |= right
+        position.key = position.compute_key()
+        return position
+
+    @classmethod
+    def from_fen(cls, fen):
+        """
+        Build a position from a FEN string.
+        :param fen: the FEN record, the move counters may be left off
+        :return: a new Position
+        :raises ValueError: if the record is malformed, a side does not have
+            exactly one king, the side not to move is in check, or a castling
+            right or the en passant square does not fit the placement
+        """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError(f"Invalid FEN: {fen!r}")
+        rows = fields[0].split("/")
+        if len(rows) != 8:
+            raise ValueError(f"Invalid FEN board: {fields[0]!r}")
+
+        position = cls()
+        for row, text in enumerate(rows):
+            col = 0
+            for char in text:
+                if char.isdigit():
+                    col += int(char)
+                elif char.lower() in SYMBOL_KINDS and col < 8:
+                    color = WHITE if char.isupper() else BLACK
+                    position.put_piece(
+                        color << 3 | SYMBOL_KINDS[char.lower()], row * 8 + col
+                    )
+                    col += 1
+                else:
+                    raise ValueError(f"Invalid FEN board: {fields[0]!r}")
+            if col != 8:
+                raise ValueError(f"Invalid FEN board: {fields[0]!r}")
+
+        for color in (WHITE, BLACK):
+            if popcount(position.bitboards[color << 3 | KING]) != 1:
+                raise ValueError(f"Invalid FEN board, not one king each: {fields[0]!r}")
+
+        if fields[1] not in NAME_COLORS:
+            raise ValueError(f"Invalid FEN side to move: {fields[1]!r}")
+        position.side = NAME_COLORS[fields[1]]
+
+        # Each castling right needs its king and rook still on their squares
+        rights = fields[2]
+        if rights != "-" and (
+            len(set(rights)) != len(rights) or set(rights) - set("KQkq")
+        ):
+            raise ValueError(f"Invalid FEN castling rights: {rights!r}")
+        for char, right in zip("KQkq", CASTLING):
+            if char in rights:
+                king_sq, _, rook_sq, _, _, _ = CASTLING[right]
+                color = WHITE if char.isupper() else BLACK
+                if (
+                    position.squares[king_sq] != color << 3 | KING
+                    or position.squares[rook_sq] != color << 3 | ROOK
+                ):
+                    raise ValueError(f"Invalid FEN castling rights: {rights!r}")
+                position.castling |= right
+
+        # The en passant square is behind a pawn that has just made a double step
+        ep = fields[3]
+        if ep == "-":
+            position.ep_square = -1
+        else:
+            ep_row = 2 if position.side == WHITE else 5
+            if len(ep) != 2 or ep[0] not in "abcdefgh" or ep[1] != str(8 - ep_row):
+                raise ValueError(f"Invalid FEN en passant square: {ep!r}")
+            position.ep_square = ep_row * 8 + "abcdefgh".index(ep[0])
+
+        # The side to move could take the other king, which no game can reach
+        if position.is_attacked(position.king_square(position.side ^ 1), position.side):
+            raise ValueError(f"Invalid FEN, the side not to move is in check: {fen!r}")
+        if len(fields) > 4:
+            position.halfmove_clock = int(fields[4])
+        if len(fields) > 5:
+            position.fullmove_number = int(fields[5])
+        position.key = position.compute_key()
+        return position
+
+    def fen(self):
+        """Write the position as a FEN string"""
+        rows = []
+        for row in range(8):
+            text, empty = "", 0
+            for code in self.squares[row * 8 : row * 8 + 8]:
+                if code == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                symbol = PIECE_SYMBOLS[code & 7]
+                text += symbol.upper() if code >> 3 == WHITE else symbol
+            rows.append(text + (str(empty) if empty else ""))
+        castling = "".join(
+            c for c, right in zip("KQkq", CASTLING) if self.castling & right
+        )
+        ep = square_name(self.ep_square) if self.ep_square >= 0 else "-"
+        return (
+            f"{'/'.join(rows)} {COLOR_NAMES[self.side]} {castling or '-'} {ep} "
+            f"{self.halfmove_clock} {self.fullmove_number}"
+        )
+
+    @classmethod
+    def unpack(cls, data):
+        """
+        Build a position from the bytes written by pack.
+        :param data: PACKED_SIZE bytes
+        :return: a new Position, with no moves to pop
+        """
+        squares, flags, ep, halfmove, fullmove = PACKED_FORMAT.unpack(data)
+        position = cls()
+        for i, pair in enumerate(squares):
+            if pair & 15:
+                position.put_piece(pair & 15, 2 * i)
+            if pair >> 4:
+                position.put_piece(pair >> 4, 2 * i + 1)
+        position.side = flags & 1
+        position.castling = flags >> 1
+        position.ep_square = ep - 1
+        position.halfmove_clock = halfmove
+        position.fullmove_number = fullmove
+        position.key = position.compute_key()
+        return position
+
+    def pack(self):
+        """
+        Pack the position into PACKED_SIZE bytes. The move history is left out,
+        and the halfmove clock is capped at 255.
+        """
+        squares = self.squares
+        return PACKED_FORMAT.pack(
+            bytes(squares[i] | squares[i + 1] << 4 for i in range(0, 64, 2)),
+            self.side | self.castling << 1,
+            self.ep_square + 1,
+            min(self.halfmove_clock, 255),
+            min(self.fullmove_number, 0xFFFF),
+        )
+
+    def copy(self):
+        """Return an independent copy of this position"""
+        position = Position.__new__(Position)
+        position.bitboards = self.bitboards[:]
+        position.occupied = self.occupied[:]
+        position.squares = self.squares[:]
+        position.side = self.side
+        position.castling = self.castling
+        position.ep_square = self.ep_square
+        position.halfmove_clock = self.halfmove_clock
+        position.fullmove_number = self.fullmove_number
+        position.key = self.key
+        position.middlegame = self.middlegame
+        position.endgame = self.endgame
+        position.phase = self.phase
+        position.pawn_key = self.pawn_key
+        position.move_stack = self.move_stack[:]
+        position.undo_stack = self.undo_stack[:]
+        return position
+
+    def put_piece(self, code, sq):
+        bit = 1 << sq
+        self.bitboards[code] |= bit
+        self.occupied[code >> 3] |= bit
+        self.squares[sq] = code
+        self.key ^= PIECE_KEYS[code][sq]
+        self.middlegame += MIDDLEGAME_SCORES[code][sq]
+        self.endgame += ENDGAME_SCORES[code][sq]
+        self.phase += PHASE_SCORES[code]
+        if code & 7 == PAWN:
+            self.pawn_key ^= PIECE_KEYS[code][sq]
+
+    def remove_piece(self, sq):
+        code = self.squares[sq]
+        bit = 1 << sq
+        self.bitboards[code] ^= bit
+        self.occupied[code >> 3] ^= bit
+        self.squares[sq] = EMPTY
+        self.key ^= PIECE_KEYS[code][sq]
+        self.middlegame -= MIDDLEGAME_SCORES[code][sq]
+        self.endgame -= ENDGAME_SCORES[code][sq]
+        self.phase -= PHASE_SCORES[code]
+        if code & 7 == PAWN:
+            self.pawn_key ^= PIECE_KEYS[code][sq]
+        return code
+
+    def ep_key(self):
+        """
+        The en passant part of the Zobrist key. The file only counts when a pawn
+        of the side to move can really capture, so positions that only differ by
+        an unusable en passant square hash the same.
+        """
+        ep_square = self.ep_square
+        if ep_square >= 0 and (
+            PAWN_ATTACKS[self.side ^ 1][ep_square]
+            & self.bitboards[self.side << 3 | PAWN]
+        ):
+            return EP_KEYS[ep_square & 7]
+        return 0
+
+    def compute_key(self):
+        """Compute the Zobrist key from scratch, push and pop keep it up to date"""
+        key = CASTLING_KEYS[self.castling] ^ self.ep_key()
+        if self.side == WHITE:
+            key ^= SIDE_KEY
+        for sq, code in enumerate(self.squares):
+            if code:
+                key ^= PIECE_KEYS[code][sq]
+        return key
+
+    def compute_scores(self):
+        """
+        Compute the evaluation terms from scratch, push and pop keep them up to date.
+        :return: (middlegame, endgame, phase, pawn_key)
+        """
+        middlegame = endgame = phase = pawn_key = 0
+        for sq, code in enumerate(self.squares):
+            if code:
+                middlegame += MIDDLEGAME_SCORES[code][sq]
+                endgame += ENDGAME_SCORES[code][sq]
+                phase += PHASE_SCORES[code]
+                if code & 7 == PAWN:
+                    pawn_key ^= PIECE_KEYS[code][sq]
+        return middlegame, endgame, phase, pawn_key
+
+    def piece_at(self, sq):
+        """The piece code on a square, or EMPTY"""
+        return self.squares[sq]
+
+    def king_square(self, color):
+        return self.bitboards[color << 3 | KING].bit_length() - 1
+
+    def attackers_to(self, sq, color, occ=None):
+        """
+        All pieces of one color that attack a square.
+        :param sq: the square being attacked
+        :param color: the color of the attacking pieces
+        :param occ: the occupancy to slide through, the current board by default
+        :return: a bitboard of the attackers
+        """
+        if occ is None:
+            occ = self.occupied[0] | self.occupied[1]
+        bbs = self.bitboards
+        base = color << 3
+        queens = bbs[base | QUEEN]
+        return (
+            (PAWN_ATTACKS[color ^ 1][sq] & bbs[base | PAWN])
+            | (KNIGHT_ATTACKS[sq] & bbs[base | KNIGHT])
+            | (KING_ATTACKS[sq] & bbs[base | KING])
+            | (bishop_attacks(sq, occ) & (bbs[base | BISHOP] | queens))
+            | (rook_attacks(sq, occ) & (bbs[base | ROOK] | queens))
+        )
+
+    def is_attacked(self, sq, color):
+        """Whether any piece of the given color attacks the square"""
+        return self.attackers_to(sq, color) != 0
+
+    def targets_from(self, sq):
+        """
+        The pseudo-legal destination squares of the piece on a square.
+        :param sq: the square of the piece
+        :return: a bitboard of destinations, including castling and en passant
+        """
+        code = self.squares[sq]
+        color, kind = code >> 3, code & 7
+        own = self.occupied[color]
+        occ = self.occupied[0] | self.occupied[1]
+        if kind == PAWN:
+            targets = PAWN_ATTACKS[color][sq] & self.occupied[color ^ 1]
+            if self.ep_square >= 0:
+                targets |= PAWN_ATTACKS[color][sq] & (1 << self.ep_square)
+            step = 1 << (sq - 8 if color == WHITE else sq + 8)
+            if not occ & step:
+                targets |= step
+                if PAWN_START_ROW[color] >> sq & 1:
+                    double = 1 << (sq - 16 if color == WHITE else sq + 16)
+                    if not occ & double:
+                        targets |= double
+            return targets
+        if kind == KNIGHT:
+            return KNIGHT_ATTACKS[sq] & ~own
+        if kind == BISHOP:
+            return bishop_attacks(sq, occ) & ~own
+        if kind == ROOK:
+            return rook_attacks(sq, occ) & ~own
+        if kind == QUEEN:
+            return queen_attacks(sq, occ) & ~own
+        targets = KING_ATTACKS[sq] & ~own
+        for right in CASTLING_FOR[color]:
+            king_sq, king_to, _, _, empty, _ = CASTLING[right]
+            if self.castling & right and sq == king_sq and not occ & empty:
+                targets |= 1 << king_to
+        return targets
+
+    def moves_from(self, position):
+        """
+        The legal moves of the piece on a board position, in the same form the
+        Piece.get_legal_moves methods return.
+        :param position: the position of the piece as (row, col)
+        :return: a list of legal moves as (row, col) tuples
+        """
+        row, col = position
+        from_sq = row * 8 + col
+        if self.squares[from_sq] >> 3 != self.side:
+            # Only the side to move has legal moves, fall back to the piece's reach
+            return [divmod(sq, 8) for sq in iter_squares(self.targets_from(from_sq))]
+        targets = {
+            move >> 6 & 63 for move in self.legal_moves() if move & 63 == from_sq
+        }
+        return [divmod(sq, 8) for sq in sorted(targets)]
+
+    def generate_moves(self):
+        """
+        Generate the pseudo-legal moves for the side to move.
+        :return: a list of moves packed with encode_move
+        """
+        moves = []
+        append = moves.append
+        color = self.side
+        base = color << 3
+        bbs = self.bitboards
+        own = self.occupied[color]
+        enemy = self.occupied[color ^ 1]
+        occ = own | enemy
+        not_own = FULL ^ own
+        empty = FULL ^ occ
+
+        # Pawns are generated set-wise: shift the whole pawn bitboard at once
+        pawns = bbs[base | PAWN]
+        if color == WHITE:
+            single = (pawns >> 8) & empty
+            double = ((single & ROWS[5]) >> 8) & empty
+            left = (pawns >> 9) & NOT_FILE_H
+            right = (pawns >> 7) & NOT_FILE_A
+            push, left_delta, right_delta = 8, 9, 7
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & ROWS[2]) << 8) & empty
+            left = (pawns << 7) & NOT_FILE_H & FULL
+            right = (pawns << 9) & NOT_FILE_A & FULL
+            push, left_delta, right_delta = -8, -7, -9
+        promo_row = PROMOTION_ROW[color]
+        ep_bit = 1 << self.ep_square if self.ep_square >= 0 else 0
+        for targets, delta in (
+            (single, push),
+            (double, push * 2),
+            (left & (enemy | ep_bit), left_delta),
+            (right & (enemy | ep_bit), right_delta),
+        ):
+            while targets:
+                low = targets & -targets
+                targets ^= low
+                to_sq = low.bit_length() - 1
+                from_to = (to_sq + delta) | to_sq << 6
+                if low & promo_row:
+                    for kind in PROMOTIONS:
+                        append(from_to | kind << 12)
+                else:
+                    append(from_to)
+
+        for kind in (KNIGHT, BISHOP, ROOK, QUEEN, KING):
+            pieces = bbs[base | kind]
+            while pieces:
+                low = pieces & -pieces
+                pieces ^= low
+                from_sq = low.bit_length() - 1
+                if kind == KNIGHT:
+                    targets = KNIGHT_ATTACKS[from_sq] & not_own
+                elif kind == BISHOP:
+                    targets = (
+                        BISHOP_TABLES[from_sq][occ & BISHOP_MASKS[from_sq]] & not_own
+                    )
+                elif kind == ROOK:
+                    targets = ROOK_TABLES[from_sq][occ & ROOK_MASKS[from_sq]] & not_own
+                elif kind == QUEEN:
+                    targets = queen_attacks(from_sq, occ) & not_own
+                else:
+                    targets = KING_ATTACKS[from_sq] & not_own
+                while targets:
+                    low = targets & -targets
+                    targets ^= low
+                    append(from_sq | (low.bit_length() - 1) << 6)
+
+        for right in CASTLING_FOR[color]:
+            king_sq, king_to, _, _, empty_mask, _ = CASTLING[right]
+            if self.castling & right and not occ & empty_mask:
+                append(king_sq | king_to << 6)
+        return moves
+
+    def push(self, move):
+        """
+        Play a move in place, remembering enough to take it back with pop.
+
+        The undo record is a single int packing the captured piece code, the
+        castling rights, the en passant square, the halfmove clock and the Zobrist
+        key; the rest of the position can be recomputed from the move itself. The
+        key and the evaluation terms are updated incrementally from the squares the
+        move touches.
+        :param move: a packed move, assumed to be legal
+        """
+        from_sq = move & 63
+        to_sq = move >> 6 & 63
+        bbs = self.bitboards
+        occupied = self.occupied
+        squares = self.squares
+        code = squares[from_sq]
+        captured = squares[to_sq]
+        color = code >> 3
+        kind = code & 7
+        from_bit = 1 << from_sq
+        to_bit = 1 << to_sq
+
+        self.undo_stack.append(
+            captured
+            | self.castling << 4
+            | (self.ep_square + 1) << 8
+            | self.halfmove_clock << 15
+            | self.key << 32
+        )
+        self.move_stack.append(move)
+        # The side, castling and en passant keys of the old position come out here
+        key = self.key ^ SIDE_KEY ^ CASTLING_KEYS[self.castling]
+        if self.ep_square >= 0:
+            key ^= self.ep_key()
+
+        self.halfmove_clock += 1
+        if captured:
+            bbs[captured] ^= to_bit
+            occupied[color ^ 1] ^= to_bit
+            key ^= PIECE_KEYS[captured][to_sq]
+            self.middlegame -= MIDDLEGAME_SCORES[captured][to_sq]
+            self.endgame -= ENDGAME_SCORES[captured][to_sq]
+            self.phase -= PHASE_SCORES[captured]
+            if captured & 7 == PAWN:
+                self.pawn_key ^= PIECE_KEYS[captured][to_sq]
+            self.halfmove_clock = 0
+
+        # Lift the piece off its square, and put it (or its promotion) down again
+        bbs[code] ^= from_bit
+        squares[from_sq] = EMPTY
+        key ^= PIECE_KEYS[code][from_sq]
+        self.middlegame -= MIDDLEGAME_SCORES[code][from_sq]
+        self.endgame -= ENDGAME_SCORES[code][from_sq]
+        ep_square = -1
+        if kind == PAWN:
+            self.halfmove_clock = 0
+            if to_sq == self.ep_square:
+                # The captured pawn sits behind the square the capturing pawn lands on
+                self.remove_piece(to_sq + 8 if color == WHITE else to_sq - 8)
+            elif to_sq - from_sq in (16, -16):
+                ep_square = (from_sq + to_sq) >> 1
+            self.pawn_key ^= PIECE_KEYS[code][from_sq]
+            if move >> 12:
+                code = color << 3 | move >> 12
+                self.phase += PHASE_SCORES[code]
+            else:
+                self.pawn_key ^= PIECE_KEYS[code][to_sq]
+        elif kind == KING and to_sq - from_sq in (2, -2):
+            rook_from, rook_to = CASTLING_ROOKS[to_sq]
+            self.put_piece(self.remove_piece(rook_from), rook_to)
+        bbs[code] |= to_bit
+        occupied[color] ^= from_bit | to_bit
+        squares[to_sq] = code
+        self.middlegame += MIDDLEGAME_SCORES[code][to_sq]
+        self.endgame += ENDGAME_SCORES[code][to_sq]
+        # Fold in what put_piece and remove_piece changed for the rook or pawn
+        key ^= PIECE_KEYS[code][to_sq] ^ self.key ^ (self.undo_stack[-1] >> 32)
+
+        self.castling &= CASTLING_MASK[from_sq] & CASTLING_MASK[to_sq]
+        self.ep_square = ep_square
+        if color == BLACK:
+            self.fullmove_number += 1
+        self.side = color ^ 1
+        key ^= CASTLING_KEYS[self.castling]
+        if ep_square >= 0:
+            key ^= self.ep_key()
+        self.key = key
+
+    def pop(self):
+        """
+        Take back the last move played with push.
+        :return: the move that was taken back
+        """
+        move = self.move_stack.pop()
+        undo = self.undo_stack.pop()
+        from_sq = move & 63
+        to_sq = move >> 6 & 63
+        bbs = self.bitboards
+        occupied = self.occupied
+        squares = self.squares
+        color = self.side ^ 1
+        code = squares[to_sq]
+        from_bit = 1 << from_sq
+        to_bit = 1 << to_sq
+
+        bbs[code] ^= to_bit
+        self.middlegame -= MIDDLEGAME_SCORES[code][to_sq]
+        self.endgame -= ENDGAME_SCORES[code][to_sq]
+        if move >> 12:
+            self.phase -= PHASE_SCORES[code]
+            code = color << 3 | PAWN
+            self.pawn_key ^= PIECE_KEYS[code][from_sq]
+        elif code & 7 == PAWN:
+            self.pawn_key ^= PIECE_KEYS[code][from_sq] ^ PIECE_KEYS[code][to_sq]
+        bbs[code] |= from_bit
+        occupied[color] ^= from_bit | to_bit
+        squares[from_sq] = code
+        squares[to_sq] = EMPTY
+        self.middlegame += MIDDLEGAME_SCORES[code][from_sq]
+        self.endgame += ENDGAME_SCORES[code][from_sq]
+
+        captured = undo & 15
+        ep_square = (undo >> 8 & 127) - 1
+        if captured:
+            self.put_piece(captured, to_sq)
+        elif code & 7 == PAWN and to_sq == ep_square:
+            self.put_piece(
+                (color ^ 1) << 3 | PAWN, to_sq + 8 if color == WHITE else to_sq - 8
+            )
+        elif code & 7 == KING and to_sq - from_sq in (2, -2):
+            rook_from, rook_to = CASTLING_ROOKS[to_sq]
+            self.put_piece(self.remove_piece(rook_to), rook_from)
+
+        self.castling = undo >> 4 & 15
+        self.ep_square = ep_square
+        self.halfmove_clock = undo >> 15 & 0x1FFFF
+        self.key = undo >> 32
+        if color == BLACK:
+            self.fullmove_number -= 1
+        self.side = color
+        return move
+
+    def push_null(self):
+        """
+        Pass the turn without moving, for null-move pruning. Take it back with
+        pop_null. The move stack records it as NULL_MOVE.
+        """
+        self.undo_stack.append(
+            self.castling << 4
+            | (self.ep_square + 1) << 8
+            | self.halfmove_clock << 15
+            | self.key << 32
+        )
+        self.move_stack.append(NULL_MOVE)
+        self.key ^= SIDE_KEY ^ self.ep_key()
+        self.ep_square = -1
+        self.halfmove_clock += 1
+        self.side ^= 1
+
+    def pop_null(self):
+        """Take back a null move played with push_null"""
+        self.move_stack.pop()
+        undo = self.undo_stack.pop()
+        self.ep_square = (undo >> 8 & 127) - 1
+        self.halfmove_clock = undo >> 15 & 0x1FFFF
+        self.key = undo >> 32
+        self.side ^= 1
+
+    def in_check(self):
+        """Whether the side to move is in check"""
+        return self.is_attacked(self.king_square(self.side), self.side ^ 1)
+
+    def pins(self, color):
+        """
+        Find the pieces of one color pinned against their own king.
+        :param color: the color whose king is checked for pins
+        :return: (pinned bitboard, dict from pinned square to the line it may move on)
+        """
+        bbs = self.bitboards
+        them = (color ^ 1) << 3
+        king_sq = bbs[color << 3 | KING].bit_length() - 1
+        occ = self.occupied[0] | self.occupied[1]
+        # Enemy sliders that would attack the king on an empty board are candidates
+        snipers = (ROOK_TABLES[king_sq][0] & (bbs[them | ROOK] | bbs[them | QUEEN])) | (
+            BISHOP_TABLES[king_sq][0] & (bbs[them | BISHOP] | bbs[them | QUEEN])
+        )
+        pinned, lines = 0, {}
+        between_king = BETWEEN[king_sq]
+        own = self.occupied[color]
+        while snipers:
+            low = snipers & -snipers
+            snipers ^= low
+            sniper = low.bit_length() - 1
+            blockers = between_king[sniper] & occ
+            # Exactly one blocker, and it is ours
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinned |= blockers
+                lines[blockers.bit_length() - 1] = LINE[king_sq][sniper]
+        return pinned, lines
+
+    def legal_moves(self, noisy=True, quiet=True):
+        """
+        Generate the strictly legal moves for the side to move.
+
+        Checkers and pinned pieces are found once by looking outward from the king,
+        then every move is generated against a mask of the squares that resolve the
+        check and the line its piece is pinned to, so no move has to be played to
+        see whether it leaves the king in check.
+        :param noisy: include captures, en passant and promotions
+        :param quiet: include every other move, castling among them
+        :return: a list of moves packed with encode_move
+        """
+        moves = []
+        append = moves.append
+        color = self.side
+        them = color ^ 1
+        base = color << 3
+        bbs = self.bitboards
+        own = self.occupied[color]
+        enemy = self.occupied[them]
+        occ = own | enemy
+        empty = FULL ^ occ
+        # The squares pieces other than pawns may move to
+        destinations = (enemy if noisy else 0) | (empty if quiet else 0)
+        king_sq = bbs[base | KING].bit_length() - 1
+        checkers = self.attackers_to(king_sq, them, occ)
+
+        # The king may not step onto an attacked square. It is lifted off the board
+        # first so a slider checking it also covers the square behind it.
+        occ_without_king = occ ^ (1 << king_sq)
+        attackers_to = self.attackers_to
+        targets = KING_ATTACKS[king_sq] & destinations
+        while targets:
+            low = targets & -targets
+            targets ^= low
+            to_sq = low.bit_length() - 1
+            if not attackers_to(to_sq, them, occ_without_king):
+                append(king_sq | to_sq << 6)
+
+        # In double check only the king can move
+        if checkers & (checkers - 1):
+            return moves
+
+        if checkers:
+            # Capture the checker, or block it if it is a slider
+            checker = checkers.bit_length() - 1
+            evasion = checkers | BETWEEN[king_sq][checker]
+        else:
+            evasion = FULL
+            for right in CASTLING_FOR[color] if quiet else ():
+                _, king_to, _, _, between, path = CASTLING[right]
+                if (
+                    self.castling & right
+                    and not occ & between
+                    and not attackers_to(path[1], them, occ)
+                    and not attackers_to(path[2], them, occ)
+                ):
+                    append(king_sq | king_to << 6)
+        pinned, pin_lines = self.pins(color)
+
+        # Pawns are generated set-wise, pins are checked per move afterwards
+        pawns = bbs[base | PAWN]
+        if color == WHITE:
+            single = (pawns >> 8) & empty
+            double = ((single & ROWS[5]) >> 8) & empty
+            left = (pawns >> 9) & NOT_FILE_H
+            right = (pawns >> 7) & NOT_FILE_A
+            push, left_delta, right_delta = 8, 9, 7
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & ROWS[2]) << 8) & empty
+            left = (pawns << 7) & NOT_FILE_H & FULL
+            right = (pawns << 9) & NOT_FILE_A & FULL
+            push, left_delta, right_delta = -8, -7, -9
+        promo_row = PROMOTION_ROW[color]
+        # Pushes onto the last row promote, so they are noisy
+        pushes = (promo_row if noisy else 0) | (FULL ^ promo_row if quiet else 0)
+        captures = enemy if noisy else 0
+        for targets, delta in (
+            (single & pushes & evasion, push),
+            (double & pushes & evasion, push * 2),
+            (left & captures & evasion, left_delta),
+            (right & captures & evasion, right_delta),
+        ):
+            while targets:
+                low = targets & -targets
+                targets ^= low
+                to_sq = low.bit_length() - 1
+                from_sq = to_sq + delta
+                if pinned >> from_sq & 1 and not pin_lines[from_sq] & low:
+                    continue
+                if low & promo_row:
+                    for kind in PROMOTIONS:
+                        append(from_sq | to_sq << 6 | kind << 12)
+                else:
+                    append(from_sq | to_sq << 6)
+
+        # En passant removes two pawns from one rank, which pins alone cannot
+        # describe, so the king's sliding lines are checked with both pawns gone
+        ep_square = self.ep_square
+        if ep_square >= 0 and noisy:
+            captured_sq = ep_square + push
+            if evasion >> ep_square & 1 or checkers >> captured_sq & 1:
+                capturers = PAWN_ATTACKS[them][ep_square] & pawns
+                while capturers:
+                    low = capturers & -capturers
+                    capturers ^= low
+                    from_sq = low.bit_length() - 1
+                    after = (occ ^ low ^ (1 << captured_sq)) | (1 << ep_square)
+                    rooks = bbs[them << 3 | ROOK] | bbs[them << 3 | QUEEN]
+                    bishops = bbs[them << 3 | BISHOP] | bbs[them << 3 | QUEEN]
+                    if rook_attacks(king_sq, after) & rooks:
+                        continue
+                    if bishop_attacks(king_sq, after) & bishops:
+                        continue
+                    append(from_sq | ep_square << 6)
+
+        targets_mask = destinations & evasion
+        for kind in (KNIGHT, BISHOP, ROOK, QUEEN):
+            pieces = bbs[base | kind]
+            while pieces:
+                low = pieces & -pieces
+                pieces ^= low
+                from_sq = low.bit_length() - 1
+                if kind == KNIGHT:
+                    targets = KNIGHT_ATTACKS[from_sq]
+                elif kind == BISHOP:
+                    targets = BISHOP_TABLES[from_sq][occ & BISHOP_MASKS[from_sq]]
+                elif kind == ROOK:
+                    targets = ROOK_TABLES[from_sq][occ & ROOK_MASKS[from_sq]]
+                else:
+                    targets = queen_attacks(from_sq, occ)
+                targets &= targets_mask
+                if low & pinned:
+                    targets &= pin_lines[from_sq]
+                while targets:
+                    low = targets & -targets
+                    targets ^= low
+                    append(from_sq | (low.bit_length() - 1) << 6)
+        return moves
+
+    def is_legal(self, move):
+        """
+        Whether a move not generated for this position, such as a hash move or a
+        killer, is legal in it. Costs one push and pop rather than generating every
+        move.
+        :param move: a packed move
+        """
+        from_sq = move & 63
+        to_sq = move >> 6 & 63
+        code = self.squares[from_sq]
+        color = self.side
+        if (
+            not code
+            or code >> 3 != color
+            or not self.targets_from(from_sq) >> to_sq & 1
+        ):
+            return False
+        kind = code & 7
+        promotion = move >> 12
+        if kind == PAWN and PROMOTION_ROW[color] >> to_sq & 1:
+            if promotion not in PROMOTIONS:
+                return False
+        elif promotion:
+            return False
+        if kind == KING and to_sq - from_sq in (2, -2):
+            # Castling may not start in, pass through or end on an attacked square
+            path = CASTLING_PATHS[to_sq]
+            return not any(self.is_attacked(sq, color ^ 1) for sq in path)
+        self.push(move)
+        legal = not self.is_attacked(self.king_square(color), color ^ 1)
+        self.pop()
+        return legal
+
+    def is_checkmate(self):
+        """Whether the side to move is in check with no legal move"""
+        return self.in_check() and not self.legal_moves()
+
+    def is_stalemate(self):
+        """Whether the side to move is not in check but has no legal move"""
+        return not self.in_check() and not self.legal_moves()
@@ -1,4 +1,18 @@
 from pieces import Pawn, Rook, Knight, Bishop, Queen, King
+from bitboard import (
+    Position,
+    WHITE,
+    BLACK,
+    CASTLING,
+    CASTLING_ROOKS,
+    COLOR_NAMES,
+    PAWN,
+    KNIGHT,
+    BISHOP,
+    ROOK,
+    QUEEN,
+    KING,
+)
 import pygame
 
 # Define the colors of the chessboard
@@ -9,15 +23,34 @@ black_square_color = (181, 136, 99)
 WINDOW_SIZE = (512, 512)
 square_size = WINDOW_SIZE[0] // 8
 
+# Piece class for each promotion kind in a packed move
+PROMOTION_PIECES = {QUEEN: Queen, ROOK: Rook, BISHOP: Bishop, KNIGHT: Knight}
+
+# Piece class for each piece kind in a bitboard Position
+KIND_PIECES = {PAWN: Pawn, KING: King, **PROMOTION_PIECES}
+
 
 # NEED TO BUILD MOVING PIECES AND POTENTIAL MOVES
 class Board:
-    def __init__(self, screen):
+    def __init__(self, screen, use_bitboards=False):
         self.screen = screen
         self.selected_piece = None
         self.legal_moves = []
         self.board = self.initialize_board()
 
+        # Bitboard mirror of self.board, kept in step by push and pop. Pieces only
+        # generate their moves from it when use_bitboards is set.
+        self.use_bitboards = use_bitboards
+        self.bitboards = None
+        self.undo_stack = []
+        self.sync_bitboards()
+
+        # The checkerboard is rendered once, and drawn remembers what each square
+        # showed last frame so draw_board only repaints the squares that changed
+        self.background = None
+        self.drawn = None
+        self.invalidate()
+
     def initialize_board(self):
         # Define the initial state of the game board
         board = [
@@ -68,46 +101,201 @@ class Board:
         ]
         return board
 
-    def draw_board(self, screen, selected_piece, legal_moves):
-        # Draw the squares
+    def sync_bitboards(self, turn="white"):
+        """
+        Rebuild the bitboard mirror after self.board has been changed directly.
+        This forgets the moves played so far, so they can no longer be popped.
+        :param turn: the side to move, "white" or "black"
+        """
+        self.undo_stack = []
+        self.bitboards = Position.from_board(self, WHITE if turn == "white" else BLACK)
+
+    def load_fen(self, fen):
+        """
+        Set the board up from a FEN string, replacing everything on it.
+        :param fen: the FEN record
+        :return: the side to move, "white" or "black"
+        :raises ValueError: if the FEN cannot be read, or its castling rights do
+            not match the kings and rooks on the board
+        """
+        # from_fen checks every castling right against the placement, so the king
+        # and rook set_position looks for are there
+        position = Position.from_fen(fen)
+        self.set_position(position)
+        return "white" if position.side == WHITE else "black"
+
+    def set_position(self, position):
+        """
+        Set the pieces up from a Position, replacing everything on the board. The
+        board keeps the Position itself as its bitboards, so a GameState playing
+        its moves on the Position can show them by calling this after each one.
+        :param position: a bitboard Position
+        """
+        board = [[None] * 8 for _ in range(8)]
+        for sq, code in enumerate(position.squares):
+            if code:
+                board[sq // 8][sq % 8] = KIND_PIECES[code & 7](COLOR_NAMES[code >> 3])
+
+        # Kings and rooks count as moved unless a castling right says otherwise
+        for row in board:
+            for piece in row:
+                if isinstance(piece, (King, Rook)):
+                    piece.has_moved = True
+        for right, (king_sq, _, rook_sq, _, _, _) in CASTLING.items():
+            if position.castling & right:
+                board[king_sq // 8][king_sq % 8].has_moved = False
+                board[rook_sq // 8][rook_sq % 8].has_moved = False
+
+        # Flag the king of the side to move when it is in check
+        king_sq = position.king_square(position.side)
+        board[king_sq // 8][king_sq % 8].in_check = position.in_check()
+
+        self.board = board
+        self.undo_stack = []
+        self.bitboards = position
+
+    def fen(self):
+        """Write the board, including the side to move, as a FEN string"""
+        return self.bitboards.fen()
+
+    def push(self, move):
+        """
+        Play a move on the board, including castling, en passant and promotion.
+        :param move: a legal move packed with bitboard.encode_move
+        :return: the captured piece, or None
+        """
+        from_row, from_col = divmod(move & 63, 8)
+        to_row, to_col = divmod(move >> 6 & 63, 8)
+        piece = self.board[from_row][from_col]
+        captured_row, captured_col = to_row, to_col
+        if (
+            isinstance(piece, Pawn)
+            and from_col != to_col
+            and self.board[to_row][to_col] is None
+        ):
+            # En passant, the captured pawn is beside the pawn, not on its target
+            captured_row = from_row
+        captured = self.board[captured_row][captured_col]
+
+        rook_had_moved = False
+        if isinstance(piece, King) and abs(to_col - from_col) == 2:
+            rook_from, rook_to = CASTLING_ROOKS[move >> 6 & 63]
+            rook = self.board[from_row][rook_from % 8]
+            rook_had_moved = rook.has_moved
+            rook.has_moved = True
+            self.board[from_row][rook_to % 8] = rook
+            self.board[from_row][rook_from % 8] = None
+
+        # Compact undo record: what moved, what it captured, and the moved flags
+        self.undo_stack.append(
+            (
+                piece,
+                piece.has_moved,
+                captured,
+                captured_row,
+                captured_col,
+                rook_had_moved,
+            )
+        )
+
+        self.board[captured_row][captured_col] = None
+        self.board[from_row][from_col] = None
+        if move >> 12:
+            self.board[to_row][to_col] = PROMOTION_PIECES[move >> 12](piece.color)
+        else:
+            self.board[to_row][to_col] = piece
+        piece.has_moved = True
+        self.bitboards.push(move)
+        return captured
+
+    def pop(self):
+        """
+        Take back the last move played with push.
+        :return: the move that was taken back
+        """
+        move = self.bitboards.pop()
+        piece, had_moved, captured, captured_row, captured_col, rook_had_moved = (
+            self.undo_stack.pop()
+        )
+        from_row, from_col = divmod(move & 63, 8)
+        to_row, to_col = divmod(move >> 6 & 63, 8)
+
+        self.board[to_row][to_col] = None
+        self.board[from_row][from_col] = piece
+        self.board[captured_row][captured_col] = captured
+        piece.has_moved = had_moved
+
+        if isinstance(piece, King) and abs(to_col - from_col) == 2:
+            rook_from, rook_to = CASTLING_ROOKS[move >> 6 & 63]
+            rook = self.board[from_row][rook_to % 8]
+            rook.has_moved = rook_had_moved
+            self.board[from_row][rook_from % 8] = rook
+            self.board[from_row][rook_to % 8] = None
+        return move
+
+    def render_background(self):
+        """Draw the empty checkerboard once, squares are restored from it later"""
+        background = pygame.Surface((square_size * 8, square_size * 8))
         for row in range(8):
             for col in range(8):
                 color = (
                     white_square_color if (row + col) % 2 == 0 else black_square_color
                 )
                 pygame.draw.rect(
-                    screen,
+                    background,
                     color,
                     pygame.Rect(
                         col * square_size, row * square_size, square_size, square_size
                     ),
                 )
+        return background
 
-        # Draw the pieces
+    def invalidate(self):
+        """Forget what is on screen, so the next draw_board repaints every square"""
+        self.drawn = [[None] * 8 for _ in range(8)]
+
+    def draw_board(self, screen, selected_piece, legal_moves):
+        """
+        Repaint the squares whose contents changed since the last call. It does
+        not update the display, the caller does that with the rects returned.
+        :param screen: the surface to draw on
+        :param selected_piece: the (row, col) of the selected piece, or None
+        :param legal_moves: the (row, col) squares the selected piece can move to
+        :return: a list of the pygame.Rects that were repainted
+        """
+        if self.background is None:
+            self.background = self.render_background()
+        targets = set(legal_moves) if legal_moves else ()
+
+        dirty = []
         for row in range(8):
             for col in range(8):
                 piece = self.board[row][col]
-                if piece:
-                    screen.blit(piece.image, (col * square_size, row * square_size))
-
-        # If a piece is selected, draw a circle around it
-        if selected_piece is not None:
-            row, col = selected_piece
-            pygame.draw.circle(
-                screen,
-                (255, 0, 0),
-                ((col + 0.5) * square_size, (row + 0.5) * square_size),
-                square_size // 3,
-            )
-
-        # Draw legal move indicators for the selected piece
-        if legal_moves:
-            for r, c in legal_moves:
-                pygame.draw.circle(
-                    screen,
-                    (0, 255, 0),
-                    ((c + 0.5) * square_size, (r + 0.5) * square_size),
-                    square_size // 10,
+                state = (
+                    piece.image if piece else None,
+                    (row, col) == selected_piece,
+                    (row, col) in targets,
                 )
+                if state == self.drawn[row][col]:
+                    continue
+                self.drawn[row][col] = state
+                image, selected, target = state
 
-        pygame.display.flip()
+                rect = pygame.Rect(
+                    col * square_size, row * square_size, square_size, square_size
+                )
+                screen.blit(self.background, rect, rect)
+                if image is not None:
+                    screen.blit(image, rect)
+                # If a piece is selected, draw a circle around it
+                if selected:
+                    pygame.draw.circle(
+                        screen, (255, 0, 0), rect.center, square_size // 3
+                    )
+                # Draw legal move indicators for the selected piece
+                if target:
+                    pygame.draw.circle(
+                        screen, (0, 255, 0), rect.center, square_size // 10
+                    )
+                dirty.append(rect)
+        return dirty
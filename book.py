@@ -0,0 +1,244 @@
+"""
+Polyglot opening books.
+
+A Polyglot book is a file of 16-byte entries sorted by position key: the key, the
+move, a weight and a learn value, all big-endian. Our Zobrist keys are the Polyglot
+ones, so position.key is looked up directly. The file is memory-mapped and searched
+by bisection, so opening even a very large book reads nothing up front and a
+lookup only touches the pages it needs.
+
+Usage:
+    python book.py build games.pgn --out book.bin --plies 20
+    python book.py probe book.bin --fen "<fen>"
+"""
+
+import argparse
+import mmap
+import random
+import struct
+import sys
+
+from bitboard import (
+    Position,
+    START_FEN,
+    KING,
+    ROOK,
+    encode_move,
+    move_from,
+    move_to,
+    move_promotion,
+    move_to_uci,
+)
+from pgn import read_games
+
+ENTRY = struct.Struct(">QHHI")  # key, move, weight, learn
+ENTRY_SIZE = ENTRY.size
+MAX_WEIGHT = 0xFFFF
+
+# Book result points for the side that played a move: a win, a draw, a loss
+RESULT_POINTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+
+
+def _book_square(sq):
+    """Polyglot squares count from a1, ours from a8"""
+    return sq ^ 56
+
+
+def encode_book_move(position, move):
+    """
+    Write a move the way Polyglot stores it: castling as the king taking its own
+    rook, and a promotion kind of 1 for a knight up to 4 for a queen.
+    :param position: the position the move is played in
+    :param move: a packed move
+    :return: the 16-bit Polyglot move
+    """
+    from_sq, to_sq = move_from(move), move_to(move)
+    if position.squares[from_sq] & 7 == KING and abs(from_sq - to_sq) == 2:
+        to_sq = from_sq + 3 if to_sq > from_sq else from_sq - 4
+    promotion = move_promotion(move)
+    return (
+        _book_square(to_sq)
+        | _book_square(from_sq) << 6
+        | (promotion - 1 if promotion else 0) << 12
+    )
+
+
+def decode_book_move(position, raw):
+    """
+    Turn a Polyglot move back into a packed move.
+    :param position: the position the move is played in
+    :param raw: the 16-bit Polyglot move
+    :return: the packed move, which still has to be checked for legality
+    """
+    from_sq = _book_square(raw >> 6 & 63)
+    to_sq = _book_square(raw & 63)
+    promotion = raw >> 12 & 7
+    code = position.squares[from_sq]
+    if code & 7 == KING and position.squares[to_sq] == (code & 8 | ROOK):
+        to_sq = from_sq + 2 if to_sq > from_sq else from_sq - 2
+    return encode_move(from_sq, to_sq, promotion + 1 if promotion else 0)
+
+
+class OpeningBook:
+    def __init__(self, path):
+        """
+        Open a Polyglot book.
+        :param path: the book file
+        :raises ValueError: if the file is not a whole number of entries
+        """
+        self.file = open(path, "rb")
+        size = self.file.seek(0, 2)
+        if size % ENTRY_SIZE:
+            self.file.close()
+            raise ValueError(f"Not a Polyglot book: {path!r}")
+        # An empty file cannot be mapped, it is simply a book with no entries
+        self.data = (
+            mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        )
+        self.count = size // ENTRY_SIZE
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def entries(self, key):
+        """
+        Find the entries stored for a key.
+        :return: a list of (raw move, weight, learn) tuples, in file order
+        """
+        data, low, high = self.data, 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if ENTRY.unpack_from(data, middle * ENTRY_SIZE)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        for index in range(low, self.count):
+            entry_key, raw, weight, learn = ENTRY.unpack_from(data, index * ENTRY_SIZE)
+            if entry_key != key:
+                break
+            found.append((raw, weight, learn))
+        return found
+
+    def moves(self, position):
+        """
+        The legal book moves for a position.
+        :return: a list of (move, weight) pairs, heaviest first
+        """
+        entries = self.entries(position.key)
+        if not entries:
+            return []
+        legal_moves = set(position.legal_moves())
+        moves = []
+        for raw, weight, _ in entries:
+            move = decode_book_move(position, raw)
+            if move in legal_moves:
+                moves.append((move, weight))
+        moves.sort(key=lambda pair: -pair[1])
+        return moves
+
+    def choose(self, position, rng=random):
+        """
+        Pick a book move at random, in proportion to the weights.
+        :param position: the position to play in
+        :param rng: the random number generator to use
+        :return: a packed move, or None when the position is not in the book
+        """
+        moves = [(move, weight) for move, weight in self.moves(position) if weight]
+        if not moves:
+            return None
+        pick = rng.randrange(sum(weight for _, weight in moves))
+        for move, weight in moves:
+            pick -= weight
+            if pick < 0:
+                return move
+
+
+def build_book(sources, path, max_plies=24, min_count=1):
+    """
+    Build a Polyglot book from PGN collections. Each move played in the first
+    plies of a game counts two points for the side that played it when it won and
+    one when the game was drawn. Games are streamed, only the counts are kept.
+    :param sources: PGN file paths
+    :param path: the book file to write
+    :param max_plies: how many plies of each game to take moves from
+    :param min_count: leave out moves played fewer times than this
+    :return: a dict with the games read and the positions and entries written
+    """
+    points, counts, games = {}, {}, 0
+    for source in sources:
+        for game in read_games(source):
+            games += 1
+            win_points = RESULT_POINTS.get(game.result, (0, 0))
+            try:
+                for ply, (position, move) in enumerate(game.moves()):
+                    if ply >= max_plies:
+                        break
+                    entry = (position.key, encode_book_move(position, move))
+                    points[entry] = points.get(entry, 0) + win_points[position.side]
+                    counts[entry] = counts.get(entry, 0) + 1
+            except ValueError:
+                continue  # Keep the moves up to the first illegal one
+
+    entries = sorted(
+        (key, raw, score)
+        for (key, raw), score in points.items()
+        if counts[key, raw] >= min_count
+    )
+    # Weights are 16 bits, scale them down if the biggest would not fit
+    scale = max((score for _, _, score in entries), default=0) / MAX_WEIGHT
+    with open(path, "wb") as file:
+        for key, raw, score in entries:
+            weight = int(score / scale) if scale > 1 else score
+            file.write(ENTRY.pack(key, raw, weight, 0))
+    return {
+        "games": games,
+        "positions": len({key for key, _, _ in entries}),
+        "entries": len(entries),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and probe Polyglot books")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("pgn", nargs="+", help="PGN files to read")
+    build.add_argument("--out", required=True, help="book file to write")
+    build.add_argument("--plies", type=int, default=24, help="plies per game")
+    build.add_argument("--min-count", type=int, default=1, help="rarest move kept")
+    probe = commands.add_parser("probe", help="list the book moves for a position")
+    probe.add_argument("book", help="book file to read")
+    probe.add_argument("--fen", default=START_FEN, help="position to look up")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        stats = build_book(args.pgn, args.out, args.plies, args.min_count)
+        print(
+            f"{stats['games']} games, {stats['positions']} positions, "
+            f"{stats['entries']} entries written to {args.out}"
+        )
+        return 0
+
+    position = Position.from_fen(args.fen)
+    with OpeningBook(args.book) as book:
+        moves = book.moves(position)
+        total = sum(weight for _, weight in moves) or 1
+        print(f"key {position.key:016x}, {len(moves)} book moves")
+        for move, weight in moves:
+            print(f"{move_to_uci(move):6} {weight:6} {100 * weight / total:5.1f}%")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+A thin pygame client for the multiplayer server.
+
+The client only draws and sends clicks. It asks the server for a game, shows
+the position and clocks the server sends after every move, and sends a move when
+a piece is dragged there with two clicks. The legal squares shown for a selected
+piece come from the local board, but only the server decides what is played.
+
+Usage:
+    python client.py --host 127.0.0.1 --port 8765 --time 300
+"""
+
+import argparse
+import json
+import queue
+import socket
+import sys
+import threading
+import time
+
+import pygame
+
+from board import Board
+from pieces import Pawn
+from bitboard import encode_move, square, move_to_uci, QUEEN
+from sprites import preload_sprites
+from server import DEFAULT_PORT
+
+
+def _read_messages(sock, messages):
+    """Thread: put each line the server sends on the queue, None when it closes"""
+    with sock.makefile("r", encoding="utf-8") as lines:
+        for line in lines:
+            messages.put(json.loads(line))
+    messages.put(None)
+
+
+class Client:
+    def __init__(self, host, port, clock=600):
+        """
+        Connect to the server and ask for a game.
+        :param clock: the seconds on each side's clock
+        """
+        pygame.init()
+        self.WINDOW_SIZE = (712, 512)
+        self.screen = pygame.display.set_mode(self.WINDOW_SIZE)
+        pygame.display.set_caption("Chess - waiting for an opponent")
+        preload_sprites()
+        self.board = Board(self.screen, use_bitboards=True)
+        self.font = pygame.font.Font(None, 36)
+
+        self.sock = socket.create_connection((host, port))
+        self.messages = queue.Queue()
+        threading.Thread(
+            target=_read_messages, args=(self.sock, self.messages), daemon=True
+        ).start()
+        self.send({"type": "seek", "time": clock})
+
+        self.game_id = None
+        self.color = None
+        self.turn = "w"
+        self.times = {"w": clock, "b": clock}
+        self.turn_started = time.monotonic()
+        self.selected_position = None
+        self.legal_moves = []
+        self.drawn_timers = None
+
+    def send(self, message):
+        self.sock.sendall(json.dumps(message).encode() + b"\n")
+
+    def handle(self, message):
+        """
+        Apply one message from the server.
+        :return: False once the connection has closed
+        """
+        if message is None:
+            print("Disconnected from the server.")
+            return False
+        kind = message["type"]
+        if kind == "start":
+            self.game_id, self.color = message["game"], message["color"]
+            self.board.load_fen(message["fen"])
+            side = "White" if self.color == "w" else "Black"
+            pygame.display.set_caption(f"Chess - game {self.game_id}, {side}")
+        elif kind == "move":
+            self.turn = self.board.load_fen(message["fen"])[0]
+            self.times = {"w": message["white_time"], "b": message["black_time"]}
+            self.turn_started = time.monotonic()
+        elif kind == "over":
+            print(f"{message['reason']} {message['result']}")
+            pygame.display.set_caption(f"Chess - {message['result']}")
+            self.game_id = None
+        elif kind == "error":
+            print(f"Server: {message['message']}")
+        self.selected_position, self.legal_moves = None, []
+        return True
+
+    def click(self, row, col):
+        """Select one of our pieces, or send the move to the square clicked"""
+        if self.game_id is None or self.turn != self.color:
+            return
+        if (row, col) in self.legal_moves:
+            from_sq = square(*self.selected_position)
+            piece = self.board.board[self.selected_position[0]][
+                self.selected_position[1]
+            ]
+            # Pawns reaching the last row are always promoted to a queen
+            promotion = QUEEN if isinstance(piece, Pawn) and row in (0, 7) else 0
+            move = encode_move(from_sq, square(row, col), promotion)
+            self.send({"type": "move", "game": self.game_id, "move": move_to_uci(move)})
+            self.selected_position, self.legal_moves = None, []
+            return
+        piece = self.board.board[row][col]
+        if piece is not None and piece.color == self.color:
+            self.selected_position = (row, col)
+            self.legal_moves = piece.get_legal_moves((row, col), self.board)
+        else:
+            self.selected_position, self.legal_moves = None, []
+
+    def draw_timers(self):
+        """Draw both clocks, counting the side to move down between messages"""
+        times = dict(self.times)
+        if self.game_id is not None:
+            times[self.turn] -= time.monotonic() - self.turn_started
+        strings = tuple(
+            f"{int(max(t, 0) // 60)}:{int(max(t, 0) % 60):02}"
+            for t in (times["w"], times["b"])
+        )
+        if strings == self.drawn_timers:
+            return []
+        self.drawn_timers = strings
+        rects = []
+        for text, rect in zip(
+            strings, (pygame.Rect(562, 452, 100, 50), pygame.Rect(562, 10, 100, 50))
+        ):
+            pygame.draw.rect(self.screen, (255, 255, 255), rect)
+            self.screen.blit(
+                self.font.render(text, True, (0, 0, 0)), (rect.x + 25, rect.y + 10)
+            )
+            rects.append(rect)
+        return rects
+
+    def run(self):
+        clock = pygame.time.Clock()
+        self.screen.fill((255, 255, 255))
+        pygame.display.flip()
+        running = True
+        while running:
+            while True:
+                try:
+                    message = self.messages.get_nowait()
+                except queue.Empty:
+                    break
+                running = self.handle(message) and running
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    x, y = event.pos
+                    if x < 512:
+                        self.click(y // 64, x // 64)
+
+            dirty = self.board.draw_board(
+                self.screen, self.selected_position, self.legal_moves
+            )
+            dirty += self.draw_timers()
+            pygame.display.update(dirty)
+            clock.tick(30)
+        self.sock.close()
+        pygame.quit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play on a game server")
+    parser.add_argument("--host", default="127.0.0.1", help="server address")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port")
+    parser.add_argument("--time", type=float, default=600, help="seconds per side")
+    args = parser.parse_args(argv)
+    Client(args.host, args.port, args.time).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,526 @@
+"""
+The built-in chess engine.
+
+Iterative-deepening negamax with alpha-beta (principal variation search),
+quiescence search over captures, a transposition table, MVV-LVA, killer and
+history move ordering, and null-move pruning. Moves are generated in stages as
+the search asks for them: the hash move, then captures, killers and quiet moves,
+so a node that cuts off early never generates the rest. Captures that lose
+material by static exchange evaluation are tried last, and not at all in
+quiescence. A TimeManager turns the clock of
+the side to move into a budget for one move. With endgame tablebases, positions
+they cover are scored exactly instead of searched.
+
+Usage:
+    python engine.py --depth 6
+    python engine.py --fen "<fen>" --time 10
+"""
+
+import argparse
+import sys
+import time
+
+from bitboard import Position, START_FEN, PAWN, KING, NULL_MOVE, move_to_uci
+from evaluation import evaluate, see, PIECE_VALUES
+from adjudication import Adjudicator
+from book import OpeningBook
+from tablebase import Tablebase
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+
+MATE = 30000
+INFINITY = 32000
+MAX_PLY = 64
+# Scores beyond MATE_BOUND are forced mates, their distance to MATE is the plies.
+# Tablebase mates can be far longer than the search is deep, hence the margin.
+MATE_BOUND = MATE - 1000
+
+# History scores are capped so they stay comparable between moves
+HISTORY_LIMIT = (1 << 22) - 1
+# Piece values indexed by kind, 0 for an empty square
+ORDER_VALUES = [0] + [PIECE_VALUES[kind] for kind in range(1, 7)]
+
+# How often, in nodes, the clock and the stop flag are checked
+CHECK_INTERVAL = 1024
+
+
+class SearchAborted(Exception):
+    """Raised inside the search when time is up or a stop was requested"""
+
+
+class TimeManager:
+    def __init__(
+        self, remaining, increment=0.0, moves_to_go=None, overhead=0.05, ponder_hit=None
+    ):
+        """
+        Budget the time for one move from the clock of the side to move.
+        :param remaining: seconds left on the clock, e.g. Game.white_total_time
+        :param increment: seconds added to the clock after each move
+        :param moves_to_go: moves until the next time control, None for the
+            whole game; then 30 more moves are assumed
+        :param overhead: seconds kept back for drawing and moving the piece
+        :param ponder_hit: for a search of the opponent's predicted move, an
+            Event-like object set once the opponent has played it. Until then
+            there is no limit; after it the time since the start counts as spent.
+        """
+        usable = max(remaining - overhead, 0.01)
+        moves = moves_to_go or 30
+        # The soft limit is the target, the search may run over it to finish an
+        # iteration but never past the hard limit
+        self.soft_limit = min(usable / moves + increment * 0.75, usable)
+        self.hard_limit = min(self.soft_limit * 4, usable * 0.5 + increment, usable)
+        self.start_time = time.perf_counter()
+        self.ponder_hit = ponder_hit
+
+    def pondering(self):
+        return self.ponder_hit is not None and not self.ponder_hit.is_set()
+
+    def start(self):
+        self.start_time = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def should_start_iteration(self):
+        """A new iteration takes several times the last one, so stop early"""
+        return self.pondering() or self.elapsed() < self.soft_limit * 0.5
+
+    def out_of_time(self):
+        return self.elapsed() >= self.hard_limit and not self.pondering()
+
+
+def score_to_tt(score, ply):
+    """Store mate scores as distance from this node, not from the root"""
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def format_score(score):
+    """A score as UCI prints it: centipawns, or moves to mate"""
+    if score >= MATE_BOUND:
+        return f"mate {(MATE - score + 1) // 2}"
+    if score <= -MATE_BOUND:
+        return f"mate -{(MATE + score) // 2}"
+    return f"cp {score}"
+
+
+class Engine:
+    def __init__(
+        self, hash_mb=16, table=None, stop_event=None, book=None, tablebase=None
+    ):
+        """
+        Create an engine.
+        :param hash_mb: the transposition table size in megabytes
+        :param table: a TranspositionTable to use instead of creating one
+        :param stop_event: an optional threading or multiprocessing Event; setting
+            it stops the running search, like calling stop
+        :param book: an optional book.OpeningBook; positions found in it are
+            answered from the book without searching
+        :param tablebase: an optional tablebase.Tablebase; positions it covers
+            get their exact score without being searched further
+        """
+        self.table = table if table is not None else TranspositionTable(hash_mb)
+        self.history = [0] * 4096  # Indexed by the from and to bits of a move
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.pv = [[] for _ in range(MAX_PLY + 1)]
+        self.nodes = 0
+        self.stopped = False
+        self.stop_event = stop_event
+        self.book = book
+        self.tablebase = tablebase
+        self.time_manager = None
+        self.node_limit = None
+        self.adjudicator = None  # Follows the position searched, for draws
+
+    def new_game(self):
+        """Forget everything learned from the previous game"""
+        self.table.clear()
+        self.history = [0] * 4096
+
+    def stop(self):
+        """Ask a running search to stop, it returns its best move so far"""
+        self.stopped = True
+
+    def search(
+        self,
+        position,
+        max_depth=MAX_PLY,
+        time_manager=None,
+        node_limit=None,
+        on_info=None,
+        start_depth=1,
+    ):
+        """
+        Search a position by iterative deepening.
+        :param position: the Position to search, restored before returning
+        :param max_depth: the deepest iteration to run
+        :param time_manager: a TimeManager limiting the search, or None
+        :param node_limit: stop after roughly this many nodes, or None
+        :param on_info: called with the info dict after every finished iteration
+        :param start_depth: the first iteration to run, parallel helpers start
+            deeper so they do not all repeat the same work
+        :return: the info dict of the last finished iteration; "move" is the
+            best move, 0 when the side to move has no legal move
+        """
+        self.stopped = False
+        self.nodes = 0
+        self.time_manager = time_manager
+        self.node_limit = node_limit
+        self.table.new_search()
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        # Keep the ordering learned last move, but let new evidence outweigh it
+        self.history = [value >> 1 for value in self.history]
+        start = time.perf_counter()
+        root_length = len(position.move_stack)
+        # The moves that led to the position count towards repetitions
+        self.adjudicator = Adjudicator(position)
+
+        moves = position.legal_moves()
+        info = {
+            "move": moves[0] if moves else 0,
+            "depth": 0,
+            "score": 0,
+            "nodes": 0,
+            "time": 0.0,
+            "nps": 0,
+            "pv": [],
+        }
+        if not moves:
+            info["score"] = -MATE if position.in_check() else 0
+            return info
+
+        if self.book is not None:
+            book_move = self.book.choose(position)
+            if book_move is not None:
+                info.update(move=book_move, pv=[book_move], book=True)
+                return info
+
+        for depth in range(start_depth, max_depth + 1):
+            try:
+                score = self.negamax(position, depth, -INFINITY, INFINITY, 0)
+            except SearchAborted:
+                # Take back whatever the interrupted iteration had played
+                while len(position.move_stack) > root_length:
+                    if position.move_stack[-1] == NULL_MOVE:
+                        position.pop_null()
+                    else:
+                        position.pop()
+                break
+
+            elapsed = time.perf_counter() - start
+            pv = self.pv[0][:]
+            info = {
+                "move": pv[0] if pv else info["move"],
+                "depth": depth,
+                "score": score,
+                "nodes": self.nodes,
+                "time": elapsed,
+                "nps": int(self.nodes / max(elapsed, 1e-9)),
+                "pv": pv,
+                "tt_hit_rate": self.table.hit_rate(),
+            }
+            if on_info is not None:
+                on_info(info)
+            # A forced mate found within this depth will not get any shorter
+            if abs(score) >= MATE_BOUND and MATE - abs(score) <= depth:
+                break
+            if time_manager is not None and not time_manager.should_start_iteration():
+                break
+        return info
+
+    def check_limits(self):
+        if self.stopped or (self.stop_event is not None and self.stop_event.is_set()):
+            raise SearchAborted
+        if self.time_manager is not None and self.time_manager.out_of_time():
+            raise SearchAborted
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchAborted
+
+    def pick_moves(self, position, tt_move, ply, quiets=True):
+        """
+        Yield the legal moves of a node in stages, the most promising first: the
+        hash move, captures and promotions that do not lose material by MVV-LVA,
+        the two killers of the ply, quiet moves by history, then the losing
+        captures. A stage is only generated once the ones before it are used up.
+        :param tt_move: the move from the transposition table, or 0
+        :param quiets: False to stop after the captures that do not lose material
+        """
+        squares = position.squares
+        if tt_move and position.is_legal(tt_move):
+            yield tt_move
+
+        bad_captures = []
+        noisy = position.legal_moves(quiet=False)
+        if noisy:
+            scored = []
+            for move in noisy:
+                if move == tt_move:
+                    continue
+                victim = ORDER_VALUES[squares[move >> 6 & 63] & 7]
+                attacker = squares[move & 63] & 7
+                # Only a capture of a cheaper piece can lose material
+                if victim < ORDER_VALUES[attacker]:
+                    gain = see(position, move)
+                    if gain < 0:
+                        bad_captures.append((gain, move))
+                        continue
+                # Most valuable victim first, then least valuable attacker
+                scored.append(
+                    ((victim + ORDER_VALUES[move >> 12]) * 16 - attacker, move)
+                )
+            scored.sort(reverse=True)
+            for _, move in scored:
+                yield move
+        if not quiets:
+            return
+
+        killers = self.killers[ply]
+        for move in killers:
+            if (
+                move
+                and move != tt_move
+                and move not in noisy
+                and position.is_legal(move)
+            ):
+                yield move
+
+        history = self.history
+        quiets = [
+            move
+            for move in position.legal_moves(noisy=False)
+            if move != tt_move and move not in killers
+        ]
+        quiets.sort(key=lambda move: history[move & 4095], reverse=True)
+        yield from quiets
+
+        bad_captures.sort(reverse=True)
+        for _, move in bad_captures:
+            yield move
+
+    def negamax(self, position, depth, alpha, beta, ply, allow_null=True):
+        """
+        Alpha-beta search of one node.
+        :return: the score for the side to move, within (alpha, beta) when exact
+        """
+        self.nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self.check_limits()
+        self.pv[ply] = []
+        pv_node = beta - alpha > 1
+
+        if ply:
+            # A position repeated once is as good as a draw already
+            if self.adjudicator.is_draw(repetitions=2):
+                return 0
+            # Mate distance pruning: no line from here beats a mate already found
+            alpha = max(alpha, -MATE + ply)
+            beta = min(beta, MATE - ply - 1)
+            if alpha >= beta:
+                return alpha
+            if self.tablebase is not None:
+                score = self.probe_tablebase(position, ply)
+                if score is not None:
+                    return score
+
+        in_check = position.in_check()
+        if in_check:
+            depth += 1  # Check extension, so forcing lines are not cut short
+        if depth <= 0:
+            return self.quiescence(position, alpha, beta, ply)
+        if ply >= MAX_PLY:
+            return evaluate(position)
+
+        key = position.key
+        tt_move = 0
+        entry = self.table.probe(key)
+        if entry is not None:
+            tt_move, tt_score, tt_depth, bound = entry
+            if not pv_node and tt_depth >= depth:
+                tt_score = score_from_tt(tt_score, ply)
+                if (
+                    bound == EXACT
+                    or (bound == LOWER and tt_score >= beta)
+                    or (bound == UPPER and tt_score <= alpha)
+                ):
+                    return tt_score
+
+        # Null move: if passing still fails high, a real move surely would. Not
+        # done with only pawns left, where zugzwang makes passing a real advantage.
+        if (
+            allow_null
+            and not pv_node
+            and not in_check
+            and depth >= 3
+            and self.has_pieces(position)
+            and evaluate(position) >= beta
+        ):
+            reduction = 3 if depth >= 6 else 2
+            self.adjudicator.push_null()
+            score = -self.negamax(
+                position, depth - 1 - reduction, -beta, -beta + 1, ply + 1, False
+            )
+            self.adjudicator.pop_null()
+            if score >= beta:
+                return beta if score >= MATE_BOUND else score
+
+        squares = position.squares
+        adjudicator = self.adjudicator
+        best_score, best_move, bound = -INFINITY, 0, UPPER
+        searched = 0
+        for move in self.pick_moves(position, tt_move, ply):
+            quiet = not squares[move >> 6 & 63] and not move >> 12
+            adjudicator.push(move)
+            searched += 1
+            if searched == 1:
+                score = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            else:
+                # Prove the move is no better with a null window, re-search if it is
+                score = -self.negamax(position, depth - 1, -alpha - 1, -alpha, ply + 1)
+                if alpha < score < beta:
+                    score = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            adjudicator.pop()
+
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    bound = EXACT
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if score >= beta:
+                        bound = LOWER
+                        if quiet:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history[move & 4095] = min(
+                                self.history[move & 4095] + depth * depth,
+                                HISTORY_LIMIT,
+                            )
+                        break
+
+        if not searched:
+            return -MATE + ply if in_check else 0
+        self.table.store(key, best_move, score_to_tt(best_score, ply), depth, bound)
+        return best_score
+
+    def quiescence(self, position, alpha, beta, ply):
+        """
+        Search captures and promotions only, until the position is quiet, so the
+        evaluation is never taken in the middle of an exchange.
+        """
+        self.nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self.check_limits()
+        self.pv[ply] = []
+        if ply >= MAX_PLY:
+            return evaluate(position)
+
+        in_check = position.in_check()
+        if in_check:
+            # Every evasion has to be tried, standing pat is not an option
+            best_score = -INFINITY
+        else:
+            best_score = evaluate(position)
+            if best_score >= beta:
+                return best_score
+            alpha = max(alpha, best_score)
+
+        # Out of check only captures and promotions that do not lose material
+        searched = 0
+        for move in self.pick_moves(position, 0, ply, in_check):
+            searched += 1
+            # Quiescence does not look for repetitions, so the moves are not counted
+            position.push(move)
+            score = -self.quiescence(position, -beta, -alpha, ply + 1)
+            position.pop()
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if score >= beta:
+                        break
+        if in_check and not searched:
+            return -MATE + ply
+        return best_score
+
+    def probe_tablebase(self, position, ply):
+        """
+        The exact score of a position the tablebases cover.
+        :return: a mate score counted from the root, 0 for a draw, or None when
+            the position is not in the tables
+        """
+        occupied = position.occupied[0] | position.occupied[1]
+        if bin(occupied).count("1") > self.tablebase.max_pieces:
+            return None
+        result = self.tablebase.probe(position)
+        if result is None:
+            return None
+        wdl, plies = result
+        if wdl > 0:
+            return MATE - ply - plies
+        if wdl < 0:
+            return -MATE + ply + plies
+        return 0
+
+    @staticmethod
+    def has_pieces(position):
+        """Whether the side to move has anything besides pawns and the king"""
+        base = position.side << 3
+        pawns_and_king = (
+            position.bitboards[base | PAWN] | position.bitboards[base | KING]
+        )
+        return position.occupied[position.side] != pawns_and_king
+
+
+def print_info(info):
+    """Print search progress the way UCI engines do"""
+    print(
+        f"info depth {info['depth']} score {format_score(info['score'])} "
+        f"nodes {info['nodes']} nps {info['nps']} time {int(info['time'] * 1000)} "
+        f"pv {' '.join(move_to_uci(move) for move in info['pv'])}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a position")
+    parser.add_argument("--fen", default=START_FEN, help="position to search")
+    parser.add_argument("--depth", type=int, default=MAX_PLY, help="maximum depth")
+    parser.add_argument("--time", type=float, help="seconds to search for")
+    parser.add_argument("--hash", type=int, default=16, help="hash table size in MB")
+    parser.add_argument("--book", help="Polyglot opening book to play from")
+    parser.add_argument("--tablebases", help="directory of endgame tables")
+    args = parser.parse_args(argv)
+
+    time_manager = None
+    if args.time is not None:
+        # Spend the whole allowance on this one move
+        time_manager = TimeManager(args.time, moves_to_go=1, overhead=0)
+        time_manager.hard_limit = args.time
+    elif args.depth == MAX_PLY:
+        args.depth = 5
+
+    engine = Engine(
+        args.hash,
+        book=OpeningBook(args.book) if args.book else None,
+        tablebase=Tablebase(args.tablebases) if args.tablebases else None,
+    )
+    info = engine.search(
+        Position.from_fen(args.fen), args.depth, time_manager, on_info=print_info
+    )
+    print(f"bestmove {move_to_uci(info['move']) if info['move'] else '(none)'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Run the engine in a background process so the game loop never waits on it.
+
+The search is CPU-bound, so it gets its own process rather than a thread. The
+game hands it a snapshot of the position, keeps drawing and running the clocks,
+and polls for progress and the best move once per frame.
+
+While the opponent thinks, the engine can ponder: search the position after the
+move it expects, in the same process and over the same transposition table. If the
+opponent plays that move, ponderhit turns the search into the real one, with the
+time it has already run counted towards the move. Otherwise cancel stops it.
+"""
+
+import multiprocessing
+import queue
+
+from engine import Engine, TimeManager, MAX_PLY
+from book import OpeningBook
+from tablebase import Tablebase
+
+
+class StopFlag:
+    """
+    Looks like an Event to the engine. A search is stopped once the shared stop
+    id reaches its own id, so stopping one search can never stop a later one. The
+    same goes for the ponder hit id and ending a search's pondering.
+    """
+
+    def __init__(self, stop_id, search_id):
+        self.stop_id = stop_id
+        self.search_id = search_id
+
+    def is_set(self):
+        return self.stop_id.value >= self.search_id
+
+
+def _worker_main(
+    commands, results, stop_id, ponder_hit_id, hash_mb, book_path, tablebase_dir
+):
+    """Process entry point: run searches as they arrive until told to quit"""
+    engine = Engine(
+        hash_mb,
+        book=OpeningBook(book_path) if book_path else None,
+        tablebase=Tablebase(tablebase_dir) if tablebase_dir else None,
+    )
+    while True:
+        command = commands.get()
+        if command[0] == "quit":
+            break
+        if command[0] == "new_game":
+            engine.new_game()
+            continue
+
+        _, search_id, position, remaining, max_depth, ponder = command
+        engine.stop_event = StopFlag(stop_id, search_id)
+        time_manager = None
+        if remaining is not None:
+            ponder_hit = StopFlag(ponder_hit_id, search_id) if ponder else None
+            time_manager = TimeManager(remaining, ponder_hit=ponder_hit)
+
+        def on_info(info):
+            results.put(("info", search_id, info))
+
+        info = engine.search(position, max_depth, time_manager, on_info=on_info)
+        results.put(("bestmove", search_id, info))
+
+
+class EngineWorker:
+    def __init__(self, hash_mb=16, book_path=None, tablebase_dir=None):
+        """
+        Start the background engine process.
+        :param hash_mb: the engine's transposition table size in megabytes
+        :param book_path: an optional Polyglot book for the engine to open with
+        :param tablebase_dir: an optional directory of endgame tables to probe
+        """
+        # Spawn rather than fork so the child starts clean, without pygame
+        context = multiprocessing.get_context("spawn")
+        self.commands = context.Queue()
+        self.results = context.Queue()
+        self.stop_id = context.RawValue("q", 0)
+        self.ponder_hit_id = context.RawValue("q", 0)
+        self.search_id = 0
+        self.cancelled = set()
+        self.searching = False
+        self.pondering = False
+        self.ponder_result = None  # A ponder search's best move, held until the hit
+        self.process = context.Process(
+            target=_worker_main,
+            args=(
+                self.commands,
+                self.results,
+                self.stop_id,
+                self.ponder_hit_id,
+                hash_mb,
+                book_path,
+                tablebase_dir,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+
+    def start_search(self, position, remaining=None, max_depth=MAX_PLY, ponder=False):
+        """
+        Start searching a snapshot of a position. Returns at once.
+        :param position: the Position to search, copied before it is sent
+        :param remaining: seconds left on the engine's clock, None for no limit
+        :param max_depth: the deepest iteration to run
+        :param ponder: search the position after the opponent's expected move,
+            without a time limit until ponderhit; its best move is held back
+            until then
+        :return: the id of the search, used in the messages poll returns
+        """
+        self.search_id += 1
+        self.searching = True
+        self.pondering = ponder
+        self.ponder_result = None
+        self.commands.put(
+            ("search", self.search_id, position.copy(), remaining, max_depth, ponder)
+        )
+        return self.search_id
+
+    def ponderhit(self):
+        """
+        The opponent played the expected move: the ponder search goes on as the
+        real one, and stops by the time limit counted from when it started
+        """
+        self.ponder_hit_id.value = self.search_id
+        self.pondering = False
+
+    def stop(self):
+        """Stop now: the search ends and sends its best move so far"""
+        self.stop_id.value = self.search_id
+
+    def cancel(self):
+        """Stop the search and throw its result away"""
+        self.stop()
+        self.cancelled.add(self.search_id)
+        self.searching = False
+        self.pondering = False
+        if self.ponder_result is not None:
+            # Its best move has already arrived, so nothing more will
+            self.cancelled.discard(self.search_id)
+            self.ponder_result = None
+
+    def new_game(self):
+        self.cancel()
+        self.commands.put(("new_game",))
+
+    def poll(self):
+        """
+        Collect the messages the engine sent since the last poll, without waiting.
+        :return: a list of ("info", search_id, info) and ("bestmove", search_id,
+            info) tuples, where info is the engine's info dict
+        """
+        messages = []
+        if self.ponder_result is not None and not self.pondering:
+            # The ponder search finished before the hit, its move is due now
+            messages.append(self.ponder_result)
+            self.ponder_result = None
+            self.searching = False
+        while True:
+            try:
+                kind, search_id, info = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if search_id in self.cancelled:
+                if kind == "bestmove":
+                    self.cancelled.discard(search_id)
+                continue
+            if kind == "bestmove":
+                if self.pondering:
+                    self.ponder_result = (kind, search_id, info)
+                    continue
+                self.searching = False
+            messages.append((kind, search_id, info))
+        return messages
+
+    def close(self):
+        """Stop any search and shut the process down"""
+        self.cancel()
+        self.commands.put(("quit",))
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
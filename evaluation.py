@@ -0,0 +1,189 @@
+"""
+Static evaluation of a position.
+
+The score is material plus piece-square tables, tapered between a middlegame and
+an endgame table by how much non-pawn material is left, plus pawn structure and a
+mobility proxy. Scores are in centipawns from the point of view of the side to
+move, as negamax search expects. batch_evaluation.py scores arrays of positions
+with the same terms and gets the same numbers.
+
+Position keeps the material and piece-square sums and the phase up to date as
+moves are made, and the pawn structure only changes when a pawn moves, so it is
+cached by the position's pawn key. What is left to compute at each node is the
+mobility. see() tells captures that win material from those that lose it.
+"""
+
+from bitboard import (
+    WHITE,
+    BLACK,
+    PAWN,
+    KNIGHT,
+    BISHOP,
+    ROOK,
+    QUEEN,
+    KING,
+    FILE_A,
+    KNIGHT_ATTACKS,
+    KING_ATTACKS,
+    EMPTY,
+    rook_attacks,
+    bishop_attacks,
+    iter_squares,
+    popcount,
+)
+from piece_square import PIECE_VALUES, MAX_PHASE
+
+# Piece values for exchanges, where the king can take last but never be taken
+SEE_VALUES = [0] + [PIECE_VALUES[kind] for kind in range(PAWN, KING)] + [20000]
+
+# Pawn structure: a penalty for each extra pawn on a file and for each pawn with
+# no friendly pawn on a neighbouring file, and a bonus for passed pawns by how
+# many rows they have advanced
+DOUBLED_PAWN = -15
+ISOLATED_PAWN = -12
+PASSED_PAWN = [0, 5, 10, 20, 35, 60, 100, 0]
+
+# Pawn structure scores by pawn key. Emptied when it grows past PAWN_CACHE_SIZE.
+PAWN_CACHE_SIZE = 1 << 16
+_pawn_cache = {}
+
+FILES = [FILE_A << col for col in range(8)]
+ADJACENT_FILES = [
+    (FILES[col - 1] if col > 0 else 0) | (FILES[col + 1] if col < 7 else 0)
+    for col in range(8)
+]
+
+
+def _passed_masks(color):
+    """The squares ahead of a pawn, on its own and the neighbouring files"""
+    masks = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        rows = range(row) if color == WHITE else range(row + 1, 8)
+        span = FILES[col] | ADJACENT_FILES[col]
+        masks.append(sum(span & (0xFF << (r * 8)) for r in rows))
+    return masks
+
+
+# PASSED_MASKS[color][sq] holds the squares an enemy pawn must not be on for a
+# pawn of that color on sq to be passed
+PASSED_MASKS = [_passed_masks(WHITE), _passed_masks(BLACK)]
+
+# Mobility proxy: the squares a piece could step to first, counting those not
+# blocked by its own pieces. Knights count their jumps and sliders the neighbouring
+# squares along their lines, which tells a free piece from a boxed-in one without
+# walking the rays.
+MOBILITY_WEIGHTS = {KNIGHT: 4, BISHOP: 5, ROOK: 3, QUEEN: 2}
+MOBILITY_MASKS = {
+    KNIGHT: KNIGHT_ATTACKS,
+    BISHOP: [KING_ATTACKS[sq] & bishop_attacks(sq, 0) for sq in range(64)],
+    ROOK: [KING_ATTACKS[sq] & rook_attacks(sq, 0) for sq in range(64)],
+    QUEEN: KING_ATTACKS,
+}
+
+
+def taper(middlegame, endgame, phase):
+    """Blend a middlegame and an endgame score by the game phase"""
+    phase = min(phase, MAX_PHASE)
+    return (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+
+
+def pawn_structure(position):
+    """The pawn structure score, positive when it favours white"""
+    score = 0
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        pawns = position.bitboards[color << 3 | PAWN]
+        enemy_pawns = position.bitboards[(color ^ 1) << 3 | PAWN]
+        side_score = 0
+        for col in range(8):
+            count = popcount(pawns & FILES[col])
+            if count:
+                side_score += DOUBLED_PAWN * (count - 1)
+                if not pawns & ADJACENT_FILES[col]:
+                    side_score += ISOLATED_PAWN * count
+        for sq in iter_squares(pawns):
+            if not enemy_pawns & PASSED_MASKS[color][sq]:
+                side_score += PASSED_PAWN[7 - sq // 8 if color == WHITE else sq // 8]
+        score += sign * side_score
+    return score
+
+
+def cached_pawn_structure(position):
+    """pawn_structure, looked up by the position's pawn key when seen before"""
+    score = _pawn_cache.get(position.pawn_key)
+    if score is None:
+        if len(_pawn_cache) >= PAWN_CACHE_SIZE:
+            _pawn_cache.clear()
+        score = _pawn_cache[position.pawn_key] = pawn_structure(position)
+    return score
+
+
+def mobility(position):
+    """The mobility proxy score, positive when it favours white"""
+    score = 0
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        own = position.occupied[color]
+        for kind, weight in MOBILITY_WEIGHTS.items():
+            masks = MOBILITY_MASKS[kind]
+            for sq in iter_squares(position.bitboards[color << 3 | kind]):
+                score += sign * weight * popcount(masks[sq] & ~own)
+    return score
+
+
+def evaluate(position):
+    """
+    Evaluate a position.
+    :param position: a bitboard Position
+    :return: the score in centipawns for the side to move
+    """
+    score = taper(position.middlegame, position.endgame, position.phase)
+    score += cached_pawn_structure(position) + mobility(position)
+    return score if position.side == WHITE else -score
+
+
+def see(position, move):
+    """
+    Static exchange evaluation: the material a move wins once both sides have
+    taken back and forth on its target square, each with its least valuable
+    attacker and free to stop when taking again would lose. Pieces behind an
+    attacker on the same line join in once it has taken.
+    :param position: a bitboard Position
+    :param move: a legal move of the side to move
+    :return: the gain in centipawns for the side making the move, negative when
+        the move loses material
+    """
+    from_sq = move & 63
+    to_sq = move >> 6 & 63
+    squares = position.squares
+    bbs = position.bitboards
+    occ = (position.occupied[0] | position.occupied[1]) ^ 1 << from_sq
+    attacker = squares[from_sq] & 7
+    victim = squares[to_sq]
+    if attacker == PAWN and victim == EMPTY and to_sq == position.ep_square:
+        victim = PAWN
+        occ ^= 1 << (to_sq + 8 if position.side == WHITE else to_sq - 8)
+    gains = [SEE_VALUES[victim & 7]]
+    if move >> 12:
+        attacker = move >> 12
+        gains[0] += SEE_VALUES[attacker] - SEE_VALUES[PAWN]
+
+    color = position.side ^ 1
+    while True:
+        attackers = position.attackers_to(to_sq, color, occ) & occ
+        if not attackers:
+            break
+        for kind in range(PAWN, KING + 1):
+            pieces = attackers & bbs[color << 3 | kind]
+            if pieces:
+                break
+        # Taking the piece that took last, after what it gained itself
+        gains.append(SEE_VALUES[attacker] - gains[-1])
+        attacker = kind
+        occ ^= pieces & -pieces
+        color ^= 1
+
+    # Going back, each side takes only when it gains by it
+    while len(gains) > 1:
+        last = gains.pop()
+        gains[-1] = min(gains[-1], -last)
+    return gains[0]
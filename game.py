@@ -1,188 +1,313 @@
+import argparse
 import pygame
 import sys
+import time
+import instrumentation
+from game_state import GameState
+from sprites import preload_sprites, get_sprite
 from board import Board
-from pieces import Piece, Pawn, Rook, Knight, Bishop, Queen, King
-
-
-class Game:
-    def __init__(self):
+from bitboard import PIECE_SYMBOLS, COLOR_NAMES
+from engine import MATE_BOUND, MATE
+from engine_worker import EngineWorker
+
+
+class Game(GameState):
+    def __init__(
+        self,
+        computer_color=None,
+        fen=None,
+        book_path=None,
+        tablebase_dir=None,
+        ponder=False,
+    ):
         # Initialize pygame
         pygame.init()
         self.WINDOW_SIZE = (712, 512)
         self.screen = pygame.display.set_mode(self.WINDOW_SIZE)
-
-        # Initialize game variables
+        preload_sprites()  # Load the 12 piece sprites once, shared by every piece
         self.square_size = self.WINDOW_SIZE[0] // 8
-        self.selected_piece = None
-        self.selected_position = None
-        self.board = Board(self.screen)
-        self.turn = "white"  # white goes first
-        self.captured_pieces = {"w": [], "b": []}
-
-        # Initialize game and time settings
-        self.max_turn_time = 600  # 10 minutes
-        self.white_total_time = self.max_turn_time
-        self.white_start_time = None
-        self.black_total_time = self.max_turn_time
-        self.black_start_time = None
+
+        # The position, the turn, the selection and the clocks live in GameState,
+        # which reads the time from pygame here
+        super().__init__(
+            fen=fen, get_ticks=pygame.time.get_ticks, tablebase_dir=tablebase_dir
+        )
+        # The board shows GameState's position and is set up again after each move
+        self.board = Board(self.screen, use_bitboards=True)
+        self.board.set_position(self.position)
 
         self.font = pygame.font.Font(None, 36)  # Adjust the font size as necessary
 
-        
+        # Computer opponent, "w" or "b" for the color it plays, None for no opponent.
+        # It searches in a background process so the loop keeps drawing meanwhile.
+        self.computer_color = computer_color
+        if computer_color:
+            self.player_names[computer_color] = "Computer"
+        self.engine = (
+            EngineWorker(book_path=book_path, tablebase_dir=tablebase_dir)
+            if computer_color
+            else None
+        )
+        self.engine_info = None  # Latest progress report from the engine
+        # Pondering searches the reply the engine expects on the player's time
+        self.ponder = ponder
+        self.ponder_move = None  # The player's move the engine is pondering on
+        self.small_font = pygame.font.Font(None, 24)
+
+        # Only what changed is redrawn each frame, and the frame rate is capped so
+        # an idle board sleeps instead of spinning
+        self.frame_rate = 30
+        self.clock = pygame.time.Clock()
+        self.drawn_timers = None  # Timer strings on screen, redrawn when they change
+        self.drawn_engine_info = None
+
+        # Debug overlay and profiling, driven by the function keys
+        self.show_overlay = False
+        self.drawn_overlay = None
+        self.overlay_updated = 0.0
+        self.debug_font = pygame.font.Font(None, 20)
+        self.metrics_path = "metrics.json"
+        self.sampler = None
+
     def game_loop(self):
         """Main game loop"""
         # Initialize game loop variables
         running = True
-        legal_moves = []
-        
-        self.white_start_time = pygame.time.get_ticks()  # initialize white start time
-        
-        while running:
-            self.board.draw_board(self.screen, self.selected_position, legal_moves)
+        self.start_clocks()
 
+        while running:
+            frame_start = time.perf_counter()
             self.update_timer()
-            self.draw_timer()
+
+            # Let the computer think when it is its turn, or ponder on the
+            # player's, without waiting for it
+            if running and self.computer_color is not None:
+                running = self.update_computer()
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
                 elif event.type == pygame.MOUSEBUTTONDOWN:
-                    if event.button == 1:
+                    # Clicks are ignored while the computer is thinking
+                    if event.button == 1 and self.computer_color != self.turn[0]:
                         mouse_pos = pygame.mouse.get_pos()
                         board_size = 512
                         row = mouse_pos[1] // (board_size // 8)
                         col = mouse_pos[0] // (board_size // 8)
-                        piece = self.board.board[row][
-                            col
-                        ]  # Not really piece but selected square on the board
-
-                        # If no piece is selected, then select the piece
-                        if self.selected_piece is None:
-                            if piece is not None:
-                                # Prevents players to select opponents pieces
-                                wrong_piece_white = (
-                                    piece.color == "b" and self.turn == "white"
-                                )
-                                wrong_piece_black = (
-                                    piece.color == "w" and self.turn == "black"
-                                )
-                                # If player selects the wrong piece, then reset the selection
-                                if wrong_piece_black or wrong_piece_white:
-                                    break
-
-                                # If player selects the right piece, then select the piece
-                                self.selected_piece = piece
-                                self.selected_position = (row, col)
-                                legal_moves = piece.get_legal_moves(
-                                    self.selected_position, self.board
-                                )
-
-                                # If selected piece has no legal moves, then reset the selection (basically not allowing player to select the piece)
-                                if legal_moves == []:
-                                    self.selected_piece = None
-                                    self.selected_position = None
-
-                        # If a piece is selected, then select the destination
-                        else:
-                            dest_pos = (row, col)
-                            
-                            # If player selects the same piece, then reset the selection
-                            if dest_pos == self.selected_position:
-                                self.selected_piece = None
-                                self.selected_position = None
-                                legal_moves = []
-
-                            # If player selects a legal move, then move the piece
-                            elif dest_pos in legal_moves:
-                                # Castling
-                                if isinstance(self.selected_piece, King):
-                                    self.selected_piece.has_moved = True
-                                    self.move_piece(row, col)
-                                    legal_moves = []
-                                    if dest_pos[1] == 6:
-                                        self.board.board[row][5] = self.board.board[
-                                            row
-                                        ][7]
-                                        self.board.board[row][7] = None
-                                        self.board.board[row][5].has_moved = True
-                                    elif dest_pos[1] == 2:
-                                        self.board.board[row][3] = self.board.board[
-                                            row
-                                        ][0]
-                                        self.board.board[row][0] = None
-                                        self.board.board[row][3].has_moved = True
-
-                                # Pawn promotion, #####need to implement en passant#####
-                                elif isinstance(self.selected_piece, Pawn):
-                                    self.selected_piece.has_moved = True
-                                    color = self.selected_piece.color
-                                    self.move_piece(row, col)
-                                    legal_moves = []
-                                    if dest_pos[0] == 0 or dest_pos[0] == 7:
-                                        self.board.board[row][col] = Queen(color)
-
-                                # If not King or Pawn, then move the piece
-                                else:
-                                    self.move_piece(row, col)
-                                    legal_moves = []
-
-            
-            running = self.check_for_time_up()
-            self.draw_timer()
-            #self.draw_captured_pieces()
-            pygame.display.flip()
-
+                        running = self.click(row, col) and running
+                elif event.type == pygame.KEYDOWN:
+                    self.handle_debug_key(event.key)
+
+            running = running and self.check_for_time_up()
+
+            # Repaint only what changed and push just those rects to the display
+            with instrumentation.timer("draw.board"):
+                dirty = self.board.draw_board(
+                    self.screen, self.selected_position, self.legal_moves
+                )
+            dirty += self.draw_timer()
+            dirty += self.draw_engine_info()
+            dirty += self.draw_overlay()
+            # self.draw_captured_pieces()
+            with instrumentation.timer("draw.display"):
+                pygame.display.update(dirty)
+            if instrumentation.ENABLED:
+                # The work of one frame, leaving out the sleep that caps the rate
+                frame_time = time.perf_counter() - frame_start
+                instrumentation.observe("frame", frame_time)
+                if frame_time > 1 / self.frame_rate:
+                    instrumentation.count("frame.slow")
+            self.clock.tick(self.frame_rate)
+
+        if self.engine is not None:
+            self.engine.close()
         pygame.quit()
 
-    def move_piece(self, row, col):
-        # Check for captured piece
-        captured_piece = self.board.board[row][col]
-        if captured_piece is not None:
-            self.captured_pieces[captured_piece.color].append(captured_piece)
-        """Moves the piece on the board"""
-        self.board.board[row][col] = self.selected_piece  # Moves piece on board
-        self.board.board[self.selected_position[0]][
-            self.selected_position[1]
-        ] = None  # Sets old position of piece to None
-        # self.selected_piece.position = dest_pos
-        self.selected_piece = None
-        self.selected_position = None
-        self.switch_turns()
-
-    def switch_turns(self):
-        """Updates time and switches turns"""
-        
-        # Existing logic to switch turn
-        self.turn = "black" if self.turn == "white" else "white"
-
-        # Add logic to update total time and reset start time
-        if self.turn == "white":
-            self.black_total_time -= (pygame.time.get_ticks() - self.black_start_time) / 1000  # Update black's total time
-            self.white_start_time = pygame.time.get_ticks()  # Reset white's start time
-        else:
-            self.white_total_time -= (pygame.time.get_ticks() - self.white_start_time) / 1000  # Update white's total time
-            self.black_start_time = pygame.time.get_ticks()  # Reset black's start time
-        
-
-    def check_for_time_up(self):
-        # Check if time's up
-        if self.white_total_time <= 0:
-            print("White's time is up!")
-            # Add logic to display this message on the screen
-            return False
-        elif self.black_total_time <= 0:
-            print("Black's time is up!")
-            # Add logic to display this message on the screen
-            return False
+    def update_computer(self):
+        """
+        Start the computer's search on its turn and play its move once it is found.
+        Called every frame, it never blocks.
+        :return: False when the computer's move ended the game
+        """
+        if self.computer_color == self.turn[0]:
+            if self.engine.pondering:
+                # The player has moved: keep the ponder search if it was on the
+                # move played, otherwise drop it and start afresh
+                if self.position.move_stack[-1] == self.ponder_move:
+                    self.engine.ponderhit()
+                    instrumentation.count("ponder.hit")
+                else:
+                    self.engine.cancel()
+                    instrumentation.count("ponder.miss")
+            if not self.engine.searching:
+                self.engine.start_search(self.position, self.computer_time())
+
+        for kind, _, info in self.engine.poll():
+            if kind == "info":
+                self.engine_info = info
+                instrumentation.gauge("search.depth", info["depth"])
+                instrumentation.gauge("search.nps", info["nps"])
+                instrumentation.gauge("search.tt_hit_rate", info["tt_hit_rate"])
+                continue
+            instrumentation.count("search.nodes", info["nodes"])
+            instrumentation.observe("search", info["time"])
+            if info["move"]:
+                self.play_move(info["move"])
+                if not self.check_for_game_over():
+                    return False
+                if self.ponder:
+                    self.start_pondering(info["pv"])
         return True
-    
+
+    def play_move(self, move):
+        """Play a move and show it on the board"""
+        super().play_move(move)
+        self.board.set_position(self.position)
+
+    def computer_time(self):
+        """The seconds left on the computer's clock"""
+        return (
+            self.white_total_time
+            if self.computer_color == "w"
+            else self.black_total_time
+        )
+
+    def start_pondering(self, pv):
+        """
+        Search the position after the player's reply predicted by the principal
+        variation of the computer's last search, while the player thinks.
+        :param pv: the principal variation, starting with the move just played
+        """
+        self.ponder_move = None
+        position = self.position
+        if len(pv) < 2 or not position.is_legal(pv[1]):
+            return
+        self.ponder_move = pv[1]
+        predicted = position.copy()
+        predicted.push(self.ponder_move)
+        # The computer's clock stands still until the player moves, so this is
+        # also what it will have left at the ponder hit
+        self.engine.start_search(predicted, self.computer_time(), ponder=True)
+
+    def announce(self, message):
+        """Record why the game ended and print it"""
+        super().announce(message)
+        print(message)
+        # Add logic to display this message on the screen
+
+    def draw_engine_info(self):
+        """
+        Show the depth and score of the computer's latest search.
+        :return: the rects drawn, empty when the text has not changed
+        """
+        if self.engine_info is None:
+            return []
+        score = self.engine_info["score"]
+        if self.computer_color == "b":
+            score = -score  # Scores are shown from white's point of view
+        if abs(score) >= MATE_BOUND:
+            score_string = f"#{'-' if score < 0 else ''}{(MATE - abs(score) + 1) // 2}"
+        else:
+            score_string = f"{score / 100:+.2f}"
+        info_string = f"d{self.engine_info['depth']} {score_string}"
+        if info_string == self.drawn_engine_info:
+            return []
+        self.drawn_engine_info = info_string
+        text = self.small_font.render(info_string, True, (0, 0, 0))
+        rect = pygame.Rect(562, 240, 140, 30)
+        pygame.draw.rect(self.screen, (255, 255, 255), rect)
+        self.screen.blit(text, (567, 245))
+        return [rect]
+
+    def handle_debug_key(self, key):
+        """
+        F3 shows the debug overlay and turns measuring on, F4 writes what was
+        measured to metrics_path, F5 starts and stops cProfile and F6 the stack
+        sampler.
+        """
+        if key == pygame.K_F3:
+            self.show_overlay = not self.show_overlay
+            self.drawn_overlay = None
+            if self.show_overlay:
+                instrumentation.enable()
+        elif key == pygame.K_F4:
+            instrumentation.dump(self.metrics_path)
+            print(f"Metrics written to {self.metrics_path}")
+        elif key == pygame.K_F5:
+            if instrumentation.profiling():
+                print(instrumentation.stop_profile("game.prof"))
+            else:
+                instrumentation.start_profile()
+        elif key == pygame.K_F6:
+            if self.sampler is None:
+                self.sampler = instrumentation.Sampler()
+                self.sampler.start()
+            else:
+                self.sampler.stop()
+                self.sampler.dump("game.stacks")
+                print("Sampled stacks written to game.stacks")
+                self.sampler = None
+
+    def draw_overlay(self):
+        """
+        Show frame, draw, move generation and search figures, refreshed twice a
+        second while the overlay is on.
+        :return: the rects drawn
+        """
+        rect = pygame.Rect(517, 275, 190, 174)
+        if not self.show_overlay:
+            if self.drawn_overlay is None:
+                return []
+            # Clear what the overlay left behind
+            self.drawn_overlay = None
+            pygame.draw.rect(self.screen, (255, 255, 255), rect)
+            return [rect]
+        now = time.perf_counter()
+        if self.drawn_overlay is not None and now - self.overlay_updated < 0.5:
+            return []
+        self.overlay_updated = now
+
+        snapshot = instrumentation.snapshot()
+        histograms, gauges = snapshot["histograms"], snapshot["gauges"]
+        frame = histograms.get("frame", {})
+        board = histograms.get("draw.board", {})
+        movegen = [
+            value
+            for name, value in histograms.items()
+            if name.partition(".")[0] == "movegen"
+        ]
+        calls = sum(value["count"] for value in movegen)
+        movegen_ms = sum(value["total_ms"] for value in movegen)
+        counters = snapshot["counters"]
+        hits = counters.get("sprites.hit", 0)
+        sprite_hits = hits / max(hits + counters.get("sprites.miss", 0), 1)
+        lines = [
+            f"fps {self.clock.get_fps():.0f}",
+            f"frame p99 {frame.get('p99_ms', 0):.1f} ms",
+            f"slow frames {counters.get('frame.slow', 0)}",
+            f"board draw {board.get('mean_ms', 0):.2f} ms",
+            f"movegen {calls} calls {movegen_ms / max(calls, 1):.2f} ms",
+            f"search nps {gauges.get('search.nps', 0):,}",
+            f"tt hits {100 * gauges.get('search.tt_hit_rate', 0):.0f}%",
+            f"sprite hits {100 * sprite_hits:.0f}%",
+            f"profiling {'on' if instrumentation.profiling() else 'off'}",
+        ]
+        if lines == self.drawn_overlay:
+            return []
+        self.drawn_overlay = lines
+        pygame.draw.rect(self.screen, (235, 235, 235), rect)
+        for i, line in enumerate(lines):
+            text = self.debug_font.render(line, True, (0, 0, 0))
+            self.screen.blit(text, (rect.x + 5, rect.y + 3 + 19 * i))
+        return [rect]
+
     def draw_timer(self):
         # Calculate remaining time in seconds
         if self.turn == "white":
-            elapsed_time = (pygame.time.get_ticks() - self.white_start_time) / 1000
+            elapsed_time = (self.get_ticks() - self.white_start_time) / 1000
             remaining_time = max(0, self.white_total_time - elapsed_time)
         else:
-            elapsed_time = (pygame.time.get_ticks() - self.black_start_time) / 1000
+            elapsed_time = (self.get_ticks() - self.black_start_time) / 1000
             remaining_time = max(0, self.black_total_time - elapsed_time)
 
         # Convert remaining time to a string
@@ -191,54 +316,96 @@ class Game:
         time_string = f"{minutes}:{seconds:02}"
 
         # Render the time strings to surfaces
-        white_time_string = f"{int(self.white_total_time // 60)}:{int(self.white_total_time % 60):02}"
-        black_time_string = f"{int(self.black_total_time // 60)}:{int(self.black_total_time % 60):02}"
+        white_time_string = (
+            f"{int(self.white_total_time // 60)}:{int(self.white_total_time % 60):02}"
+        )
+        black_time_string = (
+            f"{int(self.black_total_time // 60)}:{int(self.black_total_time % 60):02}"
+        )
+        # The clocks only change once a second, there is nothing to draw until then
+        if (white_time_string, black_time_string) == self.drawn_timers:
+            return []
+        self.drawn_timers = (white_time_string, black_time_string)
         white_text = self.font.render(white_time_string, True, (0, 0, 0))
         black_text = self.font.render(black_time_string, True, (0, 0, 0))
 
         # Draw rectangles to cover the previous texts
-        pygame.draw.rect(self.screen, (255, 255, 255), pygame.Rect(562, 452, 100, 50))  # For white timer
-        pygame.draw.rect(self.screen, (255, 255, 255), pygame.Rect(562, 10, 100, 50))  # For black timer
+        white_rect = pygame.Rect(562, 452, 100, 50)
+        black_rect = pygame.Rect(562, 10, 100, 50)
+        pygame.draw.rect(self.screen, (255, 255, 255), white_rect)  # For white timer
+        pygame.draw.rect(self.screen, (255, 255, 255), black_rect)  # For black timer
 
         # Draw the text surfaces on the screen at certain positions
         self.screen.blit(white_text, (587, 462))  # For white timer
         self.screen.blit(black_text, (587, 20))  # For black timer
-
-    def update_timer(self):
-        current_time = pygame.time.get_ticks()
-
-        if self.turn == "white":
-            elapsed_time = (current_time - self.white_start_time) / 1000  # Time elapsed in seconds
-            self.white_total_time = max(0, self.white_total_time - elapsed_time)
-            self.white_start_time = current_time  # Reset the start time for the next frame
-        else:
-            elapsed_time = (current_time - self.black_start_time) / 1000  # Time elapsed in seconds
-            self.black_total_time = max(0, self.black_total_time - elapsed_time)
-            self.black_start_time = current_time  # Reset the start time for the next frame
-
+        return [white_rect, black_rect]
 
     def draw_captured_pieces(self):
         # Set starting position for captured pieces
         x, y = 530, 50
 
         # Draw a light gray rectangle behind the captured pieces
-        pygame.draw.rect(self.screen, (200, 200, 200), pygame.Rect(x, y, 170, self.WINDOW_SIZE[1]-y))
+        pygame.draw.rect(
+            self.screen,
+            (200, 200, 200),
+            pygame.Rect(x, y, 170, self.WINDOW_SIZE[1] - y),
+        )
 
         # Loop through each list of captured pieces
         for color in ["w", "b"]:
-            for piece in self.captured_pieces[color]:
+            for code in self.captured_pieces[color]:
+                image = get_sprite(PIECE_SYMBOLS[code & 7] + COLOR_NAMES[code >> 3])
                 # Draw the piece at the current position
-                self.screen.blit(piece.image, (x, y))
+                self.screen.blit(image, (x, y))
 
                 # Move the position to the right for the next piece
-                x += piece.image.get_width() + 10
+                x += image.get_width() + 10
 
                 # If the position is too far to the right, move it back to the left and down a row
-                if x > self.WINDOW_SIZE[0] - piece.image.get_width():
+                if x > self.WINDOW_SIZE[0] - image.get_width():
                     x = 10
-                    y += piece.image.get_height() + 10
+                    y += image.get_height() + 10
 
 
 if __name__ == "__main__":
-    game = Game()
+    parser = argparse.ArgumentParser(description="Simple Pygame Chess")
+    parser.add_argument(
+        "--computer", choices=["w", "b"], help="let the computer play this color"
+    )
+    parser.add_argument("--fen", help="start from this position instead")
+    parser.add_argument("--pgn", help="save the game to this PGN file when it ends")
+    parser.add_argument("--book", help="Polyglot opening book for the computer")
+    parser.add_argument("--tablebases", help="directory of endgame tables")
+    parser.add_argument(
+        "--ponder",
+        action="store_true",
+        help="let the computer think on the player's time",
+    )
+    parser.add_argument(
+        "--instrument", action="store_true", help="measure and show the overlay"
+    )
+    parser.add_argument("--metrics", help="write the measurements here on exit")
+    parser.add_argument("--profile", help="run cProfile and save its stats here")
+    args = parser.parse_args()
+    if args.instrument or args.metrics:
+        instrumentation.enable()
+    if args.profile:
+        instrumentation.start_profile()
+    game = Game(
+        computer_color=args.computer,
+        fen=args.fen,
+        book_path=args.book,
+        tablebase_dir=args.tablebases,
+        ponder=args.ponder,
+    )
+    if args.instrument:
+        game.show_overlay = True
+    if args.metrics:
+        game.metrics_path = args.metrics
     game.game_loop()
+    if args.pgn:
+        game.save_pgn(args.pgn)
+    if args.metrics:
+        instrumentation.dump(args.metrics)
+    if args.profile:
+        print(instrumentation.stop_profile(args.profile))
@@ -0,0 +1,333 @@
+"""
+The rules side of a game, without a window.
+
+GameState holds everything Game shows on screen: the position, whose turn it is,
+the selected piece and its moves, the clocks, the captured pieces and the
+result. It reads the time from a clock it is given, pygame's in the game and a
+ManualClock in scripts and tests, and takes clicks as (row, col) squares or moves
+through play_uci. It never opens a window or reads pygame events, so any number
+of games can be driven programmatically, and with a ManualClock the same script
+always produces the same game, down to the clocks.
+
+The rules run on a bitboard Position, whose legal moves are generated once per
+move. Neither this module nor anything it imports loads pygame or the piece
+objects; Game keeps a Board in step with the Position to draw it.
+
+Usage:
+    python game_state.py --games 1000 --seed 1
+"""
+
+import argparse
+import datetime
+import random
+import sys
+import time
+
+import instrumentation
+from bitboard import (
+    Position,
+    START_FEN,
+    WHITE,
+    PAWN,
+    QUEEN,
+    COLOR_NAMES,
+    encode_move,
+    square,
+    parse_uci,
+)
+from tablebase import Tablebase
+from adjudication import Adjudicator, DRAW
+from pgn import PgnGame, write_games
+
+
+class ManualClock:
+    """
+    A clock that only moves when told to. Calling it returns the time in
+    milliseconds, like pygame.time.get_ticks.
+    """
+
+    def __init__(self, start=0):
+        self.ticks = start
+
+    def __call__(self):
+        return self.ticks
+
+    def advance(self, milliseconds):
+        self.ticks += milliseconds
+
+
+class GameState:
+    def __init__(self, fen=None, max_turn_time=600, get_ticks=None, tablebase_dir=None):
+        """
+        Set up a game.
+        :param fen: the starting position, None for the standard one
+        :param max_turn_time: seconds on each side's clock for the whole game
+        :param get_ticks: a function returning the time in milliseconds, a new
+            ManualClock by default
+        :param tablebase_dir: an optional directory of endgame tables; a position
+            they cover ends the game with its result
+        """
+        self.get_ticks = get_ticks if get_ticks is not None else ManualClock()
+
+        # Initialize game variables
+        self.selected_position = None
+        self.legal_moves = []  # Squares the selected piece can move to
+        # Piece codes of the pieces each color has lost, by color name
+        self.captured_pieces = {"w": [], "b": []}
+
+        # The game can start from any position, and its moves can be saved as PGN
+        self.start_fen = fen
+        self.position = Position.from_fen(fen if fen is not None else START_FEN)
+        self.turn = "white" if self.position.side == WHITE else "black"
+        self.moves = self.position.legal_moves()  # Of the side to move
+        self.result = "*"
+        self.message = None  # Why the game ended, once it has
+        self.player_names = {"w": "Player", "b": "Player"}
+
+        # Endgame tables, if given, end the game as soon as its result is known
+        self.tablebase = Tablebase(tablebase_dir) if tablebase_dir else None
+        # Counts the positions of the game for the draw rules, and decides when
+        # the game is over
+        self.adjudicator = Adjudicator(self.position, self.tablebase)
+
+        # Initialize game and time settings
+        self.max_turn_time = max_turn_time
+        self.white_total_time = self.max_turn_time
+        self.white_start_time = None
+        self.black_total_time = self.max_turn_time
+        self.black_start_time = None
+        self.start_clocks()
+
+    def start_clocks(self):
+        """(Re)start the clocks from now, e.g. when the game loop starts"""
+        self.white_start_time = self.black_start_time = self.get_ticks()
+
+    def click(self, row, col):
+        """
+        Handle a click on a square: select a piece of the side to move, or move
+        the selected piece to one of its legal squares.
+        :return: False when the click played a move that ended the game
+        """
+        sq = square(row, col)
+        code = self.position.squares[sq]
+
+        # If no piece is selected, select one of the side to move that can move
+        if self.selected_position is None:
+            if code and code >> 3 == self.position.side:
+                targets = []
+                for move in self.moves:
+                    # A promotion shows once, clicking it promotes to a queen
+                    if move & 63 == sq and move >> 12 in (0, QUEEN):
+                        targets.append(divmod(move >> 6 & 63, 8))
+                if targets:
+                    self.selected_position = (row, col)
+                    self.legal_moves = targets
+            return True
+
+        # If player selects the same piece, then reset the selection
+        if (row, col) == self.selected_position:
+            self.selected_position = None
+            self.legal_moves = []
+
+        # If player selects a legal move, then move the piece.
+        # Position.push handles castling, en passant and promotion.
+        elif (row, col) in self.legal_moves:
+            self.move_piece(row, col)
+            return self.check_for_game_over()
+        return True
+
+    def move_piece(self, row, col):
+        """Moves the selected piece on the board"""
+        from_sq = square(*self.selected_position)
+        to_sq = square(row, col)
+        # Pawns reaching the last row are always promoted to a queen
+        promotion = 0
+        if self.position.squares[from_sq] & 7 == PAWN and row in (0, 7):
+            promotion = QUEEN
+        self.play_move(encode_move(from_sq, to_sq, promotion))
+
+    def play_uci(self, text):
+        """
+        Play a move given in UCI notation, such as "e2e4" or "e7e8q".
+        :return: False when the move ended the game
+        :raises ValueError: if the move is not legal
+        """
+        move = parse_uci(text)
+        if move not in self.moves:
+            raise ValueError(f"Illegal move: {text!r}")
+        self.play_move(move)
+        return self.check_for_game_over()
+
+    def play_move(self, move):
+        """Plays a legal packed move on the board and hands the turn over"""
+        position = self.position
+        to_sq = move >> 6 & 63
+        captured = position.squares[to_sq]
+        if not captured and to_sq == position.ep_square:
+            if position.squares[move & 63] & 7 == PAWN:
+                captured = (position.side ^ 1) << 3 | PAWN  # En passant
+        position.push(move)
+        self.adjudicator.record()
+        with instrumentation.timer("movegen"):
+            self.moves = position.legal_moves()
+
+        # Check for captured piece
+        if captured:
+            self.captured_pieces[COLOR_NAMES[captured >> 3]].append(captured)
+        self.selected_position = None
+        self.legal_moves = []
+        self.switch_turns()
+
+    def switch_turns(self):
+        """Updates time and switches turns"""
+
+        # Existing logic to switch turn
+        self.turn = "black" if self.turn == "white" else "white"
+
+        # Add logic to update total time and reset start time
+        if self.turn == "white":
+            self.black_total_time -= (
+                self.get_ticks() - self.black_start_time
+            ) / 1000  # Update black's total time
+            self.white_start_time = self.get_ticks()  # Reset white's start time
+        else:
+            self.white_total_time -= (
+                self.get_ticks() - self.white_start_time
+            ) / 1000  # Update white's total time
+            self.black_start_time = self.get_ticks()  # Reset black's start time
+
+    def announce(self, message):
+        """Record why the game ended. Game also prints it."""
+        self.message = message
+
+    def check_for_game_over(self):
+        """
+        Detect the end of the game after a move, by the Adjudicator's rules: mate,
+        stalemate, the fifty-move rule, threefold repetition, insufficient
+        material and a result the tablebases show
+        """
+        outcome = self.adjudicator.result(self.moves)
+        if outcome is None:
+            return True
+        self.result, termination = outcome
+        winner = "White" if self.result == "1-0" else "Black"
+        if termination == "checkmate":
+            self.announce(f"Checkmate! {winner} wins!")
+        elif termination == "stalemate":
+            self.announce("Stalemate!")
+        elif termination == "tablebase":
+            if self.result == DRAW:
+                self.announce("Draw! The tablebases show neither side can win.")
+            else:
+                self.announce(f"{winner} wins! The tablebases show a forced mate.")
+        else:
+            self.announce(f"Draw by {termination}!")
+        return False
+
+    def check_for_time_up(self):
+        # Check if time's up
+        if self.white_total_time <= 0:
+            self.result = "0-1"
+            self.announce("White's time is up!")
+            return False
+        elif self.black_total_time <= 0:
+            self.result = "1-0"
+            self.announce("Black's time is up!")
+            return False
+        return True
+
+    def update_timer(self):
+        current_time = self.get_ticks()
+
+        if self.turn == "white":
+            elapsed_time = (
+                current_time - self.white_start_time
+            ) / 1000  # Time elapsed in seconds
+            self.white_total_time = max(0, self.white_total_time - elapsed_time)
+            self.white_start_time = (
+                current_time  # Reset the start time for the next frame
+            )
+        else:
+            elapsed_time = (
+                current_time - self.black_start_time
+            ) / 1000  # Time elapsed in seconds
+            self.black_total_time = max(0, self.black_total_time - elapsed_time)
+            self.black_start_time = (
+                current_time  # Reset the start time for the next frame
+            )
+
+    def to_pgn_game(self):
+        """The moves played so far, and the result if there is one, as a PgnGame"""
+        return PgnGame.from_moves(
+            self.position.move_stack,
+            {
+                "Event": "Simple Pygame Chess",
+                "Date": datetime.date.today().strftime("%Y.%m.%d"),
+                "White": self.player_names["w"],
+                "Black": self.player_names["b"],
+            },
+            fen=self.start_fen,
+            result=self.result,
+        )
+
+    def save_pgn(self, path):
+        """Write the moves played so far, and the result if there is one, as PGN"""
+        write_games(path, [self.to_pgn_game()])
+
+
+def play_random_game(rng, max_plies=200, think_time=(10, 500)):
+    """
+    Play a game of random moves on a ManualClock, clicking the pieces the way a
+    player would.
+    :param rng: the random.Random choosing the moves and the time each one takes
+    :param max_plies: stop the game after this many plies
+    :param think_time: the fewest and most milliseconds a move takes
+    :return: the finished GameState
+    """
+    clock = ManualClock()
+    state = GameState(max_turn_time=60, get_ticks=clock)
+    state.start_clocks()
+    running = True
+    while running and len(state.position.move_stack) < max_plies:
+        move = rng.choice(state.moves)
+        clock.advance(rng.randint(*think_time))
+        state.update_timer()
+        if not state.check_for_time_up():
+            break
+        # Promotions are always to a queen when clicking, as in the game
+        state.click(*divmod(move & 63, 8))
+        running = state.click(*divmod(move >> 6 & 63, 8))
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play scripted games headless")
+    parser.add_argument("--games", type=int, default=1000, help="games to play")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--max-plies", type=int, default=200, help="plies per game")
+    parser.add_argument("--pgn", help="PGN file to write the games to")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    games, plies, results = [], 0, {}
+    start = time.perf_counter()
+    for _ in range(args.games):
+        state = play_random_game(rng, args.max_plies)
+        plies += len(state.position.move_stack)
+        results[state.result] = results.get(state.result, 0) + 1
+        if args.pgn:
+            games.append(state.to_pgn_game())
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{args.games} games, {plies} plies in {elapsed:.2f}s: "
+        f"{args.games / elapsed:,.0f} games/s, {plies / elapsed:,.0f} plies/s"
+    )
+    print("results: " + ", ".join(f"{r} {n}" for r, n in sorted(results.items())))
+    if args.pgn:
+        write_games(args.pgn, games)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
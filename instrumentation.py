@@ -0,0 +1,239 @@
+"""
+Counters, gauges and timing histograms for finding where the time goes.
+
+Instrumentation is off by default. Code on a hot path checks the ENABLED flag of
+this module before measuring anything, so when it is off the cost is that one
+check; timer() hands back a shared do-nothing context. Once enabled, every
+histogram keeps a count, a total, a maximum and power-of-two buckets of
+microseconds, which is enough for percentiles at a fixed, small cost per sample.
+
+snapshot() returns everything as a dict and dump() writes it as JSON. For a
+closer look, start_profile() and stop_profile() run cProfile over a stretch of the
+program, and Sampler records the main thread's call stack at intervals, which is
+cheap enough to leave running while waiting for a stall to happen.
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+ENABLED = False
+
+BUCKETS = 32  # Bucket i holds samples below 2**i microseconds, the last the rest
+
+_counters = Counter()
+_gauges = {}
+_histograms = {}
+_profiler = None
+
+
+def enable(enabled=True):
+    """Turn measuring on or off. What was recorded so far is kept."""
+    global ENABLED
+    ENABLED = enabled
+
+
+def reset():
+    """Forget everything recorded"""
+    _counters.clear()
+    _gauges.clear()
+    _histograms.clear()
+
+
+def count(name, amount=1):
+    """Add to a counter"""
+    if ENABLED:
+        _counters[name] += amount
+
+
+def gauge(name, value):
+    """Set a value that is reported as last seen, such as nodes per second"""
+    if ENABLED:
+        _gauges[name] = value
+
+
+class Histogram:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket if bucket < BUCKETS else BUCKETS - 1] += 1
+
+    def percentile(self, fraction):
+        """An upper bound on the given fraction of the samples, in seconds"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bucket, samples in enumerate(self.buckets):
+            seen += samples
+            if seen >= rank:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        """The count, and the mean, p50, p99 and maximum in milliseconds"""
+        return {
+            "count": self.count,
+            "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+            "p50_ms": 1000 * self.percentile(0.5),
+            "p99_ms": 1000 * self.percentile(0.99),
+            "max_ms": 1000 * self.max,
+            "total_ms": 1000 * self.total,
+        }
+
+
+def observe(name, seconds):
+    """Add a duration to a histogram"""
+    if ENABLED:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(seconds)
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+    """
+    Time a block into a histogram: with timer("draw"): ...
+    :return: a context manager, one that does nothing when disabled
+    """
+    return _Timer(name) if ENABLED else _NULL_TIMER
+
+
+def histogram(name):
+    """The histogram recorded under a name, or None"""
+    return _histograms.get(name)
+
+
+def snapshot():
+    """Everything recorded, as a dict ready for JSON"""
+    return {
+        "time": time.time(),
+        "counters": dict(_counters),
+        "gauges": dict(_gauges),
+        "histograms": {
+            name: histogram.summary() for name, histogram in sorted(_histograms.items())
+        },
+    }
+
+
+def dump(path):
+    """Write snapshot() to a JSON file"""
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(snapshot(), file, indent=2)
+
+
+def profiling():
+    return _profiler is not None
+
+
+def start_profile():
+    """Start profiling every call with cProfile until stop_profile"""
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def stop_profile(path=None, limit=25):
+    """
+    Stop profiling.
+    :param path: an optional file to save the raw stats to, for pstats or
+        snakeviz
+    :param limit: how many functions to list
+    :return: the functions with the most time of their own, as text
+    """
+    global _profiler
+    if _profiler is None:
+        return ""
+    _profiler.disable()
+    if path is not None:
+        _profiler.dump_stats(path)
+    text = io.StringIO()
+    pstats.Stats(_profiler, stream=text).sort_stats("tottime").print_stats(limit)
+    _profiler = None
+    return text.getvalue()
+
+
+class Sampler:
+    def __init__(self, interval=0.005, thread_id=None):
+        """
+        Record the call stack of a thread at intervals, from a background thread.
+        :param interval: seconds between samples
+        :param thread_id: the thread to watch, the main thread by default
+        """
+        self.interval = interval
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.stacks = Counter()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def dump(self, path):
+        """Write the stacks in the folded format flame graph tools read"""
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, samples in self.stacks.most_common():
+                file.write(f"{stack} {samples}\n")
@@ -0,0 +1,227 @@
+"""
+Load test the multiplayer server.
+
+Opens a number of connections and has them seek games until the requested
+number are being played at once. Every game is played with random legal moves,
+chosen with the bitboard move generator, as fast as the server answers, and
+resigned after a number of plies if it has not ended. The time from sending a
+move to seeing the server's broadcast of it is that move's latency.
+
+Usage:
+    python loadgen.py --games 2000 --connections 100 --plies 60
+    python loadgen.py --serve --games 500
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+from bitboard import Position, move_to_uci, parse_uci
+from server import DEFAULT_PORT, COLORS
+
+
+class LoadClient:
+    def __init__(self, stats, rng, plies, clock):
+        """
+        One connection of the load test.
+        :param stats: the dict shared by every client, counting games and moves
+            and collecting the latencies
+        :param rng: the random.Random choosing the moves
+        :param plies: resign a game after this many plies
+        :param clock: the seconds each side gets
+        """
+        self.stats = stats
+        self.rng = rng
+        self.plies = plies
+        self.clock = clock
+        self.games = {}  # Game id to (position, our colors)
+        self.sent = {}  # Game id to the time its last move was sent
+        self.writer = None
+
+    def send(self, message):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+
+    def play(self, game_id):
+        """Move in a game if it is our turn there"""
+        position, colors = self.games[game_id]
+        # Wait for the server to confirm a move before sending the next one
+        if COLORS[position.side] not in colors or game_id in self.sent:
+            return
+        if len(position.move_stack) >= self.plies:
+            self.sent[game_id] = None
+            self.send({"type": "resign", "game": game_id})
+            return
+        moves = position.legal_moves()
+        if not moves:
+            return  # Mate or stalemate, the server is about to say so
+        move = self.rng.choice(moves)
+        self.sent[game_id] = time.perf_counter()
+        self.send({"type": "move", "game": game_id, "move": move_to_uci(move)})
+
+    async def run(self, host, port, seeks, done):
+        """
+        Seek games and play them until this connection's share has ended.
+        :param seeks: how many games to seek
+        :param done: an asyncio.Event set once every game of the test is over
+        """
+        reader, self.writer = await asyncio.open_connection(host, port, limit=1 << 16)
+        for _ in range(seeks):
+            self.send({"type": "seek", "time": self.clock})
+        stats = self.stats
+        while not done.is_set():
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            kind = message["type"]
+            game_id = message.get("game")
+            if kind == "start":
+                if game_id in self.games:  # Both sides on this connection
+                    self.games[game_id][1].add(message["color"])
+                else:
+                    position = Position.from_fen(message["fen"])
+                    self.games[game_id] = (position, {message["color"]})
+                self.play(game_id)
+            elif kind == "move":
+                position, _ = self.games[game_id]
+                sent = self.sent.pop(game_id, None)
+                if sent is not None:
+                    stats["latencies"].append(time.perf_counter() - sent)
+                    stats["moves"] += 1
+                position.push(parse_uci(message["move"]))
+                self.play(game_id)
+            elif kind == "over":
+                self.games.pop(game_id, None)
+                self.sent.pop(game_id, None)
+                # Both players hear of the end, the game is counted once
+                if game_id not in stats["finished"]:
+                    stats["finished"].add(game_id)
+                    result = message["result"]
+                    stats["results"][result] = stats["results"].get(result, 0) + 1
+                    if len(stats["finished"]) == stats["games"]:
+                        done.set()
+            elif kind == "error":
+                stats["errors"] += 1
+            await self.writer.drain()
+        self.writer.close()
+
+
+def percentile(values, fraction):
+    """The value below which a fraction of the sorted values fall"""
+    if not values:
+        return 0.0
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+async def run(host, port, games, connections, plies, clock, seed=0):
+    """
+    Play games against a running server.
+    :return: a dict with the games finished, the moves, the time taken, moves
+        per second, the errors, the results and the latency percentiles in
+        seconds
+    """
+    rng = random.Random(seed)
+    stats = {
+        "games": games,
+        "moves": 0,
+        "finished": set(),
+        "errors": 0,
+        "latencies": [],
+        "results": {},
+    }
+    done = asyncio.Event()
+    # Two seeks make a game, spread them over the connections
+    seeks = [2 * games // connections] * connections
+    for i in range(2 * games - sum(seeks)):
+        seeks[i] += 1
+    clients = [LoadClient(stats, rng, plies, clock) for _ in range(connections)]
+    start = time.perf_counter()
+    tasks = [
+        asyncio.create_task(client.run(host, port, count, done))
+        for client, count in zip(clients, seeks)
+    ]
+
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies = sorted(stats["latencies"])
+    return {
+        "games": games,
+        "moves": stats["moves"],
+        "time": elapsed,
+        "moves_per_second": stats["moves"] / elapsed if elapsed else 0.0,
+        "errors": stats["errors"],
+        "results": stats["results"],
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "max": latencies[-1] if latencies else 0.0,
+    }
+
+
+def _serve(host, port):
+    """Process entry point for --serve"""
+    import server
+
+    server.main(["--host", host, "--port", str(port), "--report", "0"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the game server")
+    parser.add_argument("--host", default="127.0.0.1", help="server address")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port")
+    parser.add_argument("--games", type=int, default=1000, help="concurrent games")
+    parser.add_argument("--connections", type=int, default=50, help="sockets")
+    parser.add_argument("--plies", type=int, default=60, help="resign after")
+    parser.add_argument("--time", type=float, default=600, help="seconds per side")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--serve", action="store_true", help="start a server process to test"
+    )
+    args = parser.parse_args(argv)
+
+    process = None
+    if args.serve:
+        process = multiprocessing.get_context("spawn").Process(
+            target=_serve, args=(args.host, args.port), daemon=True
+        )
+        process.start()
+        time.sleep(1)  # Let it start listening
+    try:
+        stats = asyncio.run(
+            run(
+                args.host,
+                args.port,
+                args.games,
+                args.connections,
+                args.plies,
+                args.time,
+                args.seed,
+            )
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+
+    print(
+        f"{stats['games']} games, {stats['moves']:,} moves in {stats['time']:.2f}s: "
+        f"{stats['moves_per_second']:,.0f} moves/s, {stats['errors']} errors"
+    )
+    print(
+        f"latency p50 {1000 * stats['p50']:.1f} ms, p99 {1000 * stats['p99']:.1f} ms, "
+        f"max {1000 * stats['max']:.1f} ms"
+    )
+    print(
+        "results: " + ", ".join(f"{r} {n}" for r, n in sorted(stats["results"].items()))
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
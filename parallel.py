@@ -0,0 +1,172 @@
+"""
+Parallel search over several processes (Lazy SMP).
+
+Every worker searches the same root position with its own Engine, and all of them
+share one transposition table in a multiprocessing.shared_memory buffer. Helpers
+profit from each other's entries and half of them start one iteration deeper, so
+together they reach a given depth sooner than one process. Worker 0 is the main
+worker: it keeps time, and when it finishes the helpers are stopped.
+
+Usage:
+    python parallel.py --workers 1,2,4,8 --depth 6
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+
+from bitboard import Position, START_FEN, move_to_uci
+from engine import Engine, TimeManager, MAX_PLY, format_score
+from engine_worker import StopFlag
+from transposition import TranspositionTable, table_words
+
+
+def _worker_main(index, shm_name, hash_mb, commands, results, stop_id):
+    """Process entry point for one search worker"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    engine = Engine(table=TranspositionTable(hash_mb, buffer=shm.buf))
+    while True:
+        command = commands.get()
+        if command[0] == "quit":
+            break
+        _, search_id, position, remaining, max_depth, node_limit = command
+        engine.stop_event = StopFlag(stop_id, search_id)
+        # Only the main worker keeps time, the helpers run until they are stopped
+        main = index == 0
+        info = engine.search(
+            position,
+            max_depth,
+            TimeManager(remaining) if main and remaining is not None else None,
+            node_limit if main else None,
+            start_depth=1 + (index & 1),
+        )
+        results.put((index, search_id, info))
+    # The table views the shared buffer, it has to go before the buffer can close
+    engine.table = None
+    shm.close()
+
+
+class ParallelSearch:
+    def __init__(self, workers=None, hash_mb=64):
+        """
+        Start the worker processes and the shared transposition table.
+        :param workers: the number of worker processes, one per core by default
+        :param hash_mb: the size of the shared transposition table in megabytes
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=table_words(hash_mb) * 8
+        )
+        context = multiprocessing.get_context("spawn")
+        self.results = context.Queue()
+        self.stop_id = context.RawValue("q", 0)
+        self.search_id = 0
+        self.commands = []
+        self.processes = []
+        for index in range(self.workers):
+            commands = context.Queue()
+            process = context.Process(
+                target=_worker_main,
+                args=(
+                    index,
+                    self.shm.name,
+                    hash_mb,
+                    commands,
+                    self.results,
+                    self.stop_id,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self.commands.append(commands)
+            self.processes.append(process)
+
+    def search(self, position, max_depth=MAX_PLY, remaining=None, node_limit=None):
+        """
+        Search a position with every worker and merge their results.
+        :param position: the Position to search
+        :param max_depth: the deepest iteration to run
+        :param remaining: seconds left on the clock, budgeted like Engine does
+        :param node_limit: stop the main worker after roughly this many nodes
+        :return: the info dict of the deepest finished search, with "nodes" and
+            "nps" summed over all workers and "workers" holding each worker's info
+        """
+        self.search_id += 1
+        start = time.perf_counter()
+        for commands in self.commands:
+            commands.put(
+                ("search", self.search_id, position, remaining, max_depth, node_limit)
+            )
+
+        infos = [None] * self.workers
+        while None in infos:
+            index, search_id, info = self.results.get()
+            if search_id != self.search_id:
+                continue
+            infos[index] = info
+            if index == 0:
+                # The main worker is done, so the helpers are too
+                self.stop_id.value = self.search_id
+        elapsed = time.perf_counter() - start
+
+        # Trust the deepest finished iteration, the main worker's on a tie
+        best = max(enumerate(infos), key=lambda item: (item[1]["depth"], -item[0]))[1]
+        nodes = sum(info["nodes"] for info in infos)
+        return dict(
+            best,
+            nodes=nodes,
+            time=elapsed,
+            nps=int(nodes / max(elapsed, 1e-9)),
+            workers=infos,
+        )
+
+    def close(self):
+        """Stop the workers and free the shared table"""
+        self.stop_id.value = self.search_id
+        for commands in self.commands:
+            commands.put(("quit",))
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.shm.close()
+        self.shm.unlink()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure Lazy SMP scaling")
+    parser.add_argument("--fen", default=START_FEN, help="position to search")
+    parser.add_argument("--depth", type=int, default=5, help="depth to search to")
+    parser.add_argument(
+        "--workers",
+        default=",".join(str(n) for n in (1, 2, 4, os.cpu_count() or 1)),
+        help="comma separated worker counts to compare",
+    )
+    parser.add_argument("--hash", type=int, default=64, help="shared table size in MB")
+    args = parser.parse_args(argv)
+
+    counts = sorted({int(n) for n in args.workers.split(",")})
+    position = Position.from_fen(args.fen)
+    print(f"{'workers':>7} {'time':>8} {'nodes':>10} {'nps':>10} {'speedup':>8}  pv")
+    baseline = None
+    for workers in counts:
+        search = ParallelSearch(workers, args.hash)
+        try:
+            info = search.search(position, args.depth)
+        finally:
+            search.close()
+        baseline = baseline or info["time"]
+        print(
+            f"{workers:>7} {info['time']:>7.2f}s {info['nodes']:>10} "
+            f"{info['nps']:>10} {baseline / info['time']:>7.2f}x  "
+            f"{format_score(info['score'])} "
+            f"{' '.join(move_to_uci(move) for move in info['pv'])}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
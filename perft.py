@@ -0,0 +1,212 @@
+"""
+Perft: count the leaf nodes of the move tree to a fixed depth.
+
+The node counts for the positions below are well known, so any difference means
+the move generator broke a rule, and the nodes per second make a throughput
+baseline for changes to the generator.
+
+Usage:
+    python perft.py --depth 4                     # start position
+    python perft.py --fen "<fen>" --depth 3 --divide
+    python perft.py --suite --max-depth 3         # check every standard position
+    python perft.py --depth 5 --hash 64           # hash perft with a 64 MB table
+    python perft.py --suite --save-baseline perft_baseline.json
+    python perft.py --suite --baseline perft_baseline.json --tolerance 10
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from bitboard import Position, START_FEN, move_to_uci
+from transposition import TranspositionTable
+
+# Standard test positions with their known node counts per depth
+PERFT_SUITE = [
+    (
+        "start",
+        START_FEN,
+        {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609},
+    ),
+    (
+        "kiwipete",  # Castling, pins and promotions all at once
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        {1: 48, 2: 2039, 3: 97862, 4: 4085603},
+    ),
+    (
+        "en passant",  # En passant captures that expose the king on the rank
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624},
+    ),
+    (
+        "promotion",  # Promotions with check and castling rights for one side
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        {1: 6, 2: 264, 3: 9467, 4: 422333},
+    ),
+    (
+        "discovered check",  # Discovered checks and promotion to a checking piece
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        {1: 44, 2: 1486, 3: 62379, 4: 2103487},
+    ),
+    (
+        "middlegame",
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        {1: 46, 2: 2079, 3: 89890, 4: 3894594},
+    ),
+]
+
+
+def perft(position, depth, table=None):
+    """
+    Count the leaf nodes of the legal move tree.
+    :param position: the Position to search from, left unchanged
+    :param depth: the number of plies to search
+    :param table: an optional TranspositionTable to reuse the counts of
+        positions reached again through a different move order (hash perft)
+    :return: the number of leaf nodes
+    """
+    if depth == 0:
+        return 1
+    if table is not None and depth > 1:
+        data = table.probe_raw(position.key)
+        if data is not None and data & 0xFF == depth:
+            return data >> 16
+    moves = position.legal_moves()
+    # Bulk counting: the moves at the last ply are the leaves, no need to play them
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        position.push(move)
+        nodes += perft(position, depth - 1, table)
+        position.pop()
+    if table is not None:
+        table.store_raw(position.key, depth | nodes << 16)
+    return nodes
+
+
+def divide(position, depth, table=None):
+    """
+    Count the leaf nodes below each root move, to narrow down a wrong total.
+    :return: a dict mapping each root move in UCI form to its node count
+    """
+    counts = {}
+    for move in position.legal_moves():
+        position.push(move)
+        counts[move_to_uci(move)] = (
+            perft(position, depth - 1, table) if depth > 1 else 1
+        )
+        position.pop()
+    return counts
+
+
+def timed_perft(fen, depth, hash_mb=0):
+    """
+    Run perft on a FEN and time it.
+    :param hash_mb: the size of the hash perft table, 0 to run without one
+    :return: (nodes, seconds)
+    """
+    position = Position.from_fen(fen)
+    table = TranspositionTable(hash_mb) if hash_mb else None
+    start = time.perf_counter()
+    nodes = perft(position, depth, table)
+    return nodes, time.perf_counter() - start
+
+
+def run_suite(max_depth, hash_mb=0, out=sys.stdout):
+    """
+    Run every suite position up to max_depth and check the node counts.
+    :return: (all_correct, nodes_per_second) over the whole suite
+    """
+    all_correct = True
+    total_nodes, total_time = 0, 0.0
+    for name, fen, expected in PERFT_SUITE:
+        for depth in sorted(expected):
+            if depth > max_depth:
+                break
+            nodes, seconds = timed_perft(fen, depth, hash_mb)
+            total_nodes += nodes
+            total_time += seconds
+            ok = nodes == expected[depth]
+            all_correct &= ok
+            print(
+                f"{name:<18} depth {depth}  {nodes:>10} nodes  "
+                f"{nodes / max(seconds, 1e-9):>12,.0f} nps  "
+                f"{'ok' if ok else f'FAIL (expected {expected[depth]})'}",
+                file=out,
+            )
+    return all_correct, total_nodes / max(total_time, 1e-9)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft for the chess move generator")
+    parser.add_argument("--fen", default=START_FEN, help="position to search")
+    parser.add_argument("--depth", type=int, default=3, help="plies to search")
+    parser.add_argument(
+        "--divide", action="store_true", help="print the count below each root move"
+    )
+    parser.add_argument(
+        "--suite", action="store_true", help="check all standard positions"
+    )
+    parser.add_argument(
+        "--max-depth", type=int, default=3, help="deepest suite depth to run"
+    )
+    parser.add_argument(
+        "--min-nps", type=float, help="fail when nodes per second fall below this"
+    )
+    parser.add_argument(
+        "--hash", type=int, default=0, help="hash perft table size in MB (0 = off)"
+    )
+    parser.add_argument("--baseline", help="JSON baseline to compare throughput to")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=10.0,
+        help="percent the nps may drop below the baseline before failing",
+    )
+    parser.add_argument("--save-baseline", help="write the measured nps to this file")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        ok, nps = run_suite(args.max_depth, args.hash)
+        print(f"suite: {'ok' if ok else 'FAILED'}  {nps:,.0f} nps")
+    elif args.divide:
+        position = Position.from_fen(args.fen)
+        table = TranspositionTable(args.hash) if args.hash else None
+        start = time.perf_counter()
+        counts = divide(position, args.depth, table)
+        seconds = time.perf_counter() - start
+        for move, nodes in sorted(counts.items()):
+            print(f"{move}: {nodes}")
+        nodes = sum(counts.values())
+        nps = nodes / max(seconds, 1e-9)
+        print(f"\nmoves: {len(counts)}  nodes: {nodes}  {nps:,.0f} nps")
+        ok = True
+    else:
+        nodes, seconds = timed_perft(args.fen, args.depth, args.hash)
+        nps = nodes / max(seconds, 1e-9)
+        print(f"depth {args.depth}: {nodes} nodes in {seconds:.3f}s, {nps:,.0f} nps")
+        ok = True
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"nps": nps, "max_depth": args.max_depth}, f)
+    if args.min_nps is not None and nps < args.min_nps:
+        print(f"throughput {nps:,.0f} nps is below the minimum {args.min_nps:,.0f}")
+        ok = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["nps"]
+        floor = baseline * (1 - args.tolerance / 100)
+        if nps < floor:
+            print(
+                f"throughput regression: {nps:,.0f} nps is more than "
+                f"{args.tolerance:g}% below the baseline {baseline:,.0f} nps"
+            )
+            ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
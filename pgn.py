@@ -0,0 +1,315 @@
+"""
+Standard algebraic notation and PGN reading and writing.
+
+read_games streams games out of a PGN file one at a time, reading it line by line
+so memory stays flat however large the file is. It only splits the movetext into
+SAN tokens; a game's moves are parsed against the board when they are asked for,
+so skimming headers over a large dump is limited by the disk. This module does not
+import pygame.
+"""
+
+import re
+
+from bitboard import (
+    Position,
+    START_FEN,
+    WHITE,
+    PAWN,
+    KING,
+    PIECE_SYMBOLS,
+    SYMBOL_KINDS,
+    move_from,
+    move_to,
+    move_promotion,
+    square_name,
+    parse_square,
+)
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+# The Seven Tag Roster, written first and in this order
+ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+
+SAN_RE = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+# Movetext tokens: comments, variation brackets, NAGs, move numbers, results and
+# anything else, which is taken to be a move
+TOKEN_RE = re.compile(
+    r"\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s(){};$]+"
+)
+MOVE_NUMBER_RE = re.compile(r"\d+\.+")
+HEADER_RE = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+
+
+def move_to_san(position, move):
+    """
+    Write a move in standard algebraic notation.
+    :param position: the position the move is played in, left unchanged
+    :param move: a legal packed move
+    :return: the SAN string, such as "Nbd7", "exd6", "e8=Q+" or "O-O"
+    """
+    from_sq, to_sq = move_from(move), move_to(move)
+    kind = position.squares[from_sq] & 7
+    if kind == KING and abs(from_sq - to_sq) == 2:
+        san = "O-O" if to_sq > from_sq else "O-O-O"
+    elif kind == PAWN:
+        san = ""
+        if from_sq % 8 != to_sq % 8:
+            san = square_name(from_sq)[0] + "x"
+        san += square_name(to_sq)
+        if move_promotion(move):
+            san += "=" + PIECE_SYMBOLS[move_promotion(move)].upper()
+    else:
+        # Name the file, the rank or both if another piece of the same kind can
+        # reach the same square
+        rivals = [
+            move_from(other)
+            for other in position.legal_moves()
+            if move_to(other) == to_sq
+            and move_from(other) != from_sq
+            and position.squares[move_from(other)] & 7 == kind
+        ]
+        name = square_name(from_sq)
+        disambiguation = ""
+        if rivals:
+            if all(sq % 8 != from_sq % 8 for sq in rivals):
+                disambiguation = name[0]
+            elif all(sq // 8 != from_sq // 8 for sq in rivals):
+                disambiguation = name[1]
+            else:
+                disambiguation = name
+        capture = "x" if position.squares[to_sq] else ""
+        san = PIECE_SYMBOLS[kind].upper() + disambiguation + capture
+        san += square_name(to_sq)
+
+    position.push(move)
+    if position.in_check():
+        san += "#" if not position.legal_moves() else "+"
+    position.pop()
+    return san
+
+
+def parse_san(position, text):
+    """
+    Find the legal move a SAN string stands for.
+    :param position: the position the move is played in
+    :param text: the SAN string, check marks and annotations such as "!?" allowed
+    :return: the packed move
+    :raises ValueError: if the text is not a legal move in the position
+    """
+    san = text.rstrip("+#!?")
+    legal_moves = position.legal_moves()
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        king_sq = position.king_square(position.side)
+        to_sq = king_sq + (2 if len(san) == 3 else -2)
+        for move in legal_moves:
+            if (
+                move_from(move) == king_sq
+                and move_to(move) == to_sq
+                and position.squares[king_sq] & 7 == KING
+            ):
+                return move
+        raise ValueError(f"Illegal move: {text!r}")
+
+    match = SAN_RE.match(san)
+    if match is None:
+        raise ValueError(f"Invalid SAN: {text!r}")
+    piece, from_file, from_rank, to_name, promotion = match.groups()
+    kind = SYMBOL_KINDS[piece.lower()] if piece else PAWN
+    to_sq = parse_square(to_name)
+    promotion = SYMBOL_KINDS[promotion.lower()] if promotion else 0
+
+    found = None
+    for move in legal_moves:
+        from_sq = move_from(move)
+        if (
+            move_to(move) != to_sq
+            or position.squares[from_sq] & 7 != kind
+            or move_promotion(move) != promotion
+        ):
+            continue
+        name = square_name(from_sq)
+        if (from_file and name[0] != from_file) or (from_rank and name[1] != from_rank):
+            continue
+        if found is not None:
+            raise ValueError(f"Ambiguous move: {text!r}")
+        found = move
+    if found is None:
+        raise ValueError(f"Illegal move: {text!r}")
+    return found
+
+
+class PgnGame:
+    def __init__(self, headers=None, san_moves=None, result="*"):
+        """
+        A game as read from or written to PGN.
+        :param headers: the tag pairs, as a dict
+        :param san_moves: the moves of the main line in SAN
+        :param result: "1-0", "0-1", "1/2-1/2" or "*"
+        """
+        self.headers = headers if headers is not None else {}
+        self.san_moves = san_moves if san_moves is not None else []
+        self.result = result
+
+    @classmethod
+    def from_moves(cls, moves, headers=None, fen=None, result="*"):
+        """
+        Build a game from packed moves, writing them out in SAN.
+        :param moves: the packed moves, played from the starting position
+        :param headers: extra tag pairs
+        :param fen: the starting position, None for the standard one
+        :param result: the result of the game
+        """
+        game = cls(dict(headers or {}), [], result)
+        if fen is not None and fen != START_FEN:
+            game.headers["SetUp"] = "1"
+            game.headers["FEN"] = fen
+        game.headers["Result"] = result
+        position = game.starting_position()
+        for move in moves:
+            game.san_moves.append(move_to_san(position, move))
+            position.push(move)
+        return game
+
+    def starting_position(self):
+        """The position before the first move, from the FEN tag if there is one"""
+        return Position.from_fen(self.headers.get("FEN", START_FEN))
+
+    def moves(self):
+        """
+        Parse the moves against the board.
+        :return: a generator of (position, move) pairs, where position is the one
+            the move is played in. It is a single Position that is updated as the
+            game goes on, so copy it to keep it.
+        :raises ValueError: at the first illegal or unreadable move
+        """
+        position = self.starting_position()
+        for san in self.san_moves:
+            move = parse_san(position, san)
+            yield position, move
+            position.push(move)
+
+    def end_position(self):
+        """The position after the last move"""
+        position = self.starting_position()
+        for san in self.san_moves:
+            position.push(parse_san(position, san))
+        return position
+
+    def to_pgn(self, width=80):
+        """
+        Write the game as PGN text, ending with a blank line.
+        :param width: the longest movetext line
+        """
+        headers = dict(self.headers, Result=self.result)
+        lines = [f'[{name} "{_escape(headers.get(name, "?"))}"]' for name in ROSTER]
+        lines += [
+            f'[{name} "{_escape(value)}"]'
+            for name, value in headers.items()
+            if name not in ROSTER
+        ]
+        lines.append("")
+
+        position = self.starting_position()
+        number, side = position.fullmove_number, position.side
+        tokens = []
+        for i, san in enumerate(self.san_moves):
+            if side == WHITE:
+                tokens.append(f"{number}.")
+            elif i == 0:
+                tokens.append(f"{number}...")
+            tokens.append(san)
+            if side != WHITE:
+                number += 1
+            side ^= 1
+        tokens.append(self.result)
+
+        line = ""
+        for token in tokens:
+            if line and len(line) + 1 + len(token) > width:
+                lines.append(line)
+                line = token
+            else:
+                line = f"{line} {token}" if line else token
+        lines.append(line)
+        return "\n".join(lines) + "\n\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _unescape(value):
+    return re.sub(r"\\(.)", r"\1", value) if "\\" in value else value
+
+
+def _parse_movetext(text):
+    """Split movetext into the main line's SAN moves and the result"""
+    if not any(char in text for char in "{(;$"):
+        # Nothing but move numbers and moves, the common case in bulk dumps
+        san_moves = MOVE_NUMBER_RE.sub(" ", text).split()
+        if san_moves and san_moves[-1] in RESULTS:
+            return san_moves[:-1], san_moves[-1]
+        return san_moves, "*"
+
+    san_moves, result, depth = [], "*", 0
+    for token in TOKEN_RE.findall(text):
+        first = token[0]
+        if first == "(":
+            depth += 1
+        elif first == ")":
+            depth -= 1
+        elif depth or first in "{;$" or token[-1] == ".":
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            san_moves.append(token)
+    return san_moves, result
+
+
+def read_games(source):
+    """
+    Read games from a PGN file one at a time.
+    :param source: a path or an open text file
+    :return: a generator of PgnGame, each built when it is reached
+    """
+    if isinstance(source, str):
+        with open(source, encoding="utf-8", errors="replace") as file:
+            yield from read_games(file)
+        return
+
+    headers, movetext, comment_depth = {}, [], 0
+    for line in source:
+        # A tag pair after movetext starts the next game, unless it is inside a
+        # comment that runs over several lines
+        if line.startswith("[") and not comment_depth:
+            if movetext:
+                yield PgnGame(headers, *_parse_movetext("".join(movetext)))
+                headers, movetext = {}, []
+            match = HEADER_RE.match(line)
+            if match:
+                headers[match.group(1)] = _unescape(match.group(2))
+        elif line.startswith("%"):
+            continue  # Escaped line, ignored by definition
+        elif movetext or line.strip():
+            movetext.append(line)
+            if "{" in line or "}" in line:
+                comment_depth += line.count("{") - line.count("}")
+    if headers or movetext:
+        yield PgnGame(headers, *_parse_movetext("".join(movetext)))
+
+
+def write_games(path, games):
+    """
+    Write games to a PGN file.
+    :param path: the file to write
+    :param games: an iterable of PgnGame
+    :return: the number of games written
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as file:
+        for game in games:
+            file.write(game.to_pgn())
+            count += 1
+    return count
@@ -0,0 +1,124 @@
+"""
+Material and piece-square values.
+
+These are the terms of the evaluation that only depend on which piece stands on
+which square, so Position keeps their sums up to date as moves are pushed and
+popped, the way it keeps its Zobrist key. The module imports nothing, so
+bitboard.py can use it; evaluation.py builds the rest of the evaluation on top.
+"""
+
+# Colors and piece kinds, numbered as bitboard.py numbers them
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+
+PIECE_VALUES = {PAWN: 100, KNIGHT: 320, BISHOP: 330, ROOK: 500, QUEEN: 900, KING: 0}
+
+# Game phase: 24 with all minor and major pieces on the board, 0 with none left
+PHASE_WEIGHTS = {PAWN: 0, KNIGHT: 1, BISHOP: 1, ROOK: 2, QUEEN: 4, KING: 0}
+MAX_PHASE = 24
+
+# Piece-square tables from white's point of view, laid out like Board.board so
+# the first row is the eighth rank. Black looks them up with the rows mirrored.
+# fmt: off
+PAWN_TABLE = [
+     0,   0,   0,   0,   0,   0,   0,   0,
+    50,  50,  50,  50,  50,  50,  50,  50,
+    10,  10,  20,  30,  30,  20,  10,  10,
+     5,   5,  10,  25,  25,  10,   5,   5,
+     0,   0,   0,  20,  20,   0,   0,   0,
+     5,  -5, -10,   0,   0, -10,  -5,   5,
+     5,  10,  10, -20, -20,  10,  10,   5,
+     0,   0,   0,   0,   0,   0,   0,   0,
+]
+KNIGHT_TABLE = [
+   -50, -40, -30, -30, -30, -30, -40, -50,
+   -40, -20,   0,   0,   0,   0, -20, -40,
+   -30,   0,  10,  15,  15,  10,   0, -30,
+   -30,   5,  15,  20,  20,  15,   5, -30,
+   -30,   0,  15,  20,  20,  15,   0, -30,
+   -30,   5,  10,  15,  15,  10,   5, -30,
+   -40, -20,   0,   5,   5,   0, -20, -40,
+   -50, -40, -30, -30, -30, -30, -40, -50,
+]
+BISHOP_TABLE = [
+   -20, -10, -10, -10, -10, -10, -10, -20,
+   -10,   0,   0,   0,   0,   0,   0, -10,
+   -10,   0,   5,  10,  10,   5,   0, -10,
+   -10,   5,   5,  10,  10,   5,   5, -10,
+   -10,   0,  10,  10,  10,  10,   0, -10,
+   -10,  10,  10,  10,  10,  10,  10, -10,
+   -10,   5,   0,   0,   0,   0,   5, -10,
+   -20, -10, -10, -10, -10, -10, -10, -20,
+]
+ROOK_TABLE = [
+     0,   0,   0,   0,   0,   0,   0,   0,
+     5,  10,  10,  10,  10,  10,  10,   5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+     0,   0,   0,   5,   5,   0,   0,   0,
+]
+QUEEN_TABLE = [
+   -20, -10, -10,  -5,  -5, -10, -10, -20,
+   -10,   0,   0,   0,   0,   0,   0, -10,
+   -10,   0,   5,   5,   5,   5,   0, -10,
+    -5,   0,   5,   5,   5,   5,   0,  -5,
+     0,   0,   5,   5,   5,   5,   0,  -5,
+   -10,   5,   5,   5,   5,   5,   0, -10,
+   -10,   0,   5,   0,   0,   0,   0, -10,
+   -20, -10, -10,  -5,  -5, -10, -10, -20,
+]
+KING_MIDDLEGAME_TABLE = [
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -20, -30, -30, -40, -40, -30, -30, -20,
+   -10, -20, -20, -20, -20, -20, -20, -10,
+    20,  20,   0,   0,   0,   0,  20,  20,
+    20,  30,  10,   0,   0,  10,  30,  20,
+]
+KING_ENDGAME_TABLE = [
+   -50, -40, -30, -20, -20, -30, -40, -50,
+   -30, -20, -10,   0,   0, -10, -20, -30,
+   -30, -10,  20,  30,  30,  20, -10, -30,
+   -30, -10,  30,  40,  40,  30, -10, -30,
+   -30, -10,  30,  40,  40,  30, -10, -30,
+   -30, -10,  20,  30,  30,  20, -10, -30,
+   -30, -30,   0,   0,   0,   0, -30, -30,
+   -50, -30, -30, -30, -30, -30, -30, -50,
+]
+# fmt: on
+
+MIDDLEGAME_TABLES = {
+    PAWN: PAWN_TABLE,
+    KNIGHT: KNIGHT_TABLE,
+    BISHOP: BISHOP_TABLE,
+    ROOK: ROOK_TABLE,
+    QUEEN: QUEEN_TABLE,
+    KING: KING_MIDDLEGAME_TABLE,
+}
+ENDGAME_TABLES = {**MIDDLEGAME_TABLES, KING: KING_ENDGAME_TABLE}
+
+
+def _square_scores(tables):
+    """
+    Fold material and piece-square values into one signed table per piece code,
+    positive for white and negative for black.
+    """
+    scores = [[0] * 64 for _ in range(16)]
+    for kind, table in tables.items():
+        for sq in range(64):
+            scores[WHITE << 3 | kind][sq] = PIECE_VALUES[kind] + table[sq]
+            scores[BLACK << 3 | kind][sq] = -(PIECE_VALUES[kind] + table[sq ^ 56])
+    return scores
+
+
+# MIDDLEGAME_SCORES[code][sq] is the middlegame value of a piece on a square
+MIDDLEGAME_SCORES = _square_scores(MIDDLEGAME_TABLES)
+ENDGAME_SCORES = _square_scores(ENDGAME_TABLES)
+
+# PHASE_SCORES[code] is how much a piece counts towards the game phase
+PHASE_SCORES = [PHASE_WEIGHTS.get(code & 7, 0) for code in range(16)]
@@ -1,28 +1,84 @@
-import pygame
+import time
+
+import instrumentation
+from sprites import get_sprite
+
+
+def slide_moves(color, position, board, directions):
+    """
+    Walk each direction from a square until the edge of the board or a piece.
+    :param color: the color of the sliding piece
+    :param position: the current position of the piece as (row, col)
+    :param board: the current state of the board
+    :param directions: the (row, col) steps the piece slides along
+    :return: a list of legal moves as (row, col) tuples
+    """
+    row, col = position
+    legal_moves = []
+
+    for dr, dc in directions:
+        for i in range(1, 8):
+            r, c = row + dr * i, col + dc * i
+            if 0 <= r < 8 and 0 <= c < 8:
+                target_piece = board.board[r][c]
+                if target_piece is None:
+                    legal_moves.append((r, c))
+                elif target_piece.color != color:
+                    legal_moves.append((r, c))
+                    break
+                else:
+                    break
+            else:
+                break
 
-# Define the size of the squares on the chessboard
-WINDOW_SIZE = (512, 512)
-square_size = WINDOW_SIZE[0] // 8
+    return legal_moves
 
 
 # NEED TO ADD MOVING PAWN PIECE COMPLEXITY
 class Piece:
+    # Pieces keep no per-instance dict and no image of their own, so a board of
+    # them stays small. The sprite is looked up from the shared cache when drawn.
+    __slots__ = ("color", "has_moved")
+    symbol = None  # Piece letter used for the sprite name, set by each subclass
+
     def __init__(self, color):
         self.color = color
-        self.image = None
         self.has_moved = False
 
-    def load_image(self, name):
-        self.image = pygame.image.load(f"images/{name}.png")
-        self.image = pygame.transform.scale(self.image, (square_size, square_size))
+    @property
+    def image(self):
+        # Sprites are shared through the cache, so creating a piece never loads one
+        return get_sprite(self.symbol + self.color)
+
+    def get_legal_moves(self, position, board):
+        """
+        Get the legal moves for this piece at the specified position.
+        :param position: the current position of the piece as (row, col)
+        :param board: the current state of the board
+        :return: a list of legal moves as (row, col) tuples
+        """
+        if instrumentation.ENABLED:
+            start = time.perf_counter()
+            moves = self.generate_legal_moves(position, board)
+            instrumentation.observe(
+                "movegen." + type(self).__name__, time.perf_counter() - start
+            )
+            return moves
+        return self.generate_legal_moves(position, board)
+
+    def generate_legal_moves(self, position, board):
+        # The bitboard backend gives strictly legal moves. Without it, walk the
+        # squares, which gives pseudo-legal moves that may leave the king in check.
+        if board.use_bitboards:
+            return board.bitboards.moves_from(position)
+        return self.get_mailbox_moves(position, board)
 
 
 class Pawn(Piece):
-    def __init__(self, color):
-        super().__init__(color)
-        self.load_image(f"p{color}")
+    __slots__ = ()
+    symbol = "p"
 
-    def get_legal_moves(self, position, board):
+    def get_mailbox_moves(self, position, board):
         """
         Get the legal moves for a pawn on the given board at the specified position.
         :param position: the current position of the pawn as (row, col)
@@ -85,45 +141,25 @@ class Pawn(Piece):
 
 
 class Rook(Piece):
-    def __init__(self, color):
-        super().__init__(color)
-        self.load_image(f"r{color}")
+    __slots__ = ()
+    symbol = "r"
+    directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
 
-    def get_legal_moves(self, position, board):
+    def get_mailbox_moves(self, position, board):
         """
         Get the legal moves for a rook at the specified position.
         :param position: the current position of the rook as (row, col)
         :param board: the current state of the board
         :return: a list of legal moves as (row, col) tuples
         """
-        row, col = position
-        legal_moves = []
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-
-        for dr, dc in directions:
-            for i in range(1, 8):
-                r, c = row + dr * i, col + dc * i
-                if 0 <= r < 8 and 0 <= c < 8:
-                    target_piece = board.board[r][c]
-                    if target_piece is None:
-                        legal_moves.append((r, c))
-                    elif target_piece.color != self.color:
-                        legal_moves.append((r, c))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-        return legal_moves
+        return slide_moves(self.color, position, board, self.directions)
 
 
 class Knight(Piece):
-    def __init__(self, color):
-        super().__init__(color)
-        self.load_image(f"n{color}")
+    __slots__ = ()
+    symbol = "n"
 
-    def get_legal_moves(self, position, board):
+    def get_mailbox_moves(self, position, board):
         """
         Get the legal moves for a knight at the specified position.
         :param position: the current position of the knight as (row, col)
@@ -154,45 +190,26 @@ class Knight(Piece):
 
 
 class Bishop(Piece):
-    def __init__(self, color):
-        super().__init__(color)
-        self.load_image(f"b{color}")
+    __slots__ = ()
+    symbol = "b"
+    directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
 
-    def get_legal_moves(self, position, board):
+    def get_mailbox_moves(self, position, board):
         """
         Get the legal moves for a bishop at the specified position.
         :param position: the current position of the bishop as (row, col)
         :param board: the current state of the board
         :return: a list of legal moves as (row, col) tuples
         """
-        row, col = position
-        legal_moves = []
-        directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
-
-        for dr, dc in directions:
-            for i in range(1, 8):
-                r, c = row + dr * i, col + dc * i
-                if 0 <= r < 8 and 0 <= c < 8:
-                    target_piece = board.board[r][c]
-                    if target_piece is None:
-                        legal_moves.append((r, c))
-                    elif target_piece.color != self.color:
-                        legal_moves.append((r, c))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-        return legal_moves
+        return slide_moves(self.color, position, board, self.directions)
 
 
 class Queen(Piece):
-    def __init__(self, color):
-        super().__init__(color)
-        self.load_image(f"q{color}")
+    __slots__ = ()
+    symbol = "q"
+    directions = Bishop.directions + Rook.directions
 
-    def get_legal_moves(self, position, board):
+    def get_mailbox_moves(self, position, board):
         """
         Get the legal moves for a queen at the specified position.
         :param position: the current position of the queen as (row, col)
@@ -200,19 +217,19 @@ class Queen(Piece):
         :return: a list of legal moves as (row, col) tuples
         """
         # Combine the moves of a bishop and rook, since a queen can move like both
-        return Bishop(self.color).get_legal_moves(position, board) + Rook(
-            self.color
-        ).get_legal_moves(position, board)
+        return slide_moves(self.color, position, board, self.directions)
 
 
 class King(Piece):
+    __slots__ = ("in_check",)
+    symbol = "k"
+
     def __init__(self, color):
         super().__init__(color)
-        self.load_image(f"k{color}")
         self.has_moved = False
         self.in_check = False # Used to tell if the king is in check
 
-    def get_legal_moves(self, position, board):
+    def get_mailbox_moves(self, position, board):
         """
         Get the legal moves for a king at the specified position.
         :param position: the current position of the king as (row, col)
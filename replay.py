@@ -0,0 +1,238 @@
+"""
+Replay and validate recorded games in bulk, without a window.
+
+Games are read from PGN files, or from text files with one position per line in
+the form "<fen> [moves <uci> ...]". They are sent in batches to a pool of worker
+processes, which replay each one with the bitboard move generator and report
+whether every move was legal, where it first went wrong, the final position and
+the result the board shows, with the rule that ended the game. Results are
+written as JSON Lines or CSV in input order while the pool keeps working. Only a
+couple of batches per worker are read ahead of the results, so even inputs far
+larger than memory are replayed in constant memory.
+
+Neither this module nor anything it imports loads pygame, so it runs on machines
+with no display and no piece images.
+
+Usage:
+    python replay.py games.pgn --out results.jsonl
+    python replay.py positions.txt --format csv --workers 8
+"""
+
+import argparse
+import collections
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from bitboard import Position, START_FEN, parse_uci
+from adjudication import Adjudicator
+from pgn import PgnGame, read_games, parse_san
+
+FIELDS = (
+    "index",
+    "event",
+    "white",
+    "black",
+    "plies",
+    "valid",
+    "error",
+    "error_ply",
+    "claimed_result",
+    "result",
+    "termination",
+    "final_fen",
+)
+
+
+def read_fen_lines(source):
+    """
+    Read games written as one position per line, optionally followed by moves.
+    :param source: a path or an open text file
+    :return: a generator of PgnGame whose moves are UCI strings, marked by a
+        "UCI" header so they are replayed as such
+    """
+    if isinstance(source, str):
+        with open(source, encoding="utf-8") as file:
+            yield from read_fen_lines(file)
+        return
+
+    for line in source:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fen, _, moves = line.partition(" moves ")
+        yield PgnGame({"FEN": fen.strip(), "UCI": "1"}, moves.split())
+
+
+def read_input(path):
+    """Games from a PGN file, or from a FEN list for any other extension"""
+    if path.lower().endswith(".pgn"):
+        return read_games(path)
+    return read_fen_lines(path)
+
+
+def new_record(index, game):
+    """The record of a game before it is replayed: valid, with nothing played"""
+    headers = game.headers
+    return {
+        "index": index,
+        "event": headers.get("Event", ""),
+        "white": headers.get("White", ""),
+        "black": headers.get("Black", ""),
+        "plies": 0,
+        "valid": True,
+        "error": "",
+        "error_ply": None,
+        "claimed_result": game.result,
+        "result": "*",
+        "termination": "",
+        "final_fen": "",
+    }
+
+
+def replay_game(index, game):
+    """
+    Replay one game and check every move.
+    :param index: the game's number in the input, counting from 0
+    :param game: a PgnGame
+    :return: a dict with a value for each name in FIELDS; a malformed FEN or
+        move makes the game invalid, with the error and the ply it was found at
+    """
+    headers = game.headers
+    record = new_record(index, game)
+    try:
+        position = Position.from_fen(headers.get("FEN", START_FEN))
+    except ValueError as error:
+        record.update(valid=False, error=str(error), error_ply=0)
+        return record
+
+    uci = headers.get("UCI") == "1"
+    for ply, text in enumerate(game.san_moves):
+        try:
+            if uci:
+                move = parse_uci(text)
+                if move not in position.legal_moves():
+                    raise ValueError(f"Illegal move: {text!r}")
+            else:
+                move = parse_san(position, text)
+        except (ValueError, KeyError) as error:
+            record.update(valid=False, error=str(error), error_ply=ply)
+            break
+        position.push(move)
+        record["plies"] = ply + 1
+
+    outcome = Adjudicator(position).result()
+    if outcome is not None:
+        record["result"], record["termination"] = outcome
+    record["final_fen"] = position.fen()
+    return record
+
+
+def replay_batch(batch):
+    """
+    Worker entry point: replay a batch of (index, game) pairs. A game that fails
+    in a way replay_game does not foresee is reported as invalid, so one bad
+    record never stops the run.
+    """
+    records = []
+    for index, game in batch:
+        try:
+            records.append(replay_game(index, game))
+        except Exception as error:
+            record = new_record(index, game)
+            record.update(valid=False, error=f"{type(error).__name__}: {error}")
+            records.append(record)
+    return records
+
+
+def batched(games, size):
+    """Group games into lists of (index, game) pairs"""
+    numbered = enumerate(games)
+    while True:
+        batch = list(itertools.islice(numbered, size))
+        if not batch:
+            return
+        yield batch
+
+
+def run(games, out, output_format="jsonl", workers=None, batch_size=64):
+    """
+    Replay games across a process pool, writing each result as it comes in.
+    :param games: an iterable of PgnGame, consumed lazily
+    :param out: the text file to write the results to
+    :param output_format: "jsonl" or "csv"
+    :param workers: the number of worker processes, one per core by default
+    :param batch_size: the games sent to a worker at a time
+    :return: a dict with the games replayed, how many were invalid, the time
+        taken and the games per second
+    """
+    if output_format == "csv":
+        writer = csv.DictWriter(out, FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+
+        def write(record):
+            out.write(json.dumps(record) + "\n")
+
+    count = invalid = 0
+
+    def write_batch(records):
+        nonlocal count, invalid
+        for record in records:
+            write(record)
+            invalid += not record["valid"]
+        count += len(records)
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers) as pool:
+        # Keep two batches a worker in flight: the next batch is only read from
+        # the input once the oldest one is written, in input order
+        pending = collections.deque()
+        for batch in batched(games, batch_size):
+            pending.append(pool.apply_async(replay_batch, (batch,)))
+            if len(pending) >= 2 * workers:
+                write_batch(pending.popleft().get())
+        while pending:
+            write_batch(pending.popleft().get())
+    elapsed = time.perf_counter() - start
+    return {
+        "games": count,
+        "invalid": invalid,
+        "time": elapsed,
+        "games_per_second": count / elapsed if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay and validate games")
+    parser.add_argument("inputs", nargs="+", help="PGN files or FEN lists")
+    parser.add_argument("--out", help="result file, standard output by default")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--workers", type=int, help="worker processes")
+    parser.add_argument("--batch", type=int, default=64, help="games per batch")
+    args = parser.parse_args(argv)
+
+    games = itertools.chain.from_iterable(read_input(path) for path in args.inputs)
+    out = open(args.out, "w", newline="") if args.out else sys.stdout
+    try:
+        stats = run(games, out, args.format, args.workers, args.batch)
+    finally:
+        if args.out:
+            out.close()
+    print(
+        f"{stats['games']} games, {stats['invalid']} invalid, "
+        f"{stats['time']:.2f}s, {stats['games_per_second']:,.0f} games/s",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""
+A multiplayer game server.
+
+Players connect over TCP and speak JSON, one message per line. The server holds
+every game as a GameState, so it checks each move against the rules itself and
+runs both clocks with the same timer logic as Game, reading them from its own
+monotonic clock. Everything runs on one asyncio event loop: a game is a small
+record and a connection costs one task, so one process holds thousands of games.
+A connection may play any number of games at once, even both sides of one.
+
+Messages a client sends:
+    {"type": "seek", "time": 600}           wait for an opponent, 600 s each
+    {"type": "move", "game": 7, "move": "e2e4"}
+    {"type": "resign", "game": 7}
+Messages the server sends:
+    {"type": "start", "game": 7, "color": "w", "fen": "...", "time": 600}
+    {"type": "move", "game": 7, "move": "e2e4", "fen": "...",
+     "white_time": 598.2, "black_time": 600.0}
+    {"type": "over", "game": 7, "result": "1-0", "reason": "..."}
+    {"type": "error", "message": "..."}
+
+Usage:
+    python server.py --port 8765
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from game_state import GameState
+
+DEFAULT_PORT = 8765
+MAX_LINE = 1 << 16  # Longest message a client may send, in bytes
+COLORS = ("w", "b")
+
+
+def _ticks():
+    """Milliseconds on a monotonic clock, what GameState reads the time from"""
+    return int(time.monotonic() * 1000)
+
+
+async def _discard(reader):
+    """Read and drop what a client sends until it closes its side"""
+    while await reader.read(MAX_LINE):
+        pass
+
+
+class Connection:
+    __slots__ = ("writer", "games")
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.games = set()  # Ids of the games this connection plays in
+
+    def send(self, message):
+        """Write a message as one JSON line, without waiting for it to be sent"""
+        if not self.writer.is_closing():
+            self.writer.write(json.dumps(message).encode() + b"\n")
+
+
+class ServerGame:
+    __slots__ = ("id", "state", "players")
+
+    def __init__(self, game_id, state, players):
+        self.id = game_id
+        self.state = state
+        self.players = players  # Connection of white, then of black
+
+    def broadcast(self, message):
+        for connection in set(self.players):
+            connection.send(message)
+
+
+class GameServer:
+    def __init__(self, sweep_interval=0.5):
+        """
+        :param sweep_interval: seconds between checks for flags that fall while
+            the side to move is not moving
+        """
+        self.games = {}
+        self.seeks = {}  # Clock in seconds to the connection waiting for a game
+        self.next_id = 1
+        self.sweep_interval = sweep_interval
+        self.moves = 0
+
+    async def handle(self, reader, writer):
+        """Serve one connection until it closes"""
+        connection = Connection(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # A line over the limit ends the connection. Say why, then
+                    # read out what the client still sends before closing, so the
+                    # reply is not lost to a reset.
+                    connection.send(
+                        {"type": "error", "message": f"Message over {MAX_LINE} bytes"}
+                    )
+                    writer.write_eof()
+                    try:
+                        await asyncio.wait_for(_discard(reader), 1)
+                    except asyncio.TimeoutError:
+                        pass
+                    break
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    self.dispatch(connection, message)
+                except Exception as error:
+                    # A bad message gets an error back, it never drops the player
+                    connection.send({"type": "error", "message": str(error)})
+                # Apply backpressure only once a line has been handled
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.disconnect(connection)
+            writer.close()
+
+    def dispatch(self, connection, message):
+        kind = message["type"]
+        if kind == "seek":
+            self.seek(connection, float(message.get("time", 600)))
+        elif kind == "move":
+            self.move(connection, message["game"], message["move"])
+        elif kind == "resign":
+            self.resign(connection, message["game"])
+        else:
+            raise ValueError(f"Unknown message type: {kind!r}")
+
+    def seek(self, connection, clock):
+        """Pair a connection with the one waiting for the same clock, or wait"""
+        opponent = self.seeks.pop(clock, None)
+        if opponent is None or opponent.writer.is_closing():
+            self.seeks[clock] = connection
+            return
+        game = ServerGame(
+            self.next_id,
+            GameState(max_turn_time=clock, get_ticks=_ticks),
+            (opponent, connection),
+        )
+        self.next_id += 1
+        self.games[game.id] = game
+        fen = game.state.position.fen()
+        for color, player in zip(COLORS, game.players):
+            player.games.add(game.id)
+            player.send(
+                {
+                    "type": "start",
+                    "game": game.id,
+                    "color": color,
+                    "fen": fen,
+                    "time": clock,
+                }
+            )
+
+    def find_game(self, connection, game_id):
+        game = self.games.get(game_id)
+        if game is None or connection not in game.players:
+            raise ValueError(f"Not playing game {game_id!r}")
+        return game
+
+    def move(self, connection, game_id, text):
+        """Check and play a move, and tell both players"""
+        game = self.find_game(connection, game_id)
+        state = game.state
+        if game.players[0 if state.turn == "white" else 1] is not connection:
+            raise ValueError("Not your turn")
+        state.update_timer()
+        if not state.check_for_time_up():
+            self.finish(game)
+            return
+        running = state.play_uci(text)
+        self.moves += 1
+        game.broadcast(
+            {
+                "type": "move",
+                "game": game.id,
+                "move": text,
+                "fen": state.position.fen(),
+                "white_time": round(state.white_total_time, 3),
+                "black_time": round(state.black_total_time, 3),
+            }
+        )
+        if not running:
+            self.finish(game)
+
+    def resign(self, connection, game_id):
+        game = self.find_game(connection, game_id)
+        state = game.state
+        # With both sides on one connection, the side to move resigns
+        if game.players[0] is game.players[1]:
+            loser = state.turn[0]
+        else:
+            loser = "w" if game.players[0] is connection else "b"
+        state.result = "0-1" if loser == "w" else "1-0"
+        state.announce(f"{'White' if loser == 'w' else 'Black'} resigns.")
+        self.finish(game)
+
+    def finish(self, game):
+        """Tell both players the result and forget the game"""
+        game.broadcast(
+            {
+                "type": "over",
+                "game": game.id,
+                "result": game.state.result,
+                "reason": game.state.message,
+            }
+        )
+        del self.games[game.id]
+        for player in game.players:
+            player.games.discard(game.id)
+
+    def disconnect(self, connection):
+        """A player who leaves loses the games still going, unless alone in them"""
+        for clock, waiting in list(self.seeks.items()):
+            if waiting is connection:
+                del self.seeks[clock]
+        for game_id in list(connection.games):
+            game = self.games[game_id]
+            if game.players[0] is not game.players[1]:
+                left = "w" if game.players[0] is connection else "b"
+                game.state.result = "0-1" if left == "w" else "1-0"
+                game.state.announce("Opponent disconnected.")
+            self.finish(game)
+
+    async def sweep(self):
+        """Flag sides whose time ran out while it was their move"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            for game in list(self.games.values()):
+                game.state.update_timer()
+                if not game.state.check_for_time_up():
+                    self.finish(game)
+
+    async def report(self, interval, out=sys.stdout):
+        """Print the games in progress and the move rate every interval"""
+        moves, last = self.moves, time.perf_counter()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.perf_counter()
+            print(
+                f"{len(self.games)} games, {len(self.seeks)} waiting, "
+                f"{(self.moves - moves) / (now - last):,.0f} moves/s",
+                file=out,
+            )
+            moves, last = self.moves, now
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, report_interval=None):
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+        tasks = [asyncio.create_task(self.sweep())]
+        if report_interval:
+            tasks.append(asyncio.create_task(self.report(report_interval)))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host multiplayer games")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port")
+    parser.add_argument(
+        "--report", type=float, default=5, help="seconds between status lines"
+    )
+    args = parser.parse_args(argv)
+    print(f"listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(GameServer().serve(args.host, args.port, args.report))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
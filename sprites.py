@@ -0,0 +1,40 @@
+import pygame
+
+import instrumentation
+
+# Define the size of the squares on the chessboard
+WINDOW_SIZE = (512, 512)
+square_size = WINDOW_SIZE[0] // 8
+
+# Image names are the piece letter followed by the color, e.g. "qw" or "nb"
+SPRITE_NAMES = [kind + color for color in "wb" for kind in "prnbqk"]
+
+# Process-wide cache of scaled piece sprites, shared by every piece instance
+_sprites = {}
+
+
+def get_sprite(name):
+    """
+    Get the scaled sprite for a piece, loading it from disk only the first time.
+    :param name: the image name, piece letter followed by color (e.g. "qw")
+    :return: the shared pygame Surface for that piece
+    """
+    sprite = _sprites.get(name)
+    if instrumentation.ENABLED:
+        instrumentation.count("sprites.miss" if sprite is None else "sprites.hit")
+    if sprite is None:
+        sprite = pygame.image.load(f"images/{name}.png")
+        sprite = pygame.transform.scale(sprite, (square_size, square_size))
+        _sprites[name] = sprite
+    return sprite
+
+
+def preload_sprites():
+    """Load and scale all 12 piece sprites up front so no frame pays for it later"""
+    for name in SPRITE_NAMES:
+        get_sprite(name)
+
+
+def clear_sprites():
+    """Drop every cached sprite, e.g. after the square size has changed"""
+    _sprites.clear()
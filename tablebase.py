@@ -0,0 +1,623 @@
+"""
+Endgame tablebases for a king and up to a few pieces against a lone king.
+
+Tables are generated by retrograde analysis. Checkmates are found first. Then the
+analysis works backwards from them one ply at a time: a position where the strong
+side can move into a lost position is won, and a position where every move of the
+lone king leads to a won one is lost. Every position ends up with its exact
+distance to mate in plies, or as a draw. A capture or a promotion leaves the table;
+its result comes from the smaller table it lands in, so those are generated first.
+
+Positions are stored with the strong side as white. Without pawns, the board is
+turned and mirrored so the strong king is in the a1-d1-d4 triangle; with pawns it
+is only mirrored onto the a-d files. Each table is a file of one byte per position:
+0 for a draw, 255 for an illegal position, otherwise the distance to mate plus one.
+A probe computes the position's index and reads that byte from the memory-mapped
+file, so probing is constant time and the tables are never read in whole.
+
+The initial scan and the search for the predecessors of each ply's new results
+are split across a process pool.
+
+Usage:
+    python tablebase.py generate KQK KRK KPK KBNK --dir tablebases
+    python tablebase.py probe --fen "8/8/8/4k3/8/8/8/4K2R w - - 0 1"
+"""
+
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from array import array
+
+from bitboard import (
+    Position,
+    WHITE,
+    BLACK,
+    PAWN,
+    KNIGHT,
+    BISHOP,
+    ROOK,
+    QUEEN,
+    KING,
+    KNIGHT_ATTACKS,
+    KING_ATTACKS,
+    PAWN_ATTACKS,
+    rook_attacks,
+    bishop_attacks,
+    queen_attacks,
+    iter_squares,
+)
+
+DEFAULT_TABLES = ("KQK", "KRK", "KPK", "KBNK")
+KIND_LETTERS = {QUEEN: "Q", ROOK: "R", BISHOP: "B", KNIGHT: "N", PAWN: "P"}
+LETTER_KINDS = {letter: kind for kind, letter in KIND_LETTERS.items()}
+
+STRONG, WEAK = 0, 1  # Side to move in a table index; the strong side is white
+DRAW, ILLEGAL = 0, 255
+ESCAPE = 255  # Move counter of a position the lone king can save
+
+HEADER = struct.Struct("<4s8sI")  # magic, table name, number of positions
+MAGIC = b"CTB1"
+EXTENSION = ".ctb"
+CHUNK = 1 << 14  # Positions per task handed to a worker
+
+
+def table_name(kinds):
+    """The name of the table for the strong side's pieces, such as "KBNK" """
+    return (
+        "K" + "".join(KIND_LETTERS[kind] for kind in sorted(kinds, reverse=True)) + "K"
+    )
+
+
+def parse_name(name):
+    """The strong side's piece kinds in a table name, strongest first"""
+    if len(name) < 3 or name[0] != "K" or name[-1] != "K":
+        raise ValueError(f"Invalid table name: {name!r}")
+    try:
+        kinds = [LETTER_KINDS[letter] for letter in name[1:-1]]
+    except KeyError:
+        raise ValueError(f"Invalid table name: {name!r}") from None
+    return tuple(sorted(kinds, reverse=True))
+
+
+def dependencies(name):
+    """The smaller tables a table's captures and promotions lead into"""
+    kinds = parse_name(name)
+    found = set()
+    for i, kind in enumerate(kinds):
+        rest = kinds[:i] + kinds[i + 1 :]
+        if rest:
+            found.add(table_name(rest))
+        if kind == PAWN:
+            for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                found.add(table_name(rest + (promotion,)))
+    return found
+
+
+def generation_order(names):
+    """The tables and everything they depend on, each after its dependencies"""
+    needed, stack = set(), list(names)
+    while stack:
+        name = stack.pop()
+        if name not in needed:
+            needed.add(name)
+            stack.extend(dependencies(name))
+    # Dependencies have fewer pieces, or the same number with fewer pawns
+    return sorted(needed, key=lambda name: (len(name), name.count("P"), name))
+
+
+def _square_maps():
+    """The 8 symmetries of the board, as lists mapping each square to its image"""
+    maps = []
+    for transpose in (False, True):
+        for flip_rows in (False, True):
+            for flip_cols in (False, True):
+                square_map = []
+                for sq in range(64):
+                    row, col = divmod(sq, 8)
+                    if transpose:
+                        row, col = col, row
+                    if flip_rows:
+                        row = 7 - row
+                    if flip_cols:
+                        col = 7 - col
+                    square_map.append(row * 8 + col)
+                maps.append(square_map)
+    return maps
+
+
+SQUARE_MAPS = _square_maps()
+PAWNLESS_KINGS = [sq for sq in range(64) if sq % 8 <= 3 and 7 - sq // 8 <= sq % 8]
+# Squares on the a1-h8 diagonal, and the reflection that leaves them in place
+DIAGONAL = {sq for sq in range(64) if sq // 8 + sq % 8 == 7}
+DIAGONAL_MAP = SQUARE_MAPS[7]
+PAWN_KINGS = [sq for sq in range(64) if sq % 8 <= 3]
+
+
+class TableSpec:
+    def __init__(self, name):
+        """
+        The layout of one table: how positions map to indices and back.
+        :param name: the table name, such as "KQK"
+        """
+        self.name = name
+        self.kinds = parse_name(name)
+        # Pawns only move one way, so with pawns the board may only be mirrored
+        has_pawns = PAWN in self.kinds
+        self.has_pawns = has_pawns
+        maps = SQUARE_MAPS[:2] if has_pawns else SQUARE_MAPS
+        king_squares = PAWN_KINGS if has_pawns else PAWNLESS_KINGS
+        self.king_index = [-1] * 64
+        for i, sq in enumerate(king_squares):
+            self.king_index[sq] = i
+        self.king_squares = king_squares
+        # king_maps[sk] is the symmetry that moves a strong king on sk into place
+        self.king_maps = [
+            next(m for m in maps if self.king_index[m[sk]] >= 0) for sk in range(64)
+        ]
+        self.size = 2 * len(king_squares) * 64 ** (1 + len(self.kinds))
+
+    def index(self, stm, sk, wk, pieces):
+        """
+        The index of a position.
+        :param stm: STRONG or WEAK, the side to move
+        :param sk: the strong king's square
+        :param wk: the lone king's square
+        :param pieces: the squares of the strong side's other pieces, in the order
+            of self.kinds
+        """
+        square_map = self.king_maps[sk]
+        king = square_map[sk]
+        squares = [square_map[wk]] + [square_map[sq] for sq in pieces]
+        if king in DIAGONAL and not self.has_pawns:
+            # The reflection along the diagonal keeps the king in place, so the
+            # other squares decide which of the two images is the stored one
+            squares = min(squares, [DIAGONAL_MAP[sq] for sq in squares])
+        index = stm * len(self.king_squares) + self.king_index[king]
+        for sq in squares:
+            index = index * 64 + sq
+        return index
+
+    def position(self, index):
+        """The (stm, sk, wk, pieces) an index stands for"""
+        pieces = []
+        for _ in self.kinds:
+            index, sq = divmod(index, 64)
+            pieces.append(sq)
+        pieces.reverse()
+        index, wk = divmod(index, 64)
+        stm, king = divmod(index, len(self.king_squares))
+        return stm, self.king_squares[king], wk, pieces
+
+
+def _attacks(kinds, pieces, occupied):
+    """The squares attacked by the strong side's pieces other than its king"""
+    attacks = 0
+    for kind, sq in zip(kinds, pieces):
+        if kind == PAWN:
+            attacks |= PAWN_ATTACKS[WHITE][sq]
+        elif kind == KNIGHT:
+            attacks |= KNIGHT_ATTACKS[sq]
+        elif kind == BISHOP:
+            attacks |= bishop_attacks(sq, occupied)
+        elif kind == ROOK:
+            attacks |= rook_attacks(sq, occupied)
+        else:
+            attacks |= queen_attacks(sq, occupied)
+    return attacks
+
+
+def _occupancy(sk, wk, pieces):
+    occupied = 1 << sk | 1 << wk
+    for sq in pieces:
+        occupied |= 1 << sq
+    return occupied
+
+
+def _is_legal(spec, stm, sk, wk, pieces):
+    occupied = _occupancy(sk, wk, pieces)
+    if bin(occupied).count("1") != 2 + len(pieces):
+        return False
+    if KING_ATTACKS[sk] >> wk & 1:
+        return False
+    for kind, sq in zip(spec.kinds, pieces):
+        if kind == PAWN and not 8 <= sq < 56:
+            return False
+    # The side that just moved cannot have left its king in check
+    return stm == WEAK or not _attacks(spec.kinds, pieces, occupied) >> wk & 1
+
+
+class Tablebase:
+    def __init__(self, directory):
+        """
+        Open the tables in a directory. Each file is mapped when first probed.
+        :param directory: the directory holding the .ctb files
+        """
+        self.directory = directory
+        self.tables = {}  # Name to (spec, mapped file), or None when missing
+        # Positions with more pieces than the largest table are not looked up at
+        # all; the rest are covered only when their own table is there
+        self.max_pieces = 2
+        if os.path.isdir(directory):
+            for file_name in os.listdir(directory):
+                if file_name.endswith(EXTENSION):
+                    self.max_pieces = max(
+                        self.max_pieces, len(file_name) - len(EXTENSION)
+                    )
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table[1].close()
+        self.tables = {}
+
+    def table(self, name):
+        """The (spec, data) of a table, or None when it has not been generated"""
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + EXTENSION)
+            self.tables[name] = None
+            if os.path.exists(path):
+                with open(path, "rb") as file:
+                    data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, _, size = HEADER.unpack_from(data)
+                spec = TableSpec(name)
+                if magic != MAGIC or size != spec.size:
+                    data.close()
+                    raise ValueError(f"Corrupt tablebase file: {path!r}")
+                self.tables[name] = (spec, data)
+        return self.tables[name]
+
+    def probe_value(self, kinds, stm, sk, wk, pieces):
+        """
+        Read the stored byte for a normalized position: 0 for a draw, otherwise the
+        distance to mate plus one. A position with no pieces left is a draw.
+        :param kinds: the strong side's piece kinds, in any order
+        :param pieces: their squares, in the same order
+        :return: the byte, or None when the table was not generated
+        """
+        if not kinds:
+            return DRAW
+        order = sorted(range(len(kinds)), key=lambda i: -kinds[i])
+        table = self.table(table_name(kinds))
+        if table is None:
+            return None
+        spec, data = table
+        return data[HEADER.size + spec.index(stm, sk, wk, [pieces[i] for i in order])]
+
+    def probe(self, position):
+        """
+        Look a position up.
+        :param position: a bitboard Position
+        :return: None when no table covers it, otherwise (wdl, plies): wdl is 1 when
+            the side to move wins, -1 when it loses and 0 for a draw, and plies is
+            the distance to mate
+        """
+        if position.castling:
+            return None
+        squares = position.squares
+        pieces = {WHITE: [], BLACK: []}
+        for sq in iter_squares((position.occupied[WHITE] | position.occupied[BLACK])):
+            code = squares[sq]
+            if code & 7 != KING:
+                pieces[code >> 3].append((code & 7, sq))
+        if pieces[WHITE] and pieces[BLACK]:
+            return None
+        strong = WHITE if pieces[WHITE] else BLACK
+        if len(pieces[strong]) + 2 > self.max_pieces:
+            return None
+        # Tables have the strong side as white, so turn the board over for black
+        flip = 0 if strong == WHITE else 56
+        kinds = [kind for kind, _ in pieces[strong]]
+        value = self.probe_value(
+            kinds,
+            STRONG if position.side == strong else WEAK,
+            position.king_square(strong) ^ flip,
+            position.king_square(strong ^ 1) ^ flip,
+            [sq ^ flip for _, sq in pieces[strong]],
+        )
+        if value is None or value == ILLEGAL:
+            return None
+        if value == DRAW:
+            return 0, 0
+        return (1 if position.side == strong else -1), value - 1
+
+
+# ---------------------------------------------------------------------------
+# Generation
+# ---------------------------------------------------------------------------
+
+# Each worker process keeps the tables it has opened and the specs it has built
+_worker_state = {}
+
+
+def _worker_setup(directory):
+    _worker_state["tablebase"] = Tablebase(directory)
+    _worker_state["specs"] = {}
+
+
+def _probe_dependency(kinds, stm, sk, wk, pieces):
+    """Probe a smaller table, which generation_order has generated already"""
+    value = _worker_state["tablebase"].probe_value(kinds, stm, sk, wk, pieces)
+    if value is None:
+        raise ValueError(f"Missing tablebase: {table_name(kinds)}")
+    return value
+
+
+def _spec(name):
+    specs = _worker_state.setdefault("specs", {})
+    if name not in specs:
+        specs[name] = TableSpec(name)
+    return specs[name]
+
+
+def _scan_chunk(task):
+    """
+    Worker: classify a range of positions before the retrograde passes.
+    :return: (start, values, counters, mates, events, seeds) where values marks the
+        illegal positions, counters holds each lone king's number of moves (ESCAPE
+        when one of them saves it), mates lists the checkmates, events lists
+        (distance, index) for captures into a lost smaller table and seeds lists
+        (distance, index) for promotions into one
+    """
+    name, start, stop = task
+    spec = _spec(name)
+    kinds = spec.kinds
+    values = bytearray(stop - start)
+    counters = bytearray(stop - start)
+    mates, events, seeds = array("I"), [], []
+
+    for index in range(start, stop):
+        stm, sk, wk, pieces = spec.position(index)
+        if spec.index(stm, sk, wk, pieces) != index or not _is_legal(
+            spec, stm, sk, wk, pieces
+        ):
+            # The mirror image of a stored position is never looked up
+            values[index - start] = ILLEGAL
+            continue
+        occupied = _occupancy(sk, wk, pieces)
+
+        if stm == WEAK:
+            attacked = KING_ATTACKS[sk] | _attacks(kinds, pieces, occupied ^ 1 << wk)
+            targets = KING_ATTACKS[wk] & ~attacked
+            if not targets:
+                if attacked >> wk & 1:
+                    mates.append(index)
+                else:
+                    counters[index - start] = ESCAPE  # Stalemate
+                continue
+            # Moves into positions that are mirror images of each other count once,
+            # as the retrograde pass finds them once
+            children, count = set(), 0
+            for to in iter_squares(targets):
+                if to not in pieces:
+                    children.add(spec.index(STRONG, sk, to, pieces))
+                else:
+                    count += 1
+                    # The lone king takes a piece, and the smaller table decides
+                    i = pieces.index(to)
+                    value = _probe_dependency(
+                        kinds[:i] + kinds[i + 1 :],
+                        STRONG,
+                        sk,
+                        to,
+                        pieces[:i] + pieces[i + 1 :],
+                    )
+                    if value == DRAW:
+                        count = ESCAPE
+                        break
+                    events.append((value - 1, index))
+            if count != ESCAPE:
+                count += len(children)
+            counters[index - start] = count
+        else:
+            for i, (kind, sq) in enumerate(zip(kinds, pieces)):
+                if kind != PAWN or sq >= 16 or occupied >> (sq - 8) & 1:
+                    continue
+                for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                    value = _probe_dependency(
+                        kinds[:i] + (promotion,) + kinds[i + 1 :],
+                        WEAK,
+                        sk,
+                        wk,
+                        pieces[:i] + [sq - 8] + pieces[i + 1 :],
+                    )
+                    if value not in (DRAW, ILLEGAL):
+                        seeds.append((value, index))
+    return start, bytes(values), bytes(counters), mates, events, seeds
+
+
+def _predecessors(task):
+    """
+    Worker: the positions one ply before each of a list of newly decided ones,
+    with the other side to move. Unmoves of the strong side come before a lost
+    position for the lone king, unmoves of the lone king before a won one.
+    :return: an array of indices; a position appears once for every position in
+        the list it has a move into
+    """
+    name, stm, indices = task
+    spec = _spec(name)
+    kinds = spec.kinds
+    found = array("I")
+    for index in indices:
+        _, sk, wk, pieces = spec.position(index)
+        occupied = _occupancy(sk, wk, pieces)
+        empty = ~occupied
+
+        if stm == STRONG:
+            found.extend(
+                {
+                    spec.index(WEAK, sk, origin, pieces)
+                    for origin in iter_squares(
+                        KING_ATTACKS[wk] & empty & ~KING_ATTACKS[sk]
+                    )
+                }
+            )
+            continue
+
+        for origin in iter_squares(KING_ATTACKS[sk] & empty & ~KING_ATTACKS[wk]):
+            occupied_before = occupied ^ (1 << sk | 1 << origin)
+            if not _attacks(kinds, pieces, occupied_before) >> wk & 1:
+                found.append(spec.index(STRONG, origin, wk, pieces))
+        for i, (kind, sq) in enumerate(zip(kinds, pieces)):
+            if kind == PAWN:
+                origins = 0
+                if sq < 48 and not occupied >> (sq + 8) & 1:
+                    origins = 1 << (sq + 8)
+                    if 32 <= sq < 40 and not occupied >> (sq + 16) & 1:
+                        origins |= 1 << (sq + 16)
+            elif kind == KNIGHT:
+                origins = KNIGHT_ATTACKS[sq] & empty
+            elif kind == BISHOP:
+                origins = bishop_attacks(sq, occupied) & empty
+            elif kind == ROOK:
+                origins = rook_attacks(sq, occupied) & empty
+            else:
+                origins = queen_attacks(sq, occupied) & empty
+            for origin in iter_squares(origins):
+                before = pieces[:i] + [origin] + pieces[i + 1 :]
+                occupied_before = occupied ^ (1 << sq | 1 << origin)
+                # The lone king cannot have been left in check
+                if not _attacks(kinds, before, occupied_before) >> wk & 1:
+                    found.append(spec.index(STRONG, sk, wk, before))
+    return found
+
+
+def generate_table(name, directory, pool, workers):
+    """
+    Generate one table and write it to the directory. Its dependencies must be
+    there already.
+    :return: a dict with the positions, the won ones and the longest mate in plies
+    """
+    spec = TableSpec(name)
+    values = bytearray(spec.size)
+    counters = bytearray(spec.size)
+    buckets, events = {}, {}
+
+    tasks = [
+        (name, start, min(start + CHUNK, spec.size))
+        for start in range(0, spec.size, CHUNK)
+    ]
+    for (
+        start,
+        chunk_values,
+        chunk_counters,
+        mates,
+        chunk_events,
+        seeds,
+    ) in pool.imap_unordered(_scan_chunk, tasks):
+        values[start : start + len(chunk_values)] = chunk_values
+        counters[start : start + len(chunk_counters)] = chunk_counters
+        buckets.setdefault(0, []).extend(mates)
+        for distance, index in chunk_events:
+            events.setdefault(distance, []).append(index)
+        for distance, index in seeds:
+            buckets.setdefault(distance, []).append(index)
+
+    distance, longest, won = 0, 0, 0
+    while any(buckets.values()) or events:
+        decided = array("I")
+        for index in buckets.pop(distance, ()):
+            if values[index] == DRAW:
+                values[index] = distance + 1
+                decided.append(index)
+        if decided:
+            longest = distance
+            won += len(decided)
+        stm = WEAK if distance % 2 == 0 else STRONG
+        size = max(64, len(decided) // (workers * 4) + 1)
+        tasks = [
+            (name, stm, decided[i : i + size]) for i in range(0, len(decided), size)
+        ]
+        predecessors = pool.imap_unordered(_predecessors, tasks)
+
+        if stm == WEAK:
+            # Moving into a lost position wins in one more ply
+            bucket = buckets.setdefault(distance + 1, [])
+            for found in predecessors:
+                bucket.extend(found)
+        else:
+            # A lone king with every move now lost is lost one ply later
+            bucket = buckets.setdefault(distance + 1, [])
+            for found in [*predecessors, events.pop(distance, ())]:
+                for index in found:
+                    count = counters[index]
+                    if count != ESCAPE and values[index] == DRAW:
+                        counters[index] = count - 1
+                        if count == 1:
+                            bucket.append(index)
+        distance += 1
+        if distance >= ILLEGAL - 1:
+            raise ValueError(f"{name}: mates longer than the format can store")
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + EXTENSION)
+    with open(path + ".tmp", "wb") as file:
+        file.write(HEADER.pack(MAGIC, name.encode(), spec.size))
+        file.write(values)
+    os.replace(path + ".tmp", path)
+    return {"positions": spec.size, "decided": won, "longest": longest}
+
+
+def generate(names, directory, workers=None, force=False, out=sys.stdout):
+    """
+    Generate tables and the smaller ones they depend on, skipping those already
+    in the directory unless force is set.
+    """
+    workers = workers or os.cpu_count() or 1
+    context = multiprocessing.get_context("spawn")
+    for name in generation_order(names):
+        path = os.path.join(directory, name + EXTENSION)
+        if os.path.exists(path) and not force:
+            print(f"{name:6} already generated", file=out)
+            continue
+        start = time.perf_counter()
+        # A fresh pool for each table, so every worker opens the tables generated
+        # before it rather than remembering them as missing
+        with context.Pool(
+            workers, initializer=_worker_setup, initargs=(directory,)
+        ) as pool:
+            stats = generate_table(name, directory, pool, workers)
+        print(
+            f"{name:6} {stats['positions']:>10,} positions "
+            f"{stats['decided']:>10,} decided, longest mate {stats['longest']:3} "
+            f"plies, {time.perf_counter() - start:.1f}s",
+            file=out,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and probe endgame tables")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("generate", help="generate tables")
+    build.add_argument("tables", nargs="*", default=DEFAULT_TABLES, help="table names")
+    build.add_argument("--dir", default="tablebases", help="directory for the tables")
+    build.add_argument("--workers", type=int, help="worker processes")
+    build.add_argument(
+        "--force", action="store_true", help="regenerate existing tables"
+    )
+    probe = commands.add_parser("probe", help="look a position up")
+    probe.add_argument("--fen", required=True, help="position to look up")
+    probe.add_argument("--dir", default="tablebases", help="directory of the tables")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        generate(args.tables, args.dir, args.workers, args.force)
+        return 0
+
+    tablebase = Tablebase(args.dir)
+    result = tablebase.probe(Position.from_fen(args.fen))
+    if result is None:
+        print("not in the tablebases")
+    elif result[0] == 0:
+        print("draw")
+    else:
+        print(f"{'win' if result[0] > 0 else 'loss'}, mate in {result[1]} plies")
+    tablebase.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
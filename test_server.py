@@ -0,0 +1,72 @@
+"""
+Tests for the game server's handling of bad input, run against a server on a
+free local port.
+
+Usage:
+    python -m unittest test_server
+"""
+
+import asyncio
+import json
+import unittest
+
+from server import GameServer, MAX_LINE
+
+
+class ServerInputTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await asyncio.start_server(
+            GameServer().handle, "127.0.0.1", 0, limit=MAX_LINE
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def connect(self):
+        return await asyncio.open_connection("127.0.0.1", self.port)
+
+    async def test_oversized_line_gets_an_error_and_a_clean_close(self):
+        reader, writer = await self.connect()
+        writer.write(b'{"type": "' + b"x" * (2 * MAX_LINE) + b'"}\n')
+        await writer.drain()
+        reply = json.loads(await asyncio.wait_for(reader.readline(), 5))
+        self.assertEqual(reply["type"], "error")
+        self.assertIn("over", reply["message"])
+        # The server closes the connection after the error
+        self.assertEqual(await asyncio.wait_for(reader.read(), 5), b"")
+        writer.close()
+
+    async def test_malformed_move_gets_an_error_and_the_game_goes_on(self):
+        white_reader, white_writer = await self.connect()
+        black_reader, black_writer = await self.connect()
+        for writer in (white_writer, black_writer):
+            writer.write(b'{"type": "seek", "time": 60}\n')
+        starts = [
+            json.loads(await asyncio.wait_for(reader.readline(), 5))
+            for reader in (white_reader, black_reader)
+        ]
+        if starts[0]["color"] != "w":
+            white_reader, white_writer = black_reader, black_writer
+        game = starts[0]["game"]
+
+        for move in ("e2", "e2e4x", None):
+            white_writer.write(
+                json.dumps({"type": "move", "game": game, "move": move}).encode()
+                + b"\n"
+            )
+            reply = json.loads(await asyncio.wait_for(white_reader.readline(), 5))
+            self.assertEqual(reply["type"], "error")
+
+        white_writer.write(
+            json.dumps({"type": "move", "game": game, "move": "e2e4"}).encode() + b"\n"
+        )
+        reply = json.loads(await asyncio.wait_for(white_reader.readline(), 5))
+        self.assertEqual((reply["type"], reply["move"]), ("move", "e2e4"))
+        white_writer.close()
+        black_writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
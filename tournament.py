@@ -0,0 +1,374 @@
+"""
+Play engine-vs-engine matches without a window.
+
+Two engine configurations play each other from a suite of openings, each opening
+twice with the colors swapped. Each side has one clock for the whole game, like
+Game.max_turn_time, with an optional increment, and the engine budgets it with
+its TimeManager just as it does against a player. Games run concurrently on a
+pool of worker processes and are adjudicated by the rules, or by the endgame
+tablebases when given. Finished games are written to PGN, and the match ends with
+the Elo difference and its error bars, games per second and how busy the workers
+kept the CPU.
+
+Usage:
+    python tournament.py --engine base --engine big:hash=64 --games 100 --time 10
+    python tournament.py --openings suite.pgn --opening-plies 8 --pgn match.pgn
+"""
+
+import argparse
+import datetime
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+from bitboard import Position, START_FEN, WHITE, parse_uci
+from engine import Engine, TimeManager, MAX_PLY
+from book import OpeningBook
+from tablebase import Tablebase
+from adjudication import Adjudicator
+from pgn import PgnGame, parse_san
+from replay import read_input
+
+# A few common openings, six plies deep, used when no suite is given
+DEFAULT_OPENINGS = (
+    "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6",
+    "e2e4 c7c5 g1f3 d7d6 d2d4 c5d4",
+    "e2e4 e7e6 d2d4 d7d5 b1c3 g8f6",
+    "e2e4 c7c6 d2d4 d7d5 b1c3 d5e4",
+    "d2d4 d7d5 c2c4 e7e6 b1c3 g8f6",
+    "d2d4 g8f6 c2c4 g7g6 b1c3 f8g7",
+    "c2c4 e7e5 b1c3 g8f6 g1f3 b8c6",
+    "g1f3 d7d5 g2g3 g8f6 f1g2 e7e6",
+)
+
+ENGINE_OPTIONS = {
+    "hash": int,
+    "depth": int,
+    "nodes": int,
+    "book": str,
+    "tablebases": str,
+}
+
+SCORES = {"1-0": 1.0, "1/2-1/2": 0.5, "0-1": 0.0}
+
+
+def parse_engine(text):
+    """
+    Read an engine configuration written as "name:option=value,...".
+    :param text: such as "big:hash=64,depth=6"; the options are those in
+        ENGINE_OPTIONS
+    :return: a (name, options) pair
+    :raises ValueError: for an unknown option or a bad value
+    """
+    name, _, rest = text.partition(":")
+    options = {"hash": 16}
+    for item in filter(None, rest.split(",")):
+        key, _, value = item.partition("=")
+        if key not in ENGINE_OPTIONS:
+            raise ValueError(f"Unknown engine option: {key!r}")
+        options[key] = ENGINE_OPTIONS[key](value)
+    return name or "engine", options
+
+
+def load_openings(path=None, plies=None):
+    """
+    Read an opening suite.
+    :param path: a PGN file or a FEN list as replay.py reads them, None for
+        DEFAULT_OPENINGS
+    :param plies: keep at most this many moves of each opening
+    :return: a list of (fen, moves) pairs, the moves packed
+    :raises ValueError: if an opening has an illegal move
+    """
+    if path is None:
+        games = [PgnGame({"UCI": "1"}, line.split()) for line in DEFAULT_OPENINGS]
+    else:
+        games = read_input(path)
+
+    openings = []
+    for game in games:
+        fen = game.headers.get("FEN", START_FEN)
+        position = Position.from_fen(fen)
+        moves = []
+        for text in game.san_moves[:plies]:
+            if game.headers.get("UCI") == "1":
+                move = parse_uci(text)
+                if move not in position.legal_moves():
+                    raise ValueError(f"Illegal move in opening: {text!r}")
+            else:
+                move = parse_san(position, text)
+            position.push(move)
+            moves.append(move)
+        openings.append((fen, moves))
+    return openings
+
+
+# Each worker process keeps its engines between games, and its tablebase
+_worker_state = {}
+
+
+def _worker_setup(tablebase_dir):
+    _worker_state["engines"] = {}
+    _worker_state["tablebase"] = Tablebase(tablebase_dir) if tablebase_dir else None
+
+
+def _engine(slot, options):
+    """The worker's engine for one side of the match, ready for a new game"""
+    engines = _worker_state["engines"]
+    key = (slot, tuple(sorted(options.items())))
+    if key not in engines:
+        engines[key] = Engine(
+            options["hash"],
+            book=OpeningBook(options["book"]) if options.get("book") else None,
+            tablebase=(
+                Tablebase(options["tablebases"]) if options.get("tablebases") else None
+            ),
+        )
+    engine = engines[key]
+    engine.new_game()
+    return engine
+
+
+def play_game(task):
+    """
+    Worker: play one game.
+    :param task: (round, players, fen, opening moves, clock, increment, max
+        plies); players holds the (slot, name, options) of white and then
+        black, where slot is the engine's place in the match
+    :return: a dict with the round, the players, the opening, the moves, the
+        result and termination, the nodes searched and the CPU seconds used
+    """
+    number, players, fen, opening, clock, increment, max_plies = task
+    cpu_start = time.process_time()
+    tablebase = _worker_state["tablebase"]
+    engines = [_engine(slot, options) for slot, _, options in players]
+    clocks = [clock, clock]
+
+    position = Position.from_fen(fen)
+    adjudicator = Adjudicator(position, tablebase)
+    for move in opening:
+        adjudicator.push(move)
+    moves, nodes = [], 0
+
+    outcome = adjudicator.result()
+    while outcome is None:
+        if len(moves) >= max_plies:
+            outcome = "1/2-1/2", "move limit"
+            break
+        side = position.side
+        options = players[side][2]
+        time_manager = TimeManager(clocks[side], increment)
+        info = engines[side].search(
+            position,
+            options.get("depth", MAX_PLY),
+            time_manager,
+            options.get("nodes"),
+        )
+        clocks[side] -= time_manager.elapsed()
+        if clocks[side] <= 0:
+            outcome = ("0-1" if side == WHITE else "1-0"), "time forfeit"
+            break
+        clocks[side] += increment
+        nodes += info["nodes"]
+        adjudicator.push(info["move"])
+        moves.append(info["move"])
+        outcome = adjudicator.result()
+
+    return {
+        "round": number,
+        "white": players[0][:2],
+        "black": players[1][:2],
+        "fen": fen,
+        "opening": opening,
+        "moves": moves,
+        "result": outcome[0],
+        "termination": outcome[1],
+        "nodes": nodes,
+        "cpu": time.process_time() - cpu_start,
+    }
+
+
+def elo_difference(wins, draws, losses):
+    """
+    The Elo difference a match score implies, with its 95% error bars.
+    :return: (elo, margin); both are infinite when one side scored everything
+    """
+    games = wins + draws + losses
+    if not games:
+        return 0.0, math.inf
+    score = (wins + draws / 2) / games
+    if score in (0.0, 1.0):
+        return math.copysign(math.inf, score - 0.5), math.inf
+
+    def elo(p):
+        return -400 * math.log10(1 / p - 1)
+
+    # The standard error of the mean score over games
+    deviation = math.sqrt(
+        (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score**2)
+        / games
+    )
+    error = 1.96 * deviation / math.sqrt(games)
+    low, high = max(score - error, 1e-6), min(score + error, 1 - 1e-6)
+    return elo(score), (elo(high) - elo(low)) / 2
+
+
+def run(
+    players,
+    games,
+    openings,
+    clock,
+    increment=0.0,
+    workers=None,
+    tablebase_dir=None,
+    max_plies=400,
+    pgn_path=None,
+    out=sys.stdout,
+):
+    """
+    Play a match across a process pool.
+    :param players: the (name, options) of the two engines
+    :param games: the number of games to play
+    :param openings: (fen, moves) pairs; each is played twice with the colors
+        swapped, and the suite is repeated if there are more games than that
+    :param clock: seconds on each side's clock at the start
+    :param increment: seconds added to a clock after each move
+    :param workers: the number of worker processes, one per core by default
+    :param tablebase_dir: an optional directory of tables to adjudicate with
+    :param max_plies: a game still going after this many plies is drawn
+    :param pgn_path: an optional PGN file to write the games to as they finish
+    :param out: where to print a line for every finished game
+    :return: a dict with the wins, draws and losses of the first engine, the
+        Elo difference and margin, the time taken, games per second, CPU use and
+        nodes per second
+    """
+    workers = workers or os.cpu_count() or 1
+    tasks = []
+    for number in range(games):
+        fen, moves = openings[number // 2 % len(openings)]
+        first, second = (0, 1) if number % 2 == 0 else (1, 0)
+        pairing = tuple((slot, *players[slot]) for slot in (first, second))
+        tasks.append((number + 1, pairing, fen, moves, clock, increment, max_plies))
+
+    pgn_file = open(pgn_path, "w", encoding="utf-8") if pgn_path else None
+    wins = draws = losses = nodes = 0
+    cpu = 0.0
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    try:
+        with context.Pool(
+            workers, initializer=_worker_setup, initargs=(tablebase_dir,)
+        ) as pool:
+            for done, record in enumerate(pool.imap_unordered(play_game, tasks), 1):
+                # Scores are counted for the first engine, whichever color it had
+                score = SCORES[record["result"]]
+                if record["white"][0] != 0:
+                    score = 1 - score
+                wins += score == 1.0
+                draws += score == 0.5
+                losses += score == 0.0
+                nodes += record["nodes"]
+                cpu += record["cpu"]
+                if pgn_file is not None:
+                    pgn_file.write(to_pgn(record, clock, increment).to_pgn())
+                print(
+                    f"game {done}/{games} {record['white'][1]} vs "
+                    f"{record['black'][1]}: {record['result']} "
+                    f"({record['termination']}), "
+                    f"score {wins + draws / 2:g}-{losses + draws / 2:g}",
+                    file=out,
+                )
+    finally:
+        if pgn_file is not None:
+            pgn_file.close()
+    elapsed = time.perf_counter() - start
+
+    elo, margin = elo_difference(wins, draws, losses)
+    return {
+        "wins": wins,
+        "draws": draws,
+        "losses": losses,
+        "elo": elo,
+        "margin": margin,
+        "time": elapsed,
+        "games_per_second": games / elapsed if elapsed else 0.0,
+        "cpu_use": cpu / (elapsed * workers) if elapsed else 0.0,
+        "nps": nodes / cpu if cpu else 0.0,
+    }
+
+
+def to_pgn(record, clock, increment):
+    """A finished game as a PgnGame, with the opening's moves included"""
+    return PgnGame.from_moves(
+        record["opening"] + record["moves"],
+        {
+            "Event": "Engine match",
+            "Date": datetime.date.today().strftime("%Y.%m.%d"),
+            "Round": str(record["round"]),
+            "White": record["white"][1],
+            "Black": record["black"][1],
+            "TimeControl": f"{clock:g}+{increment:g}",
+            "Termination": record["termination"],
+        },
+        fen=record["fen"],
+        result=record["result"],
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play an engine match")
+    parser.add_argument(
+        "--engine",
+        action="append",
+        help='an engine as "name:option=value,...", given twice',
+    )
+    parser.add_argument("--games", type=int, default=16, help="games to play")
+    parser.add_argument("--time", type=float, default=10, help="seconds per side")
+    parser.add_argument("--increment", type=float, default=0.1, help="per move")
+    parser.add_argument("--openings", help="PGN or FEN list of openings")
+    parser.add_argument("--opening-plies", type=int, help="moves kept per opening")
+    parser.add_argument("--tablebases", help="directory of tables to adjudicate by")
+    parser.add_argument("--max-plies", type=int, default=400, help="draw after")
+    parser.add_argument("--workers", type=int, help="games played at once")
+    parser.add_argument("--pgn", help="PGN file to write the games to")
+    args = parser.parse_args(argv)
+
+    specs = args.engine or ["engine"]
+    if len(specs) == 1:
+        specs.append(specs[0])  # An engine against itself, as a sanity check
+    if len(specs) != 2:
+        parser.error("give --engine once or twice")
+    try:
+        players = [parse_engine(spec) for spec in specs]
+    except ValueError as error:
+        parser.error(str(error))
+    if players[0][0] == players[1][0]:
+        players[1] = (players[1][0] + "-2", players[1][1])
+
+    openings = load_openings(args.openings, args.opening_plies)
+    stats = run(
+        players,
+        args.games,
+        openings,
+        args.time,
+        args.increment,
+        args.workers,
+        args.tablebases,
+        args.max_plies,
+        args.pgn,
+    )
+    print(
+        f"{players[0][0]} vs {players[1][0]}: +{stats['wins']} ={stats['draws']} "
+        f"-{stats['losses']}, Elo {stats['elo']:+.1f} +/- {stats['margin']:.1f}"
+    )
+    print(
+        f"{args.games} games in {stats['time']:.1f}s, "
+        f"{stats['games_per_second']:.2f} games/s, "
+        f"CPU use {100 * stats['cpu_use']:.0f}%, {stats['nps']:,.0f} nodes/s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+A fixed-size transposition table keyed by Zobrist key.
+
+Entries live in one flat array of 64-bit words, so the table's memory is set once
+by its budget and never grows. Each entry is two words: the key XOR the data, and
+the data. A probe only trusts an entry when the two XOR back to its key, which
+also catches entries torn by another process writing to a shared buffer.
+
+The data word is packed as:
+    bits  0-7   depth
+    bits  8-9   bound (EXACT, LOWER or UPPER)
+    bits 10-15  age, the search generation that stored it
+    bits 16-31  best move
+    bits 32-47  score, offset by SCORE_OFFSET so it is never negative
+    bits 48-63  unused
+Perft and other non-search uses may put their own payload in bits 16-63.
+"""
+
+from array import array
+
+EXACT, LOWER, UPPER = 0, 1, 2
+SCORE_OFFSET = 1 << 15
+
+BUCKET_SIZE = 4  # Entries probed for a key, kept together in one bucket
+ENTRY_WORDS = 2
+ENTRY_BYTES = ENTRY_WORDS * 8
+
+
+def table_words(size_mb):
+    """
+    The number of 64-bit words a table with the given memory budget uses.
+    The bucket count is rounded down to a power of two so indexing is a mask.
+    """
+    buckets = max(1, size_mb * 1024 * 1024 // (ENTRY_BYTES * BUCKET_SIZE))
+    buckets = 1 << (buckets.bit_length() - 1)
+    return buckets * BUCKET_SIZE * ENTRY_WORDS
+
+
+class TranspositionTable:
+    def __init__(self, size_mb=16, buffer=None):
+        """
+        Create a table.
+        :param size_mb: the memory budget in megabytes
+        :param buffer: an optional writable buffer to keep the entries in, such as
+            a multiprocessing.shared_memory buffer, sized with table_words
+        """
+        words = table_words(size_mb)
+        if buffer is None:
+            self.table = array("Q", bytes(words * 8))
+        else:
+            self.table = memoryview(buffer).cast("Q")[:words]
+        self.bucket_mask = words // (BUCKET_SIZE * ENTRY_WORDS) - 1
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        """Start a new generation, older entries become the first to be replaced"""
+        self.age = (self.age + 1) & 63
+
+    def clear(self):
+        """Empty the table without giving its memory back"""
+        self.table[:] = array("Q", bytes(len(self.table) * 8))
+        self.age = 0
+
+    def probe_raw(self, key):
+        """
+        Look a key up.
+        :return: the data word stored for the key, or None
+        """
+        table = self.table
+        self.probes += 1
+        index = (key & self.bucket_mask) * (BUCKET_SIZE * ENTRY_WORDS)
+        for i in range(index, index + BUCKET_SIZE * ENTRY_WORDS, ENTRY_WORDS):
+            data = table[i + 1]
+            if table[i] ^ data == key and data:
+                self.hits += 1
+                return data
+        return None
+
+    def store_raw(self, key, data):
+        """
+        Store a data word for a key. The low 8 bits of data are its depth, which
+        the replacement policy uses, and the age bits are filled in here.
+
+        An entry for the same key is overwritten. Otherwise the entry replaced is
+        the one with the lowest depth, counting each generation of age as eight
+        plies less, so deep results survive until they are stale.
+        """
+        table = self.table
+        data = (data & ~(63 << 10)) | self.age << 10
+        index = (key & self.bucket_mask) * (BUCKET_SIZE * ENTRY_WORDS)
+        victim, victim_worth = index, None
+        for i in range(index, index + BUCKET_SIZE * ENTRY_WORDS, ENTRY_WORDS):
+            old = table[i + 1]
+            if not old or table[i] ^ old == key:
+                victim = i
+                break
+            worth = (old & 0xFF) - 8 * ((self.age - (old >> 10)) & 63)
+            if victim_worth is None or worth < victim_worth:
+                victim, victim_worth = i, worth
+        table[victim] = key ^ data
+        table[victim + 1] = data
+
+    def probe(self, key):
+        """
+        Look up a search result.
+        :return: (move, score, depth, bound), or None when the key is not stored
+        """
+        data = self.probe_raw(key)
+        if data is None:
+            return None
+        return (
+            data >> 16 & 0xFFFF,
+            (data >> 32 & 0xFFFF) - SCORE_OFFSET,
+            data & 0xFF,
+            data >> 8 & 3,
+        )
+
+    def store(self, key, move, score, depth, bound):
+        """
+        Store a search result.
+        :param move: the best move found, or 0
+        :param score: the score, within +/- SCORE_OFFSET
+        :param depth: the depth searched, 0-255
+        :param bound: EXACT, LOWER or UPPER
+        """
+        self.store_raw(
+            key,
+            max(depth, 0) | bound << 8 | move << 16 | (score + SCORE_OFFSET) << 32,
+        )
+
+    def hashfull(self):
+        """How full the table is in permille, sampled from the first entries"""
+        table = self.table
+        sample = min(1000, len(table) // ENTRY_WORDS)
+        used = sum(
+            1
+            for i in range(0, sample * ENTRY_WORDS, ENTRY_WORDS)
+            if table[i + 1] and (table[i + 1] >> 10 & 63) == self.age
+        )
+        return used * 1000 // sample
+
+    def hit_rate(self):
+        """The fraction of probes that found their key"""
+        return self.hits / self.probes if self.probes else 0.0